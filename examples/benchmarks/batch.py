@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+"""
+
+Measure the time and requests to download the layers of many images that
+share base layers (e.g., the images of a workflow) from a local stand-in
+registry that limits the rate of each connection. Pulling the images one
+at a time (the previous behavior) waits for the layers of each image before
+resolving the next, while a batch pull resolves all manifests first and
+downloads each unique layer once, with one pool of workers for all images.
+Both download a shared layer once (it's found in the blob store), so the
+batch helps when images have fewer layers to download than there are
+workers (SREGISTRY_PYTHON_THREADS).
+
+    SREGISTRY_PYTHON_THREADS=8 python batch.py --images 8 --shared 4 --own 2
+
+Copyright (C) 2017-2021 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+from registry import Registry
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="batch pull benchmark")
+    parser.add_argument("--images", type=int, default=8, help="number of images")
+    parser.add_argument("--shared", type=int, default=4, help="layers shared")
+    parser.add_argument("--own", type=int, default=2, help="layers per image")
+    parser.add_argument("--size", type=int, default=1 << 20, help="layer bytes")
+    parser.add_argument(
+        "--rate", type=int, default=1 << 22, help="bytes per second per connection"
+    )
+    return parser
+
+
+def create_images(registry, images, shared, own, size):
+    """add images (tagged image0, image1...) with shared and own layers"""
+    base = [registry.add(os.urandom(size)) for _ in range(shared)]
+    config = registry.add(json.dumps({"config": {}}).encode("utf-8"))
+    tags = ["image%s" % index for index in range(images)]
+    for tag in tags:
+        layers = base + [registry.add(os.urandom(size)) for _ in range(own)]
+        manifest = {
+            "schemaVersion": 2,
+            "mediaType": "application/vnd.docker.distribution.manifest.v2+json",
+            "config": {
+                "mediaType": "application/vnd.docker.container.image.v1+json",
+                "digest": config,
+            },
+            "layers": [{"digest": digest} for digest in layers],
+        }
+        registry.add_manifest(manifest, tag)
+    return tags
+
+
+def pull(registry, tags, batch):
+    """download the layers of each image, one image at a time or as a batch"""
+    from sregistry.main.docker import Client
+    import sregistry.main.base.manifests as manifests
+    import sregistry.main.workers.blobs
+
+    cache = tempfile.mkdtemp(prefix="sregistry-benchmark.")
+    sregistry.main.workers.blobs.SREGISTRY_BLOBS = os.path.join(cache, "blobs")
+    manifests._cache = manifests.ManifestCache(None)
+
+    client = Client()
+    client.base = registry.base
+    client._get_download_cache = lambda *args, **kwargs: cache
+    names = [
+        {"url": registry.repo, "uri": "%s:%s" % (registry.repo, tag), "tag": tag}
+        for tag in tags
+    ]
+
+    registry.reset()
+    start = time.time()
+    if batch:
+        client._download_images([dict(name, version=None) for name in names])
+    else:
+        for name in names:
+            client.manifests = {}
+            client._get_manifests(name["url"], name["tag"])
+            client._download_layers(name["url"], destination=cache)
+    runtime = time.time() - start
+    shutil.rmtree(cache)
+    return dict(registry.counts), runtime
+
+
+def main():
+    args = get_parser().parse_args()
+    registry = Registry(layers=0, rate=args.rate)
+    tags = create_images(registry, args.images, args.shared, args.own, args.size)
+    results = [
+        ("one at a time", pull(registry, tags, batch=False)),
+        ("batch", pull(registry, tags, batch=True)),
+    ]
+    registry.stop()
+
+    print("\n%-14s %8s %12s %10s" % ("mode", "GET", "MB", "seconds"))
+    for mode, (counts, runtime) in results:
+        print(
+            "%-14s %8s %12.1f %10.2f"
+            % (mode, counts.get("GET", 0), counts.get("bytes", 0) / 1e6, runtime)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+"""
+
+Measure the time to extract gzip and zstd compressed layers into a sandbox,
+decompressing in the same thread as the extraction, or alongside it
+(SREGISTRY_DECOMPRESS_THREADS, and pigz for gzip if it's installed). Two
+layers are created: many small files (where writing files dominates) and
+a few large, compressible files (where decompression dominates). zstd is
+skipped if neither the zstandard module nor the zstd binary is found.
+
+    python decompress.py --files 20000 --large 8
+
+Copyright (C) 2017-2021 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+import argparse
+import io
+import os
+import random
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="layer decompression benchmark")
+    parser.add_argument(
+        "--files", type=int, default=20000, help="files in the small files layer"
+    )
+    parser.add_argument(
+        "--large", type=int, default=8, help="files in the large files layer"
+    )
+    parser.add_argument(
+        "--threads", type=int, default=os.cpu_count() or 1, help="threads to compare"
+    )
+    return parser
+
+
+def create_layer(folder, name, files):
+    """create an uncompressed layer from a list of (name, content) tuples"""
+    layer = os.path.join(folder, "%s.tar" % name)
+    with tarfile.open(layer, "w") as tar:
+        for filename, content in files:
+            info = tarfile.TarInfo(filename)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return layer
+
+
+def compress(layer):
+    """return the layer compressed as gzip and (if possible) zstd"""
+    layers = {}
+    subprocess.check_call(["gzip", "-kf", layer])
+    layers["gzip"] = "%s.gz" % layer
+    if shutil.which("zstd"):
+        subprocess.check_call(["zstd", "-qf", layer])
+        layers["zstd"] = "%s.zst" % layer
+    else:
+        try:
+            import zstandard
+
+            with open(layer, "rb") as filey:
+                content = zstandard.ZstdCompressor().compress(filey.read())
+            with open("%s.zst" % layer, "wb") as filey:
+                filey.write(content)
+            layers["zstd"] = "%s.zst" % layer
+        except ImportError:
+            pass
+    return layers
+
+
+def extract(layer, threads):
+    """extract a layer with a number of decompression threads"""
+    import sregistry.defaults
+    from sregistry.utils import extract_tar
+
+    sregistry.defaults.SREGISTRY_DECOMPRESS_THREADS = threads
+    sandbox = tempfile.mkdtemp(prefix="sregistry-benchmark.")
+    start = time.time()
+    result = extract_tar(layer, sandbox, handle_whiteout=True)
+    runtime = time.time() - start
+    shutil.rmtree(sandbox)
+    if result["return_code"] != 0:
+        raise SystemExit(result["message"])
+    return runtime
+
+
+def main():
+    args = get_parser().parse_args()
+    folder = tempfile.mkdtemp(prefix="sregistry-benchmark.")
+    words = [os.urandom(4).hex().encode("utf-8") for _ in range(2000)]
+
+    small = [("small/file%s" % i, os.urandom(2048)) for i in range(args.files)]
+    large = [
+        ("large/lib%s.so" % i, b" ".join(random.choices(words, k=1 << 21)))
+        for i in range(args.large)
+    ]
+
+    print("\n%-8s %-6s %10s %10s" % ("layer", "format", "threads", "seconds"))
+    for name, files in [("small", small), ("large", large)]:
+        layer = create_layer(folder, name, files)
+        for compression, compressed in compress(layer).items():
+            for threads in sorted(set([1, args.threads])):
+                runtime = extract(compressed, threads)
+                print("%-8s %-6s %10s %10.2f" % (name, compression, threads, runtime))
+    shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main()
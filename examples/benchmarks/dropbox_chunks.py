@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+"""
+
+Measure the time to push an image to a stand-in Dropbox, which waits a
+round trip for each request and limits the rate of each connection,
+comparing chunk sizes and the number of chunks appended at once (4MB
+chunks one at a time is how images were pushed before concurrent upload
+sessions). It needs the Dropbox sdk (pip install dropbox).
+
+    python dropbox_chunks.py --size 268435456 --latency 0.1 --rate 16777216
+
+Copyright (C) 2017-2021 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+from types import SimpleNamespace
+import argparse
+import hashlib
+import importlib
+import os
+import tempfile
+import threading
+import time
+
+# Don't update the catalog of the stand-in
+os.environ["SREGISTRY_CATALOG"] = "no"
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="dropbox push benchmark")
+    parser.add_argument("--size", type=int, default=1 << 28, help="image bytes")
+    parser.add_argument(
+        "--latency", type=float, default=0.1, help="seconds of each round trip"
+    )
+    parser.add_argument(
+        "--rate", type=int, default=1 << 24, help="bytes per second per connection"
+    )
+    parser.add_argument(
+        "--chunks",
+        type=int,
+        nargs="+",
+        default=[1, 4, 8],
+        help="chunks at once to compare",
+    )
+    return parser
+
+
+class Dropbox(object):
+    """a stand-in for the upload session routes of the Dropbox sdk, that
+    keeps the appended data (by offset) and counts requests.
+    """
+
+    def __init__(self, latency, rate):
+        self.latency = latency
+        self.rate = rate
+        self.requests = 0
+        self.parts = {}
+        self.lock = threading.Lock()
+
+    def wait(self, data):
+        with self.lock:
+            self.requests += 1
+        time.sleep(self.latency + len(data) / float(self.rate))
+
+    def files_upload(self, data, path):
+        self.wait(data)
+        return SimpleNamespace(content_hash=get_content_hash(data))
+
+    def files_upload_session_start(self, data, close=False, session_type=None):
+        self.wait(data)
+        self.parts = {}
+        return SimpleNamespace(session_id="session")
+
+    def files_upload_session_append_v2(self, data, cursor, close=False):
+        self.wait(data)
+        self.parts[cursor.offset] = bytes(data)
+
+    def files_upload_session_finish(self, data, cursor, commit):
+        self.wait(data)
+        content = b"".join(self.parts[offset] for offset in sorted(self.parts))
+        return SimpleNamespace(content_hash=get_content_hash(content))
+
+
+def get_content_hash(data):
+    blocks = b"".join(
+        hashlib.sha256(data[start : start + (4 << 20)]).digest()
+        for start in range(0, len(data), 4 << 20)
+    )
+    return hashlib.sha256(blocks).hexdigest()
+
+
+def push(path, dbx, chunks, chunk_size):
+    """push the image with the client, with a number of chunks at once of
+    a chunk size (0 adapts to the image).
+    """
+    from sregistry.main.dropbox import Client
+
+    # The package exports the push function under the name of its module
+    push_module = importlib.import_module("sregistry.main.dropbox.push")
+
+    push_module.SREGISTRY_DROPBOX_CHUNKS = chunks
+    push_module.SREGISTRY_DROPBOX_CHUNK_SIZE = chunk_size
+
+    client = Client.__new__(Client)
+    client.dbx = dbx
+    dbx.requests = 0
+    start = time.time()
+    client.push(path, "benchmark/image:latest")
+    return dbx.requests, time.time() - start
+
+
+def main():
+    args = get_parser().parse_args()
+    dbx = Dropbox(args.latency, args.rate)
+
+    fd, path = tempfile.mkstemp(prefix="sregistry-benchmark.", suffix=".sif")
+    with os.fdopen(fd, "wb") as fileobj:
+        fileobj.write(os.urandom(args.size))
+
+    runs = [("4MB", 1, 4 << 20)] + [("adaptive", chunks, 0) for chunks in args.chunks]
+    results = [(run, push(path, dbx, run[1], run[2])) for run in runs]
+    os.remove(path)
+
+    print(
+        "\n%-10s %8s %10s %10s %10s"
+        % ("chunks", "at once", "requests", "seconds", "MB/s")
+    )
+    for (label, chunks, _), (requests, runtime) in results:
+        print(
+            "%-10s %8s %10s %10.2f %10.2f"
+            % (label, chunks, requests, runtime, args.size / runtime / 1e6)
+        )
+
+
+if __name__ == "__main__":
+    main()
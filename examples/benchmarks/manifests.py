@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+"""
+
+Measure the time until layers can start downloading (the layer digests are
+known) and until the image config is returned, for a registry with a round
+trip latency. The previous behavior requested the v1, v2 and config schema
+manifests and then the config blob, one after the other; the manifest is
+now negotiated with one request (and a second for a manifest list) and
+the config is requested in the background. Manifests are then cached:
+a later pull of the tag uses the cache (within SREGISTRY_MANIFEST_TTL) or
+revalidates it with one conditional request.
+
+    python manifests.py --latency 0.1
+
+Copyright (C) 2017-2021 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+from registry import Registry
+import argparse
+import json
+import shutil
+import tempfile
+import time
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="manifest negotiation benchmark")
+    parser.add_argument(
+        "--latency", type=float, default=0.1, help="seconds per request"
+    )
+    parser.add_argument("--layers", type=int, default=5, help="number of layers")
+    return parser
+
+
+def create_image(registry, layers):
+    """add an image (config and manifest) to the registry, tagged latest,
+    and a manifest list for amd64 and arm64, tagged multi.
+    """
+    config = json.dumps({"config": {"Env": ["PATH=/usr/bin"]}}).encode("utf-8")
+    manifest = {
+        "schemaVersion": 2,
+        "mediaType": "application/vnd.docker.distribution.manifest.v2+json",
+        "config": {
+            "mediaType": "application/vnd.docker.container.image.v1+json",
+            "digest": registry.add(config),
+        },
+        "layers": [{"digest": digest} for digest in registry.digests[:layers]],
+    }
+    digest = registry.add_manifest(manifest, "latest")
+    registry.add_manifest(
+        {
+            "schemaVersion": 2,
+            "mediaType": "application/vnd.docker.distribution.manifest.list.v2+json",
+            "manifests": [
+                {"digest": digest, "platform": {"os": "linux", "architecture": arch}}
+                for arch in ["amd64", "arm64"]
+            ],
+        },
+        "multi",
+    )
+
+
+def get_client(registry):
+    from sregistry.main.docker import Client
+
+    client = Client()
+    client.base = registry.base
+    return client
+
+
+def use_cache(root=None, ttl=300):
+    """use a manifest cache in a folder (or none) for the next pulls"""
+    import sregistry.main.base.manifests as manifests
+
+    manifests._cache = manifests.ManifestCache(root, ttl=ttl)
+
+
+def serial(registry, tag):
+    """the previous behavior: each schema version, then the config blob"""
+    accepts = {
+        "config": "application/vnd.docker.container.image.v1+json",
+        "v1": "application/vnd.docker.distribution.manifest.v1+json",
+        "v2": "application/vnd.docker.distribution.manifest.v2+json",
+    }
+    client = get_client(registry)
+    client.manifests = {}
+    for version in ["v1", "v2", "config"]:
+        url = client._get_manifest_selfLink(registry.repo, tag)
+        manifest = client._get(url, headers={"Accept": accepts[version]}, quiet=True)
+        if not isinstance(manifest, dict):
+            manifest = None
+        if manifest is not None:
+            if version == "v2" and "config" in manifest:
+                url = client._get_layerLink(registry.repo, manifest["config"]["digest"])
+                headers = {"Accept": manifest["config"]["mediaType"]}
+                client.manifests["config"] = client._get(url, headers=headers)
+            client.manifests[version] = manifest
+    layers = time.time()
+    return client, layers
+
+
+def negotiated(registry, tag):
+    client = get_client(registry)
+    client._get_manifests(registry.repo, tag)
+    layers = time.time()
+    client._wait_manifests()
+    return client, layers
+
+
+def main():
+    args = get_parser().parse_args()
+    registry = Registry(layers=args.layers, size=1024, latency=args.latency)
+    create_image(registry, args.layers)
+
+    cache = tempfile.mkdtemp(prefix="sregistry-benchmark.")
+    modes = [
+        ("serial", None, None, serial),
+        ("negotiated", None, None, negotiated),
+        ("cold cache", cache, 300, negotiated),
+        ("cached", cache, 300, negotiated),
+        ("revalidated", cache, 0, negotiated),
+    ]
+
+    print("\n%-6s %-11s %9s %9s %9s" % ("tag", "mode", "requests", "layers", "config"))
+    for tag in ["latest", "multi"]:
+        for mode, root, ttl, func in modes:
+            use_cache(root, ttl)
+            registry.reset()
+            start = time.time()
+            client, layers = func(registry, tag)
+            done = time.time()
+            found = len(client._get_digests()) if "v2" in client.manifests else 0
+            print(
+                "%-6s %-11s %9s %8.2fs %8.2fs %s"
+                % (
+                    tag,
+                    mode,
+                    registry.counts["GET"],
+                    layers - start,
+                    done - start,
+                    "" if found else "(no layers found)",
+                )
+            )
+    registry.stop()
+    shutil.rmtree(cache)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""
+
+Measure the time to download and extract the layers of an image into a
+sandbox from a local stand-in registry that limits the rate of each
+connection, comparing extraction after all layers are downloaded (the
+previous behavior) with extracting each layer as soon as it's downloaded.
+The pipeline helps when layers finish downloading at different times, e.g.,
+when there are more layers than workers (SREGISTRY_PYTHON_THREADS).
+
+    SREGISTRY_PYTHON_THREADS=4 python pipeline.py --layers 16 --files 1000
+
+Copyright (C) 2017-2021 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+from registry import Registry
+import argparse
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="pipelined pull benchmark")
+    parser.add_argument("--layers", type=int, default=16, help="number of layers")
+    parser.add_argument("--files", type=int, default=1000, help="files per layer")
+    parser.add_argument(
+        "--file-size", type=int, default=4096, help="bytes per file in a layer"
+    )
+    parser.add_argument(
+        "--rate", type=int, default=1 << 22, help="bytes per second per connection"
+    )
+    return parser
+
+
+def create_layer(index, files, file_size):
+    """create a layer (.tar.gz) with a number of files of random content"""
+    layer = io.BytesIO()
+    with tarfile.open(fileobj=layer, mode="w:gz") as tar:
+        for number in range(files):
+            content = os.urandom(file_size)
+            info = tarfile.TarInfo("layer%s/file%s" % (index, number))
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return layer.getvalue()
+
+
+def pull(registry, digests, pipeline):
+    """download and extract the layers with the docker client, extracting
+    each layer as it's downloaded (pipeline) or after all are downloaded.
+    """
+    from sregistry.main.docker import Client
+    from sregistry.main.docker.utils import extract_layer
+    import sregistry.main.workers.blobs
+
+    client = Client()
+    client.base = registry.base
+    client.manifests = {
+        "config": {},
+        "v2": {"schemaVersion": 2, "layers": [{"digest": d} for d in digests]},
+    }
+    client._update_token = lambda *args, **kwargs: None
+
+    cache = tempfile.mkdtemp(prefix="sregistry-benchmark.")
+    sandbox = tempfile.mkdtemp(prefix="sregistry-benchmark.")
+    sregistry.main.workers.blobs.SREGISTRY_BLOBS = os.path.join(cache, "blobs")
+    registry.reset()
+    start = time.time()
+    if pipeline:
+        client._download_layers(registry.repo, destination=cache, sandbox=sandbox)
+    else:
+        for layer in client._download_layers(registry.repo, destination=cache):
+            extract_layer(layer, sandbox)
+    runtime = time.time() - start
+    shutil.rmtree(cache)
+    shutil.rmtree(sandbox)
+    return dict(registry.counts), runtime
+
+
+def main():
+    args = get_parser().parse_args()
+    registry = Registry(layers=0, rate=args.rate)
+    digests = [
+        registry.add(create_layer(index, args.files, args.file_size))
+        for index in range(args.layers)
+    ]
+    results = [
+        ("sequential", pull(registry, digests, pipeline=False)),
+        ("pipeline", pull(registry, digests, pipeline=True)),
+    ]
+    registry.stop()
+
+    print("\n%-12s %8s %10s" % ("mode", "GET", "seconds"))
+    for mode, (counts, runtime) in results:
+        print("%-12s %8s %10.2f" % (mode, counts.get("GET", 0), runtime))
+
+
+if __name__ == "__main__":
+    main()
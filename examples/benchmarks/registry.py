@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+"""
+
+A local stand-in for a Docker registry, serving randomly generated layers
+from memory (/v2/<repo>/blobs/<digest>) and manifests that are added to it
+(/v2/<repo>/manifests/<reference>), and counting the requests it receives,
+for use by the benchmarks in this folder.
+
+Copyright (C) 2017-2021 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import collections
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+
+class Registry(object):
+    """start a registry on a free local port (in a background thread) with
+    a number of layers of a given size. Requests are counted by method, and
+    bytes of content sent under "bytes". Range requests are supported, and
+    if interrupt is set, the connection of the first GET for each blob is
+    closed after that many bytes (to simulate a flaky link). If rate is set,
+    each connection is limited to that many bytes per second (to simulate
+    a link with a per connection limit, e.g., a long round trip). If latency
+    is set, each request waits that many seconds before it's answered. A
+    manifest is only returned if its media type is in the Accept header,
+    and is not modified (304) if If-None-Match has its digest.
+    """
+
+    def __init__(
+        self,
+        layers=10,
+        size=1 << 20,
+        repo="library/benchmark",
+        interrupt=None,
+        rate=None,
+        latency=None,
+    ):
+        self.repo = repo
+        self.interrupt = interrupt
+        self.rate = rate
+        self.latency = latency
+        self.interrupted = set()
+        self.blobs = {}
+        self.manifests = {}
+        for _ in range(layers):
+            self.add(os.urandom(size))
+
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def add(self, content):
+        """add a blob (e.g., a layer .tar.gz) and return its digest"""
+        digest = "sha256:%s" % hashlib.sha256(content).hexdigest()
+        self.blobs[digest] = content
+        return digest
+
+    def add_manifest(self, manifest, reference=None):
+        """add a manifest (a dictionary with a mediaType) by its digest, and
+        a reference (e.g., a tag) if provided. Returns the digest.
+        """
+        content = json.dumps(manifest).encode("utf-8")
+        digest = "sha256:%s" % hashlib.sha256(content).hexdigest()
+        for key in [digest, reference]:
+            if key is not None:
+                self.manifests[key] = (manifest["mediaType"], content)
+        return digest
+
+    @property
+    def base(self):
+        return "http://127.0.0.1:%s/v2" % self.server.server_address[1]
+
+    @property
+    def digests(self):
+        return list(self.blobs.keys())
+
+    def url(self, digest):
+        return "%s/%s/blobs/%s" % (self.base, self.repo, digest)
+
+    def reset(self):
+        with self.lock:
+            self.counts.clear()
+            self.interrupted.clear()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _blob(self):
+                with registry.lock:
+                    registry.counts[self.command] += 1
+                if registry.latency is not None:
+                    time.sleep(registry.latency)
+                digest = self.path.rsplit("/", 1)[-1]
+                if "/manifests/" in self.path:
+                    return self._manifest(digest)
+                return registry.blobs.get(digest)
+
+            def _manifest(self, reference):
+                with registry.lock:
+                    registry.counts["manifests"] += 1
+                media_type, content = registry.manifests.get(reference, (None, None))
+                if media_type not in self.headers.get("Accept", ""):
+                    return None
+                return content
+
+            def _headers(self, content):
+                if content is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return None
+
+                etag = '"%s"' % self.path.rsplit(":", 1)[-1]
+                if "/manifests/" in self.path:
+                    digest = "sha256:%s" % hashlib.sha256(content).hexdigest()
+                    etag = '"%s"' % digest
+                    if self.headers.get("If-None-Match") == etag:
+                        with registry.lock:
+                            registry.counts["not modified"] += 1
+                        self.send_response(304)
+                        self.send_header("ETag", etag)
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return None
+
+                start, end = 0, len(content) - 1
+                match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+                if_range = self.headers.get("If-Range")
+                if match and (if_range is None or if_range == etag):
+                    start = int(match.group(1))
+                    if match.group(2):
+                        end = min(int(match.group(2)), end)
+                    if start >= len(content):
+                        self.send_response(416)
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return None
+                    self.send_response(206)
+                    self.send_header(
+                        "Content-Range",
+                        "bytes %s-%s/%s" % (start, end, len(content)),
+                    )
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Length", str(end + 1 - start))
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return content[start : end + 1]
+
+            def do_HEAD(self):
+                self._headers(self._blob())
+
+            def do_GET(self):
+                content = self._headers(self._blob())
+                if content is None:
+                    return
+
+                # Drop the connection part way through the first download
+                with registry.lock:
+                    interrupt = registry.interrupt is not None and (
+                        self.path not in registry.interrupted
+                    )
+                    registry.interrupted.add(self.path)
+                if interrupt:
+                    content = content[: registry.interrupt]
+                    self.close_connection = True
+
+                chunk = max(len(content), 1)
+                if registry.rate is not None:
+                    chunk = max(registry.rate // 10, 1)
+                for start in range(0, len(content), chunk):
+                    self.wfile.write(content[start : start + chunk])
+                    with registry.lock:
+                        registry.counts["bytes"] += len(content[start : start + chunk])
+                    if registry.rate is not None:
+                        time.sleep(0.1)
+
+        return Handler
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+"""
+
+Count the requests needed to download the layers of an image from a
+local stand-in registry, comparing a HEAD check before each download
+(the previous behavior) with deriving existence from the streaming GET.
+
+    python requests_per_pull.py --layers 40 --size 1048576
+
+Copyright (C) 2017-2021 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+from registry import Registry
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="requests per pull benchmark")
+    parser.add_argument("--layers", type=int, default=40, help="number of layers")
+    parser.add_argument("--size", type=int, default=1 << 20, help="layer bytes")
+    return parser
+
+
+def pull(registry, head_first=False):
+    """download each layer of the stand-in registry with the worker task,
+    optionally issuing a HEAD request first.
+    """
+    from sregistry.main.base.session import get_session
+    from sregistry.main.workers.tasks import download_task
+
+    destination = tempfile.mkdtemp(prefix="sregistry-benchmark.")
+    registry.reset()
+    start = time.time()
+    for digest in registry.digests:
+        url = registry.url(digest)
+        if head_first:
+            get_session().head(url)
+        targz = os.path.join(destination, "%s.tar.gz" % digest)
+        download_task(url, {}, targz, "layer", digest)
+    runtime = time.time() - start
+    shutil.rmtree(destination)
+    return dict(registry.counts), runtime
+
+
+def main():
+    args = get_parser().parse_args()
+    registry = Registry(layers=args.layers, size=args.size)
+    results = [
+        ("HEAD + GET", pull(registry, head_first=True)),
+        ("GET only", pull(registry, head_first=False)),
+    ]
+    registry.stop()
+
+    print("\n%-12s %8s %8s %14s %10s" % ("mode", "HEAD", "GET", "per layer", "seconds"))
+    for mode, (counts, runtime) in results:
+        total = counts.get("HEAD", 0) + counts.get("GET", 0)
+        print(
+            "%-12s %8s %8s %14.2f %10.2f"
+            % (
+                mode,
+                counts.get("HEAD", 0),
+                counts.get("GET", 0),
+                total / float(args.layers),
+                runtime,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
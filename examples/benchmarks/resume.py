@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+"""
+
+Measure the bytes transferred to download the layers of an image from a
+local stand-in registry that drops the connection part way through the
+first download of each layer, comparing a restart from byte zero (the
+previous behavior) with resuming the partial download with a Range request.
+
+    python resume.py --layers 10 --size 8388608 --interrupt 0.5
+
+Copyright (C) 2017-2021 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+from registry import Registry
+from requests.exceptions import ChunkedEncodingError, ConnectionError
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="resumable download benchmark")
+    parser.add_argument("--layers", type=int, default=10, help="number of layers")
+    parser.add_argument("--size", type=int, default=1 << 23, help="layer bytes")
+    parser.add_argument(
+        "--interrupt",
+        type=float,
+        default=0.5,
+        help="fraction of each layer sent before the connection drops",
+    )
+    return parser
+
+
+def pull(registry, resume=True):
+    """download each layer of the stand-in registry with the worker tasks,
+    either resuming an interrupted download or starting it over.
+    """
+    from sregistry.main.workers.tasks import download_task, stream
+
+    destination = tempfile.mkdtemp(prefix="sregistry-benchmark.")
+    registry.reset()
+    start = time.time()
+    for digest in registry.digests:
+        url = registry.url(digest)
+        targz = os.path.join(destination, "%s.tar.gz" % digest)
+        if resume:
+            download_task(url, {}, targz, "layer", digest)
+            continue
+        while True:
+            try:
+                stream(url, {}, stream_to=targz, digest=digest)
+                break
+            except (ChunkedEncodingError, ConnectionError):
+                pass
+    runtime = time.time() - start
+    shutil.rmtree(destination)
+    return dict(registry.counts), runtime
+
+
+def main():
+    args = get_parser().parse_args()
+    registry = Registry(
+        layers=args.layers, size=args.size, interrupt=int(args.size * args.interrupt)
+    )
+    results = [
+        ("restart", pull(registry, resume=False)),
+        ("resume", pull(registry, resume=True)),
+    ]
+    registry.stop()
+
+    total = float(args.layers * args.size)
+    print(
+        "\n%-10s %8s %16s %12s %10s" % ("mode", "GET", "bytes", "per layer", "seconds")
+    )
+    for mode, (counts, runtime) in results:
+        print(
+            "%-10s %8s %16s %12.2f %10.2f"
+            % (
+                mode,
+                counts.get("GET", 0),
+                counts.get("bytes", 0),
+                counts.get("bytes", 0) / total,
+                runtime,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+"""
+
+Measure the time and requests to push (and pull) an image with the s3
+client against a local S3 endpoint, with the boto3 defaults for transfers
+(8MB parts, 10 at once) and with the part size and concurrency of the
+SREGISTRY_S3_* settings. A second push of the same image is skipped, since
+the object has the sha256 of the image in its metadata.
+
+By default, the endpoint is a moto server started in this process (pip
+install moto[server]), which keeps objects in memory. To use another
+endpoint (e.g., MinIO), export AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY
+and give its url with --base.
+
+    python s3_transfer.py --size 1024 --chunksize 64 --concurrency 10
+
+Copyright (C) 2017-2021 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="s3 transfer benchmark")
+    parser.add_argument("--size", type=int, default=256, help="image MB")
+    parser.add_argument("--chunksize", type=int, default=64, help="part MB")
+    parser.add_argument("--concurrency", type=int, default=10, help="parts at once")
+    parser.add_argument("--base", help="url of an S3 endpoint (default moto)")
+    parser.add_argument("--port", type=int, default=5123, help="moto port")
+    return parser
+
+
+def get_client(base, tmpdir):
+    """return an s3 client for the bucket sregistry-benchmark, with its own
+    database and secrets in tmpdir
+    """
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    os.environ["SREGISTRY_S3_BASE"] = base
+    os.environ["SREGISTRY_S3_BUCKET"] = "sregistry-benchmark"
+    os.environ["SREGISTRY_CLIENT"] = "s3"
+    os.environ["SREGISTRY_CLIENT_SECRETS"] = os.path.join(tmpdir, "secrets")
+    os.environ["SREGISTRY_DATABASE"] = tmpdir
+
+    import boto3
+
+    s3 = boto3.resource(
+        "s3",
+        endpoint_url=base,
+        aws_access_key_id=os.environ["AWS_ACCESS_KEY_ID"],
+        aws_secret_access_key=os.environ["AWS_SECRET_ACCESS_KEY"],
+    )
+    bucket = s3.Bucket("sregistry-benchmark")
+    if bucket.creation_date is None:
+        bucket.create()
+
+    from sregistry.main import get_client
+
+    client = get_client(quiet=True)
+
+    # Count the requests of each transfer
+    client.counts = {}
+
+    def count(request, **kwargs):
+        client.counts[request.method] = client.counts.get(request.method, 0) + 1
+
+    client.s3.meta.client.meta.events.register("before-send.s3", count)
+    return client
+
+
+def transfer(client, image, settings, pull=False):
+    """push (or pull) the image with the settings, and return the requests
+    (by method) and seconds that it took
+    """
+    os.environ.update(settings)
+    client.counts.clear()
+    start = time.time()
+    if pull:
+        client.pull("benchmark/image:latest", file_name=image, save=False)
+    else:
+        client.push(image, "benchmark/image:latest")
+    return dict(client.counts), time.time() - start
+
+
+def main():
+    args = get_parser().parse_args()
+    tmpdir = tempfile.mkdtemp(prefix="sregistry-benchmark.")
+
+    server = None
+    base = args.base
+    if base is None:
+        from moto.server import ThreadedMotoServer
+
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        server = ThreadedMotoServer(port=args.port, verbose=False)
+        server.start()
+        base = "http://127.0.0.1:%s" % args.port
+
+    image = os.path.join(tmpdir, "image.sif")
+    with open(image, "wb") as filey:
+        for _ in range(args.size):
+            filey.write(os.urandom(1 << 20))
+
+    client = get_client(base, tmpdir)
+    default = {
+        "SREGISTRY_S3_MULTIPART_CHUNKSIZE": str(8 << 20),
+        "SREGISTRY_S3_MAX_CONCURRENCY": "10",
+    }
+    tuned = {
+        "SREGISTRY_S3_MULTIPART_CHUNKSIZE": str(args.chunksize << 20),
+        "SREGISTRY_S3_MAX_CONCURRENCY": str(args.concurrency),
+    }
+
+    results = [("push boto3 defaults", transfer(client, image, default))]
+
+    # The object has the sha256 of the image, so it has to change to upload
+    client.s3.Object("sregistry-benchmark", "benchmark/image:latest.sif").delete()
+    results.append(("push settings", transfer(client, image, tuned)))
+    results.append(("push unchanged", transfer(client, image, tuned)))
+
+    pulled = os.path.join(tmpdir, "pulled.sif")
+    results.append(("pull boto3 defaults", transfer(client, pulled, default, True)))
+    os.remove(pulled)
+    results.append(("pull settings", transfer(client, pulled, tuned, True)))
+
+    if server is not None:
+        server.stop()
+    shutil.rmtree(tmpdir)
+
+    print(
+        "\n%-20s %8s %8s %8s %8s %10s"
+        % ("transfer", "HEAD", "GET", "PUT", "POST", "seconds")
+    )
+    for name, (counts, runtime) in results:
+        print(
+            "%-20s %8s %8s %8s %8s %10.2f"
+            % (
+                name,
+                counts.get("HEAD", 0),
+                counts.get("GET", 0),
+                counts.get("PUT", 0),
+                counts.get("POST", 0),
+                runtime,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+"""
+
+Measure the time to download a single large file (e.g., an image from hub,
+registry or gitlab) from a local stand-in registry that limits the rate of
+each connection, comparing one stream with a segmented download of byte
+ranges fetched at once.
+
+    python segments.py --size 67108864 --rate 8388608 --segment-size 8388608
+
+Copyright (C) 2017-2021 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+from registry import Registry
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="segmented download benchmark")
+    parser.add_argument("--size", type=int, default=1 << 26, help="file bytes")
+    parser.add_argument(
+        "--rate", type=int, default=1 << 23, help="bytes per second per connection"
+    )
+    parser.add_argument(
+        "--segment-size", type=int, default=1 << 23, help="bytes per segment"
+    )
+    parser.add_argument(
+        "--segments",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8],
+        help="segments at once to compare (1 is one stream)",
+    )
+    return parser
+
+
+def pull(registry, segments, segment_size):
+    """download the file of the stand-in registry with the client download,
+    with a number of segments at once.
+    """
+    import sregistry.defaults
+    from sregistry.main.docker import Client
+
+    sregistry.defaults.SREGISTRY_DOWNLOAD_SEGMENTS = segments
+    sregistry.defaults.SREGISTRY_DOWNLOAD_SEGMENT_SIZE = segment_size
+
+    digest = registry.digests[0]
+    destination = tempfile.mkdtemp(prefix="sregistry-benchmark.")
+    registry.reset()
+    start = time.time()
+    Client().download(
+        registry.url(digest),
+        os.path.join(destination, "image.sif"),
+        digest=digest,
+        show_progress=False,
+    )
+    runtime = time.time() - start
+    shutil.rmtree(destination)
+    return dict(registry.counts), runtime
+
+
+def main():
+    args = get_parser().parse_args()
+    registry = Registry(layers=1, size=args.size, rate=args.rate)
+    results = [
+        (segments, pull(registry, segments, args.segment_size))
+        for segments in args.segments
+    ]
+    registry.stop()
+
+    print("\n%-10s %8s %10s %10s" % ("segments", "GET", "seconds", "MB/s"))
+    for segments, (counts, runtime) in results:
+        print(
+            "%-10s %8s %10.2f %10.2f"
+            % (segments, counts.get("GET", 0), runtime, args.size / runtime / 1e6)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+"""
+
+Compare the "process" (multiprocessing pool) and "thread" engines of the
+sregistry Workers for layer downloads from a local stand-in registry,
+for many small layers and for a few large layers.
+
+    python worker_engines.py --workers 9
+
+Copyright (C) 2017-2021 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+from registry import Registry
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="worker engines benchmark")
+    parser.add_argument("--workers", type=int, default=9, help="number of workers")
+    parser.add_argument("--small", type=int, default=200, help="small layers")
+    parser.add_argument("--small-size", type=int, default=64 << 10)
+    parser.add_argument("--large", type=int, default=4, help="large layers")
+    parser.add_argument("--large-size", type=int, default=128 << 20)
+    return parser
+
+
+def pull(registry, engine, workers):
+    """download all layers of the stand-in registry with a Workers engine"""
+    from sregistry.main.workers import Workers, download_task
+
+    destination = tempfile.mkdtemp(prefix="sregistry-benchmark.")
+    tasks = []
+    for digest in registry.digests:
+        targz = os.path.join(destination, "%s.tar.gz" % digest)
+        tasks.append((registry.url(digest), {}, targz, "layer", digest))
+
+    start = time.time()
+    Workers(workers=workers, engine=engine).run(func=download_task, tasks=tasks)
+    runtime = time.time() - start
+    shutil.rmtree(destination)
+    return runtime
+
+
+def main():
+    args = get_parser().parse_args()
+    scenarios = [
+        (
+            "%s x %s KiB" % (args.small, args.small_size >> 10),
+            args.small,
+            args.small_size,
+        ),
+        (
+            "%s x %s MiB" % (args.large, args.large_size >> 20),
+            args.large,
+            args.large_size,
+        ),
+    ]
+
+    results = []
+    for name, layers, size in scenarios:
+        registry = Registry(layers=layers, size=size)
+        process = pull(registry, "process", args.workers)
+        thread = pull(registry, "thread", args.workers)
+        registry.stop()
+        results.append((name, process, thread))
+
+    print("\n%-20s %12s %12s" % ("layers", "process (s)", "thread (s)"))
+    for name, process, thread in results:
+        print("%-20s %12.2f %12.2f" % (name, process, thread))
+
+
+if __name__ == "__main__":
+    main()
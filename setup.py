@@ -81,6 +81,7 @@ if __name__ == "__main__":
     GOOGLE_BUILD_BASIC = get_reqs(lookup, "INSTALL_BASIC_GOOGLE_BUILD")
     GOOGLE_COMPUTE_BASIC = get_reqs(lookup, "INSTALL_BASIC_GOOGLE_COMPUTE")
     SWIFT_BASIC = get_reqs(lookup, "INSTALL_BASIC_SWIFT")
+    ZSTD = get_reqs(lookup, "INSTALL_BASIC_ZSTD")
     TESTS_REQUIRES = get_reqs(lookup, "TESTS_REQUIRES")
 
     # These requirement sets include sqlalchemy, for client+storage
@@ -139,8 +140,8 @@ if __name__ == "__main__":
             "registry": [REGISTRY],
             "s3": [S3],
             "swift": [SWIFT],
+            "zstd": [ZSTD],
         },
-        scripts=["sregistry/main/docker/blob2oci"],
         classifiers=[
             "Intended Audience :: Science/Research",
             "Intended Audience :: Developers",
@@ -9,6 +9,7 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
 
 from .utils import basic_auth_header
+from .tokens import TokenCache, get_token_cache, get_token_key
 from .secrets import (
     get_secrets_file,
     get_credential_cache,
@@ -0,0 +1,158 @@
+"""
+
+Copyright (C) 2017-2021 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+from sregistry.logger import bot
+from sregistry.utils import mkdir_p, read_json, write_json
+
+import fcntl
+import hashlib
+import os
+import threading
+import time
+
+# One token cache per process, shared by threads
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class TokenCache(object):
+    """A single-flight, expiry aware cache of registry tokens. Threads of a
+    process share the cache in memory, and processes (e.g., the Workers
+    pool) share it via a json file in the credential cache, locked while
+    a token is fetched. When several workers need the same token at once,
+    one fetches it and the others wait for (and reuse) the result.
+
+    Parameters
+    ==========
+    filename: the json file to share tokens between processes. If None,
+              tokens are only shared by threads of the current process.
+    margin: a token that expires within this many seconds is refreshed
+    """
+
+    def __init__(self, filename=None, margin=60):
+        self.filename = filename
+        self.margin = margin
+        self.tokens = {}
+        self._lock = threading.Lock()
+        self._locks = {}
+
+    def get(self, key, fetch, rejected=None):
+        """return a cached token for a key, or call fetch to get (and cache)
+        a new one if it doesn't exist, or expires within the margin.
+
+        Parameters
+        ==========
+        key: a unique key for the token (e.g., the token url and credential)
+        fetch: a function that returns a tuple (token, expires_in), where
+               expires_in is seconds until expiry (or None if unknown)
+        rejected: a token that the registry just rejected, and so should
+                  not be returned from the cache
+        """
+        key = hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+
+        with lock:
+            token = self._valid(self.tokens.get(key), rejected)
+            if token is not None:
+                return token
+
+            if self.filename is None:
+                return self._fetch(key, fetch)
+
+            with open("%s.lock" % self.filename, "a") as filey:
+                fcntl.flock(filey, fcntl.LOCK_EX)
+                try:
+                    self.tokens.update(self._read())
+                    token = self._valid(self.tokens.get(key), rejected)
+                    if token is not None:
+                        return token
+                    token = self._fetch(key, fetch)
+                    self._write()
+                    return token
+                finally:
+                    fcntl.flock(filey, fcntl.LOCK_UN)
+
+    def clear(self, key=None):
+        """clear one token (e.g., after it was rejected) or all tokens"""
+        with self._lock:
+            if key is None:
+                self.tokens = {}
+            else:
+                key = hashlib.sha256(key.encode("utf-8")).hexdigest()
+                self.tokens.pop(key, None)
+
+    def _valid(self, entry, rejected=None):
+        """return the token of a cache entry if it doesn't expire soon"""
+        if entry is None or entry["token"] == rejected:
+            return None
+        expires = entry.get("expires")
+        if expires is not None and expires - self.margin <= time.time():
+            return None
+        return entry["token"]
+
+    def _fetch(self, key, fetch):
+        token, expires_in = fetch()
+        expires = None
+        if expires_in is not None:
+            expires = time.time() + float(expires_in)
+        self.tokens[key] = {"token": token, "expires": expires}
+        bot.debug("Refreshed token, expires in %s seconds" % expires_in)
+        return token
+
+    def _read(self):
+        if os.path.exists(self.filename) and os.stat(self.filename).st_size > 0:
+            try:
+                return read_json(self.filename)
+            except ValueError:
+                bot.warning("Ignoring malformed token cache %s" % self.filename)
+        return {}
+
+    def _write(self):
+        """write unexpired tokens to the cache file, readable only by the user"""
+        now = time.time()
+        tokens = {
+            key: entry
+            for key, entry in self.tokens.items()
+            if entry.get("expires") is None or entry["expires"] > now
+        }
+        tmp_file = "%s.tmp.%s" % (self.filename, os.getpid())
+        fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.close(fd)
+        write_json(tokens, tmp_file, print_pretty=False)
+        os.rename(tmp_file, self.filename)
+
+
+def get_token_key(token_url, auth=None):
+    """return the key of a token in the cache, for the token url and the
+    credential (an Authorization header, or None) that it's requested with,
+    so tokens for other credentials (or none) aren't returned.
+    """
+    return "%s %s" % (token_url, auth or "")
+
+
+def get_token_cache():
+    """return the token cache for the current process. If the credential
+    cache is enabled, tokens are shared with other processes (and pulls)
+    via a tokens.json file in it. If it's disabled, tokens aren't written
+    to disk, and are only shared by the threads of a process.
+    """
+    from sregistry.defaults import CREDENTIAL_CACHE, SREGISTRY_TOKEN_MARGIN
+
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            filename = None
+            if CREDENTIAL_CACHE is not None:
+                mkdir_p(CREDENTIAL_CACHE)
+                filename = os.path.join(CREDENTIAL_CACHE, "tokens.json")
+            _cache = TokenCache(filename, margin=SREGISTRY_TOKEN_MARGIN)
+    return _cache
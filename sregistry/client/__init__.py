@@ -100,6 +100,15 @@ def get_parser():
         "query", nargs="*", help="image search query", type=str, default="*"
     )
 
+    images.add_argument(
+        "--label",
+        "-l",
+        dest="labels",
+        help="only list images with a label (key=value, or key), can be repeated",
+        action="append",
+        default=None,
+    )
+
     # List local containers and collections
     inspect = subparsers.add_parser("inspect", help="inspect an image in your database")
 
@@ -166,6 +175,14 @@ def get_parser():
         type=str,
     )
 
+    search.add_argument(
+        "--metadata",
+        dest="metadata",
+        action="store_true",
+        default=False,
+        help="show the metadata of each image (s3), a request per image",
+    )
+
     # Build an image
     build = subparsers.add_parser("build", help="build an image using a remote.")
 
@@ -247,7 +264,17 @@ def get_parser():
     # Pull an image
     pull = subparsers.add_parser("pull", help="pull an image from a registry")
 
-    pull.add_argument("image", help="full uri of image", type=str)
+    pull.add_argument(
+        "image", help="full uri of one or more images", type=str, nargs="*"
+    )
+
+    pull.add_argument(
+        "--file",
+        dest="file",
+        help="a file with image uris to pull as a batch, one per line",
+        type=str,
+        default=None,
+    )
 
     pull.add_argument(
         "--name", dest="name", help="custom name for image", type=str, default=None
@@ -27,4 +27,4 @@ def main(args, parser, extra):
     for query in args.query:
         if query in ["", "*"]:
             query = None
-        cli.images(query=query)
+        cli.images(query=query, labels=args.labels)
@@ -13,22 +13,55 @@ from sregistry.logger import bot
 
 def main(args, parser, extra):
     from sregistry.main import get_client
+    from sregistry.utils import get_uri
 
-    image = args.image
+    images = list(args.image)
     name = args.name
 
-    # Customize client based on uri
-    cli = get_client(image, quiet=args.quiet)
-    cli.announce(args.command)
+    # A batch of images can be listed in a file
+    if args.file is not None:
+        images += read_images(args.file)
 
-    # Does the user want to save the image?
-    do_save = True
-    if args.nocache is True or not hasattr(cli, "storage"):
-        do_save = False
+    if not images:
+        bot.exit("Please provide an image uri, or a --file of image uris.")
 
-    # If the client doesn't have the command, exit
-    if not hasattr(cli, "pull"):
-        msg = "pull is not implemented for %s. Why don't you add it?"
-        bot.exit(msg % cli.client_name)
+    if len(images) > 1 and name is not None:
+        bot.exit("A --name can only be given to pull one image.")
 
-    cli.pull(images=image, file_name=name, force=args.force, save=do_save)
+    # Each client pulls its images as a batch, layers shared are pulled once
+    batches = {}
+    for image in images:
+        batches.setdefault(get_uri(image), []).append(image)
+
+    for batch in batches.values():
+        image = batch[0] if len(batch) == 1 else batch
+
+        # Customize client based on uri
+        cli = get_client(batch[0], quiet=args.quiet)
+        cli.announce(args.command)
+
+        # Does the user want to save the image?
+        do_save = True
+        if args.nocache is True or not hasattr(cli, "storage"):
+            do_save = False
+
+        # If the client doesn't have the command, exit
+        if not hasattr(cli, "pull"):
+            msg = "pull is not implemented for %s. Why don't you add it?"
+            bot.exit(msg % cli.client_name)
+
+        cli.pull(images=image, file_name=name, force=args.force, save=do_save)
+
+
+def read_images(filename):
+    """read a list of image uris from a file, one per line. Blank lines
+    and comments (starting with #) are skipped.
+    """
+    from sregistry.utils import read_file
+
+    images = []
+    for line in read_file(filename):
+        line = line.split("#", 1)[0].strip()
+        if line:
+            images.append(line)
+    return images
@@ -11,8 +11,12 @@ else:
         mv,
         rm,
         images,
+        search_images,
         inspect,
         get_container,
+        get_container_by_digest,
+        get_image_hash,
+        add_image_hash,
         get_collection,
         get_or_create_collection,
         rename,
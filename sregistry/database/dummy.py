@@ -22,6 +22,8 @@ def add(
     metadata=None,
     save=True,
     copy=False,
+    digest=None,
+    inspected=None,
 ):
     """dummy add simple returns an object that mimics a database entry, so the
     calling function (in push or pull) can interact with it equally. Most
@@ -0,0 +1,196 @@
+"""
+
+sregistry.database.migrations: upgrade the schema of a database in place
+
+Copyright (C) 2017-2021 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+from sregistry.logger import bot
+from sregistry.database import search
+import json
+import os
+import sqlite3
+
+
+def add_indexes(cursor):
+    """version 1: index containers for lookup by name (and tag, version)
+    within a collection, by name alone, and by uri.
+    """
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS ix_container_lookup "
+        "ON container (collection_id, name, tag, version)"
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_container_name ON container (name)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_container_uri ON container (uri)")
+    cursor.execute("ANALYZE")
+
+
+def add_search(cursor):
+    """version 2: a full text index of the uri, labels and metadata of each
+    container, if sqlite has fts5 (otherwise images are searched without it).
+    """
+    try:
+        cursor.execute(search.CREATE_TABLE)
+    except sqlite3.OperationalError:
+        bot.warning("sqlite does not have fts5, images will not be indexed.")
+        return
+
+    rows = cursor.execute("SELECT id, uri, name, tag, metrics FROM container")
+    for container_id, uri, name, tag, metrics in rows.fetchall():
+        uri = uri or "%s:%s" % (name, tag)
+        search.add(cursor.execute, container_id, uri, metrics)
+
+
+def add_columns(cursor):
+    """version 3: columns for the size, digest, architecture and build date
+    of each container, and a table of their labels, filled from the metrics
+    (and the image file, for the size).
+    """
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(container)")]
+    for name, kind in [
+        ("size", "INTEGER"),
+        ("digest", "VARCHAR(250)"),
+        ("architecture", "VARCHAR(50)"),
+        ("build_date", "VARCHAR(50)"),
+    ]:
+        if name not in columns:
+            cursor.execute("ALTER TABLE container ADD COLUMN %s %s" % (name, kind))
+
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS label (id INTEGER NOT NULL PRIMARY KEY, "
+        "key VARCHAR(250) NOT NULL, value TEXT, container_id INTEGER NOT NULL, "
+        "FOREIGN KEY(container_id) REFERENCES container (id))"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS ix_container_digest ON container (digest)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS ix_label_key_value ON label (key, value)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS ix_label_container ON label (container_id)"
+    )
+
+    rows = cursor.execute("SELECT id, image, metrics FROM container").fetchall()
+    for container_id, image, metrics in rows:
+        try:
+            metrics = json.loads(metrics or "{}")
+        except ValueError:
+            metrics = {}
+        fields = search.get_fields(metrics)
+        size = None
+        if image and os.path.exists(image):
+            size = os.path.getsize(image)
+
+        cursor.execute(
+            "UPDATE container SET size = ?, architecture = ?, build_date = ? "
+            "WHERE id = ?",
+            (size, fields["architecture"], fields["build_date"], container_id),
+        )
+
+        # The digest was kept in the metrics before it had a column
+        if "image_digest" in metrics:
+            digest = metrics.pop("image_digest")
+            cursor.execute(
+                "UPDATE container SET digest = ?, metrics = ? WHERE id = ?",
+                (digest, json.dumps(metrics), container_id),
+            )
+        cursor.execute("DELETE FROM label WHERE container_id = ?", (container_id,))
+        for key, value in search.get_labels(metrics).items():
+            cursor.execute(
+                "INSERT INTO label (key, value, container_id) VALUES (?, ?, ?)",
+                (key, value, container_id),
+            )
+    cursor.execute("ANALYZE")
+
+
+def add_file_hashes(cursor):
+    """version 4: a table of file hashes, by device, inode, size and time
+    modified (see FileHash), so images aren't hashed again.
+    """
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS file_hash (id INTEGER NOT NULL PRIMARY KEY, "
+        "device INTEGER NOT NULL, inode INTEGER NOT NULL, size INTEGER NOT NULL, "
+        "mtime INTEGER NOT NULL, algorithm VARCHAR(32) NOT NULL, "
+        "digest VARCHAR(128) NOT NULL, "
+        "CONSTRAINT _file_hash_uc UNIQUE (device, inode, algorithm))"
+    )
+
+
+# Each migration upgrades the schema by one version, kept in the database
+# as PRAGMA user_version. New migrations are only ever added to the end, and
+# must work on a new database too (e.g., CREATE ... IF NOT EXISTS).
+MIGRATIONS = [add_indexes, add_search, add_columns, add_file_hashes]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate(engine, metadata=None):
+    """upgrade the schema of a database to the current version, running the
+    migrations it doesn't have yet in one transaction. A database that is
+    up to date is only read. Otherwise it is locked for writing first, so
+    when many processes open it at once, one upgrades it and the others
+    find it upgraded. A new database (version 0) gets the tables of the
+    models first, in the same transaction.
+
+    Parameters
+    ==========
+    engine: the sqlalchemy engine for the database
+    metadata: the metadata of the models (Base.metadata), to create tables
+    """
+    # The sqlite3 connection, as dbapi_connection from sqlalchemy 1.4.24
+    connection = engine.raw_connection()
+    database = getattr(connection, "dbapi_connection", None) or connection.connection
+    isolation_level = database.isolation_level
+    database.isolation_level = None
+    cursor = database.cursor()
+    try:
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version < SCHEMA_VERSION:
+            cursor.execute("BEGIN IMMEDIATE")
+
+            # Another process might have upgraded it while we waited
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+            if version == 0 and metadata is not None:
+                create_tables(cursor, metadata, engine.dialect)
+
+            for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+                bot.debug("Upgrading database schema to version %s" % number)
+                migration(cursor)
+
+            cursor.execute("PRAGMA user_version = %d" % max(version, SCHEMA_VERSION))
+            cursor.execute("COMMIT")
+        search.enabled = has_table(cursor, "container_search")
+    except Exception:
+        if database.in_transaction:
+            cursor.execute("ROLLBACK")
+        raise
+    finally:
+        cursor.close()
+        database.isolation_level = isolation_level
+        connection.close()
+
+
+def create_tables(cursor, metadata, dialect):
+    """create the tables of the models that don't exist yet, with their
+    indexes. This replaces metadata.create_all, which can't run in the
+    transaction of the migrations.
+    """
+    from sqlalchemy.schema import CreateIndex, CreateTable
+
+    for table in metadata.sorted_tables:
+        if has_table(cursor, table.name):
+            continue
+        cursor.execute(str(CreateTable(table).compile(dialect=dialect)))
+        for index in table.indexes:
+            cursor.execute(str(CreateIndex(index).compile(dialect=dialect)))
+
+
+def has_table(cursor, name):
+    """determine if the database has a table (or virtual table)"""
+    query = "SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?"
+    return cursor.execute(query, (name,)).fetchone() is not None
@@ -10,21 +10,37 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from sqlalchemy import (
     create_engine,
+    event,
     Column,
     DateTime,
+    Index,
     Integer,
     String,
     Text,
     ForeignKey,
     func,
+    text,
 )
 
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.schema import UniqueConstraint
-from sqlalchemy.orm import backref, relationship, scoped_session, sessionmaker
+from sqlalchemy.orm import (
+    attributes,
+    backref,
+    deferred,
+    relationship,
+    scoped_session,
+    sessionmaker,
+)
 
 from sregistry.logger import bot
-from sregistry.defaults import SREGISTRY_STORAGE
+from sregistry.defaults import (
+    SREGISTRY_DATABASE_JOURNAL,
+    SREGISTRY_DATABASE_TIMEOUT,
+    SREGISTRY_STORAGE,
+)
+from sregistry.database.migrations import migrate
+from sregistry.database import search
 from uuid import uuid4
 import os
 
@@ -80,6 +96,14 @@ class Container(Base):
     client: the client backend associated with the image, the type(client)
     version: a version string associated with the image
     :collection_id: the id of the colletion to which the image belongs.
+    size: the size of the image file in bytes
+    digest: the digest of the content the image was built from (the config)
+    architecture: the architecture of the image (a label), if known
+    build_date: the date the image was built (a label), if known
+    labels: the labels of the image, in their own table to filter by
+
+    The metrics are only loaded when they are used (e.g., inspect), so
+    listing and filtering many containers reads the columns above.
 
     We index / filter containers based on the full uri, which is assembled
                from the <collection>/<namespace>:<tag>@<version>, then stored
@@ -89,7 +113,7 @@ class Container(Base):
     __tablename__ = "container"
     id = Column(Integer, primary_key=True)
     created_at = Column(DateTime, default=func.now())
-    metrics = Column(Text, nullable=False)
+    metrics = deferred(Column(Text, nullable=False))
     name = Column(String(250), nullable=False)
     tag = Column(String(250), nullable=False)
     image = Column(String(250), nullable=True)
@@ -98,11 +122,25 @@ class Container(Base):
     client = Column(String(50), nullable=False)
     version = Column(String(250), nullable=True)
     collection_id = Column(Integer, ForeignKey("collection.id"), nullable=False)
+    size = Column(Integer, nullable=True)
+    digest = Column(String(250), nullable=True)
+    architecture = Column(String(50), nullable=True)
+    build_date = Column(String(50), nullable=True)
+    labels = relationship(
+        "Label",
+        lazy="select",
+        cascade="all,delete-orphan",
+        backref=backref("container"),
+    )
 
     __table_args__ = (
         UniqueConstraint(
             "collection_id", "name", "tag", "client", "version", name="_container_uc"
         ),
+        Index("ix_container_lookup", "collection_id", "name", "tag", "version"),
+        Index("ix_container_name", "name"),
+        Index("ix_container_uri", "uri"),
+        Index("ix_container_digest", "digest"),
     )
 
     def __repr__(self):
@@ -125,6 +163,107 @@ class Container(Base):
         return uri
 
 
+class Label(Base):
+    """a label (key and value) of a container, to filter containers by
+
+    Parameters
+    ==========
+    key: the name of the label, e.g., org.label-schema.build-arch
+    value: the value of the label, as a string
+    container_id: the id of the container with the label
+    """
+
+    __tablename__ = "label"
+    id = Column(Integer, primary_key=True)
+    key = Column(String(250), nullable=False)
+    value = Column(Text, nullable=True)
+    container_id = Column(Integer, ForeignKey("container.id"), nullable=False)
+
+    __table_args__ = (
+        Index("ix_label_key_value", "key", "value"),
+        Index("ix_label_container", "container_id"),
+    )
+
+    def __repr__(self):
+        return "<Label %s=%s>" % (self.key, self.value)
+
+    def __str__(self):
+        return "%s=%s" % (self.key, self.value)
+
+
+class FileHash(Base):
+    """a hash of a file, known to be current while the file (device and
+    inode) has the same size and modification time. A file moved within a
+    filesystem keeps its inode, so the hash of an image computed (or
+    verified) before it's moved to storage is found after.
+
+    Parameters
+    ==========
+    device: the device of the filesystem with the file
+    inode: the inode of the file
+    size: the size of the file in bytes, when it was hashed
+    mtime: the modification time of the file (nanoseconds) when it was hashed
+    algorithm: the hashlib algorithm, e.g., sha256
+    digest: the hex digest of the file
+    """
+
+    __tablename__ = "file_hash"
+    id = Column(Integer, primary_key=True)
+    device = Column(Integer, nullable=False)
+    inode = Column(Integer, nullable=False)
+    size = Column(Integer, nullable=False)
+    mtime = Column(Integer, nullable=False)
+    algorithm = Column(String(32), nullable=False)
+    digest = Column(String(128), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("device", "inode", "algorithm", name="_file_hash_uc"),
+    )
+
+    def __repr__(self):
+        return "<FileHash %s:%s>" % (self.algorithm, self.digest)
+
+
+@event.listens_for(Container, "after_insert")
+@event.listens_for(Container, "after_update")
+def index_container(mapper, connection, container):
+    """update the search index when a container is added, or its uri or
+    metrics changed. Metrics that weren't loaded are read with the same
+    connection, since the session is flushing.
+    """
+    if not search.enabled:
+        return
+    passive = attributes.PASSIVE_NO_INITIALIZE
+    changed = [
+        attributes.get_history(container, key, passive=passive).has_changes()
+        for key in ["metrics", "name", "tag", "uri"]
+    ]
+    if not any(changed):
+        return
+
+    execute = get_execute(connection)
+    metrics = container.__dict__.get("metrics")
+    if metrics is None:
+        query = "SELECT metrics FROM container WHERE id = :id"
+        metrics = execute(query, {"id": container.id}).scalar()
+    uri = container.uri or "%s:%s" % (container.name, container.tag)
+    search.add(execute, container.id, uri, metrics)
+
+
+@event.listens_for(Container, "after_delete")
+def remove_container(mapper, connection, container):
+    """remove a container from the search index when it's deleted"""
+    if search.enabled:
+        search.remove(get_execute(connection), container.id)
+
+
+def get_execute(connection):
+    """return a function to execute sql with named parameters on a
+    connection, as text() so it works with sqlalchemy 1.3 and later.
+    """
+    return lambda query, params: connection.execute(text(query), params)
+
+
 def init_db(self, db_path):
     """initialize the database, with the default database path or custom of
 
@@ -156,7 +295,12 @@ def init_db(self, db_path):
         bot.exit("Insufficient permission to write to {}".format(parent_folder))
 
     bot.debug("Database located at %s" % self.database)
-    self.engine = create_engine(self.database, convert_unicode=True)
+    self.engine = create_engine(
+        self.database,
+        convert_unicode=True,
+        connect_args={"timeout": SREGISTRY_DATABASE_TIMEOUT},
+    )
+    event.listen(self.engine, "connect", set_journal_mode)
     self.session = scoped_session(
         sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
     )
@@ -166,5 +310,23 @@ def init_db(self, db_path):
     # import all modules here that might define models so that
     # they will be registered properly on the metadata.  Otherwise
     # you will have to import them first before calling init_db()
-    Base.metadata.create_all(bind=self.engine)
+    # The tables of a new database are created with the migrations, and an
+    # existing database is upgraded to the current schema
+    migrate(self.engine, Base.metadata)
     self.Base = Base
+
+
+def set_journal_mode(connection, record):
+    """set the journal mode for each connection to the database. With write
+    ahead logging (wal), readers don't wait for a writer, and a commit only
+    needs to sync the log.
+    """
+    journal = SREGISTRY_DATABASE_JOURNAL.lower()
+    if journal not in ["delete", "truncate", "persist", "memory", "wal", "off"]:
+        bot.warning("%s is not a valid journal mode, ignoring." % journal)
+        return
+    cursor = connection.cursor()
+    cursor.execute("PRAGMA journal_mode = %s" % journal)
+    if journal == "wal":
+        cursor.execute("PRAGMA synchronous = NORMAL")
+    cursor.close()
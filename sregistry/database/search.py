@@ -0,0 +1,141 @@
+"""
+
+sregistry.database.search: labels, fields and a full text index of
+container metadata
+
+Copyright (C) 2017-2021 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+import json
+import re
+
+# Set when the database is opened, False if sqlite doesn't have fts5
+enabled = False
+
+CREATE_TABLE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS container_search "
+    "USING fts5(uri, labels, metadata)"
+)
+
+# Matches of the uri rank above labels, and labels above other metadata
+SEARCH = (
+    "SELECT rowid FROM container_search WHERE container_search MATCH :match "
+    "ORDER BY bm25(container_search, 10.0, 5.0, 1.0)"
+)
+
+
+# Keys of the metrics that name the image (see parse_image_name and add),
+# the other values (that aren't lists or dictionaries) are labels
+NAME_FIELDS = [
+    "collection",
+    "image",
+    "original",
+    "registry",
+    "storage",
+    "tag",
+    "type",
+    "uri",
+    "url",
+    "version",
+]
+
+
+def get_labels(metrics):
+    """return the labels (a dictionary of strings) in the metrics of a
+    container, a dictionary or json. Labels from inspect are flattened into
+    the metrics (see get_metadata).
+    """
+    if not isinstance(metrics, dict):
+        try:
+            metrics = json.loads(metrics or "{}")
+        except ValueError:
+            metrics = {}
+
+    labels = {}
+    for key, value in metrics.items():
+        if key in NAME_FIELDS or value is None or isinstance(value, (dict, list)):
+            continue
+        labels[key] = str(value)
+    return labels
+
+
+def get_fields(metrics):
+    """return the fields of a container that have their own columns (other
+    than the size and digest, which aren't part of the metrics), from
+    the labels of the image.
+    """
+    labels = get_labels(metrics)
+    return {
+        "architecture": labels.get("org.label-schema.build-arch"),
+        "build_date": labels.get("org.label-schema.build-date"),
+    }
+
+
+def get_document(metrics):
+    """return the labels and metadata to index for the metrics (json) of a
+    container. Labels from inspect are flattened into the metrics (see
+    get_metadata), so each value that isn't a list or dictionary is a label
+    (key=value), and the others are indexed as metadata.
+    """
+    try:
+        metrics = json.loads(metrics or "{}")
+    except ValueError:
+        metrics = {}
+
+    labels = []
+    metadata = []
+    for key, value in metrics.items():
+        if isinstance(value, (dict, list)):
+            metadata.append(json.dumps({key: value}))
+        elif value is not None:
+            labels.append("%s=%s" % (key, value))
+    return "\n".join(labels), "\n".join(metadata)
+
+
+def add(execute, container_id, uri, metrics):
+    """add (or replace) the index of a container
+
+    Parameters
+    ==========
+    execute: a function to execute sql with named parameters (a dictionary),
+             e.g., cursor.execute
+    container_id: the id of the container, the rowid in the index
+    uri: the uri of the container
+    metrics: the metrics (json) of the container
+    """
+    labels, metadata = get_document(metrics)
+    remove(execute, container_id)
+    execute(
+        "INSERT INTO container_search (rowid, uri, labels, metadata) "
+        "VALUES (:id, :uri, :labels, :metadata)",
+        {"id": container_id, "uri": uri, "labels": labels, "metadata": metadata},
+    )
+
+
+def remove(execute, container_id):
+    """remove a container from the index"""
+    execute("DELETE FROM container_search WHERE rowid = :id", {"id": container_id})
+
+
+def get_phrase(text):
+    """return text as a quoted fts5 phrase, or None if it has no words"""
+    if not re.search(r"\w", text):
+        return None
+    return '"%s"' % text.replace('"', '""')
+
+
+def get_match(query=None):
+    """return the fts5 query for a search of text (each word a prefix), or
+    None to match all containers.
+    """
+    terms = []
+    for word in (query or "").split():
+        phrase = get_phrase(word)
+        if phrase is not None:
+            terms.append("%s*" % phrase)
+    return " AND ".join(terms) or None
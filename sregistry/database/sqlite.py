@@ -8,9 +8,10 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 """
 
+from sregistry.database import search
 from sregistry.logger import bot
 from sregistry.utils import copyfile, get_file_hash, parse_image_name, remove_uri
-from sqlalchemy import or_
+from sqlalchemy import and_, or_, text
 import os
 import json
 import shutil
@@ -61,6 +62,80 @@ def get_container(self, name, collection_id, tag="latest", version=None):
     return container
 
 
+def get_container_by_digest(self, digest):
+    """get the most recent container built from the content with a digest
+    (e.g., the config of a docker image), with an image file that still
+    exists, otherwise return None.
+    """
+    from sregistry.database.models import Container
+
+    containers = Container.query.filter(Container.digest == digest)
+    for container in containers.order_by(Container.id.desc()):
+        if container.image and os.path.exists(container.image):
+            return container
+    return None
+
+
+def get_image_hash(self, image_path, algorithm="sha256", compute=True):
+    """return the hash of an image file, from the table of file hashes if
+    the file (device and inode) hasn't changed since it was hashed (or
+    verified during a download), otherwise the file is hashed and the
+    table updated.
+
+    Parameters
+    ==========
+    image_path: the path to the image file
+    algorithm: the hashlib algorithm, sha256 by default
+    compute: if False, return None instead of hashing an unknown file
+    """
+    from sregistry.database.models import FileHash
+
+    stat = os.stat(image_path)
+    known = FileHash.query.filter_by(
+        device=stat.st_dev, inode=stat.st_ino, algorithm=algorithm
+    ).first()
+    if known and known.size == stat.st_size and known.mtime == stat.st_mtime_ns:
+        bot.debug("Found %s hash of %s" % (algorithm, image_path))
+        return known.digest
+    if not compute:
+        return None
+
+    digest = get_file_hash(image_path, algorithm)
+    self.add_image_hash(image_path, digest, algorithm, stat=stat)
+    return digest
+
+
+def add_image_hash(self, image_path, digest, algorithm=None, stat=None):
+    """record the hash of a file that is known (e.g., it was verified as
+    it was downloaded), so it isn't hashed again.
+
+    Parameters
+    ==========
+    image_path: the path to the file
+    digest: the hex digest, or <algorithm>:<hexdigest> (e.g., sha256:...)
+    algorithm: the hashlib algorithm, if not part of the digest
+    stat: the os.stat of the file when it was hashed, if known
+    """
+    from sregistry.database.models import FileHash
+
+    if algorithm is None:
+        algorithm, _, digest = digest.rpartition(":")
+        algorithm = algorithm or "sha256"
+
+    stat = stat or os.stat(image_path)
+    known = FileHash.query.filter_by(
+        device=stat.st_dev, inode=stat.st_ino, algorithm=algorithm
+    ).first()
+    if known is None:
+        known = FileHash(device=stat.st_dev, inode=stat.st_ino, algorithm=algorithm)
+        self.session.add(known)
+    known.size = stat.st_size
+    known.mtime = stat.st_mtime_ns
+    known.digest = digest
+    self.session.commit()
+    return digest
+
+
 # ACTIONS ######################################################################
 
 
@@ -101,28 +176,40 @@ def get(self, name, quiet=False):
     return container
 
 
-def images(self, query=None):
-    """List local images in the database, optionally with a query.
+def images(self, query=None, labels=None):
+    """List local images in the database, optionally with a query. If the
+    database has a full text index, images are ranked by how well their
+    uri, labels and metadata match the words of the query. The index only
+    matches words by prefix, so the images with a name, tag or uri that
+    contains the query (e.g., box for busybox) follow them.
 
     Paramters
     =========
     query: a string to search for in the container or collection name|tag|uri
+    labels: a list of labels (key=value, or a key) that images must have
     """
     from sregistry.database.models import Container
 
     rows = []
+    filters = get_label_filters(labels)
     if query is not None:
+        containers = []
+        if search.enabled:
+            containers = self.search_images(query, labels)
         like = "%" + query + "%"
-        containers = Container.query.filter(
+        for container in Container.query.filter(
             or_(
                 Container.name == query,
                 Container.tag.like(like),
                 Container.uri.like(like),
                 Container.name.like(like),
-            )
-        ).all()
+            ),
+            *filters
+        ):
+            if container not in containers:
+                containers.append(container)
     else:
-        containers = Container.query.all()
+        containers = Container.query.filter(*filters).all()
 
     if len(containers) > 0:
         message = "  [date]   [client]\t[uri]"
@@ -135,6 +222,47 @@ def images(self, query=None):
     return containers
 
 
+def get_label_filters(labels=None):
+    """return a filter of containers for each label, a key=value pair or a
+    key (with any value), from the table of labels.
+    """
+    from sregistry.database.models import Container, Label
+
+    filters = []
+    for label in labels or []:
+        key, equals, value = label.partition("=")
+        if equals:
+            filters.append(
+                Container.labels.any(and_(Label.key == key, Label.value == value))
+            )
+        else:
+            filters.append(Container.labels.any(Label.key == key))
+    return filters
+
+
+def search_images(self, query=None, labels=None):
+    """return containers from the full text index that match a query, and
+    have labels (see get_label_filters), with the best matches first.
+    """
+    from sregistry.database.models import Container
+
+    filters = get_label_filters(labels)
+    match = search.get_match(query)
+    if match is None:
+        return Container.query.filter(*filters).all()
+
+    result = self.session.execute(text(search.SEARCH), {"match": match})
+    ids = [row[0] for row in result]
+
+    # Load the containers in batches, within the limit of sqlite parameters
+    found = {}
+    for start in range(0, len(ids), 500):
+        batch = ids[start : start + 500]
+        for container in Container.query.filter(Container.id.in_(batch), *filters):
+            found[container.id] = container
+    return [found[i] for i in ids if i in found]
+
+
 def inspect(self, name):
     """Inspect a local image in the database, which typically includes the
     basic fields in the model.
@@ -145,7 +273,8 @@ def inspect(self, name):
         collection = container.collection.name
         fields = container.__dict__.copy()
         fields["collection"] = collection
-        fields["metrics"] = json.loads(fields["metrics"])
+        fields["metrics"] = json.loads(container.metrics)
+        fields["labels"] = {label.key: label.value for label in container.labels}
         del fields["_sa_instance_state"]
         fields["created_at"] = str(fields["created_at"])
         print(json.dumps(fields, indent=4, sort_keys=True))
@@ -326,6 +455,8 @@ def add(
     metadata=None,
     save=True,
     copy=False,
+    digest=None,
+    inspected=None,
 ):
     """get or create a container, including the collection to add it to.
     This function can be used from a file on the local system, or via a URL
@@ -340,6 +471,10 @@ def add(
     metadata: any extra metadata to keep for the image (dict)
     save: if True, move the image to the cache if it's not there
     copy: If True, copy the image instead of moving it.
+    digest: the digest of the content the image was built from (e.g., the
+            image config), so a later pull of the same content can reuse it.
+    inspected: the metadata of the image from inspect, if it's known (e.g.,
+               the metrics of an identical image), so it isn't inspected.
 
     image_name: a uri that gets parsed into a names object that looks like:
 
@@ -358,7 +493,7 @@ def add(
     If no version is found, the file hash is used.
     """
 
-    from sregistry.database.models import Container
+    from sregistry.database.models import Container, Label
 
     # We can only save if the image is provided
     if image_path is not None:
@@ -373,14 +508,17 @@ def add(
     bot.debug("Adding %s to registry" % names["uri"])
 
     # If Singularity is installed, inspect image for metadata
-    metadata = self.get_metadata(image_path, names=names)
+    if inspected is None:
+        metadata = self.get_metadata(image_path, names=names)
+    else:
+        metadata = dict(inspected, **names)
     collection = self.get_or_create_collection(names["collection"])
 
     # Get a hash of the file for the version, or use provided
     version = names.get("version")
     if not version:
         if image_path:
-            version = get_file_hash(image_path, "sha256")
+            version = self.get_image_hash(image_path, "sha256")
         else:
             version = ""  # we can't determine a version, not in API/no file
         names = parse_image_name(remove_uri(image_uri), version=version)
@@ -392,6 +530,11 @@ def add(
             image_name = self._get_storage_name(names)
         if copy:
             copyfile(image_path, image_name)
+
+        # A link to the image in storage (e.g., an unchanged image pulled)
+        elif os.path.exists(image_name) and os.path.samefile(image_path, image_name):
+            if os.path.abspath(image_path) != os.path.abspath(image_name):
+                os.remove(image_path)
         else:
             shutil.move(image_path, image_name)
         image_path = image_name
@@ -426,16 +569,27 @@ def add(
         self.session.add(container)
         collection.containers.append(container)
 
-    # The container existed, update it.
+    # The container existed, update it, the metadata is added to what we had
     else:
         action = "update"
         metrics = json.loads(container.metrics)
         metrics.update(metadata)
+        metadata = metrics
         container.url = url
         container.client = self.client_name
         if image_path is not None:
             container.image = image_path
-        container.metrics = json.dumps(metrics)
+        container.metrics = json.dumps(metadata)
+
+    # Fields to list and filter containers by have their own columns
+    for key, value in search.get_fields(metadata).items():
+        setattr(container, key, value)
+    labels = search.get_labels(metadata)
+    container.labels = [Label(key=key, value=labels[key]) for key in labels]
+    if digest is not None:
+        container.digest = digest
+    if image_path is not None and os.path.exists(image_path):
+        container.size = os.path.getsize(image_path)
 
     self.session.commit()
     bot.info("[container][%s] %s" % (action, names["uri"]))
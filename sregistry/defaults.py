@@ -92,6 +92,69 @@ SREGISTRY_THUMBNAIL = getenv("SREGISTRY_THUMBNAIL")
 
 SREGISTRY_WORKERS = int(getenv("SREGISTRY_PYTHON_THREADS", 9))
 
+# Run workers as a multiprocessing pool ("process") or pool of threads ("thread")
+SREGISTRY_WORKERS_ENGINE = getenv("SREGISTRY_WORKERS_ENGINE", "process")
+
+#########################
+# Http
+#########################
+
+# Keep-alive connection pools: number of hosts, and connections per host
+SREGISTRY_HTTP_POOLS = int(getenv("SREGISTRY_HTTP_POOLS", 10))
+SREGISTRY_HTTP_POOLSIZE = int(getenv("SREGISTRY_HTTP_POOLSIZE", SREGISTRY_WORKERS))
+
+#########################
+# Downloads
+#########################
+
+# Number of attempts for a download that fails digest verification or is
+# interrupted (a partial download is resumed with a Range request)
+SREGISTRY_DOWNLOAD_RETRIES = int(getenv("SREGISTRY_DOWNLOAD_RETRIES", 3))
+
+# Large files (e.g., images from hub, registry, gitlab) are downloaded in
+# segments of this many bytes, with this many segments at once (1 disables)
+SREGISTRY_DOWNLOAD_SEGMENTS = int(getenv("SREGISTRY_DOWNLOAD_SEGMENTS", 4))
+SREGISTRY_DOWNLOAD_SEGMENT_SIZE = int(
+    getenv("SREGISTRY_DOWNLOAD_SEGMENT_SIZE", 64 * 1024 * 1024)
+)
+
+# Extract each layer of a pull as soon as it's downloaded, while the next
+# layers are downloading, and keep layers in the cache (and blob store)
+SREGISTRY_PULL_PIPELINE = convert2boolean(getenv("SREGISTRY_PULL_PIPELINE", True))
+SREGISTRY_KEEP_LAYERS = convert2boolean(getenv("SREGISTRY_KEEP_LAYERS", True))
+
+# The platform (os/architecture[/variant], e.g., linux/arm64) to select from
+# a manifest list or OCI index, defaults to the host
+SREGISTRY_PLATFORM = getenv("SREGISTRY_PLATFORM")
+
+# Threads to decompress a layer (pigz for gzip) alongside its extraction,
+# 1 decompresses in the same thread as the extraction
+SREGISTRY_DECOMPRESS_THREADS = int(
+    getenv("SREGISTRY_DECOMPRESS_THREADS", os.cpu_count() or 1)
+)
+
+#########################
+# Uploads
+#########################
+
+# Images larger than this many bytes are pushed to swift as a large object,
+# in segments of this size, with this many segments uploaded at once
+SREGISTRY_SWIFT_SEGMENT_SIZE = int(
+    getenv("SREGISTRY_SWIFT_SEGMENT_SIZE", 256 * 1024 * 1024)
+)
+SREGISTRY_SWIFT_SEGMENTS = int(getenv("SREGISTRY_SWIFT_SEGMENTS", 4))
+
+# Images are pushed to dropbox in chunks of this many bytes (a multiple of
+# 4MB, 0 sizes chunks by the image), with this many chunks at once, and
+# attempts for each chunk
+SREGISTRY_DROPBOX_CHUNK_SIZE = int(getenv("SREGISTRY_DROPBOX_CHUNK_SIZE", 0))
+SREGISTRY_DROPBOX_CHUNKS = int(getenv("SREGISTRY_DROPBOX_CHUNKS", 4))
+SREGISTRY_DROPBOX_RETRIES = int(getenv("SREGISTRY_DROPBOX_RETRIES", 5))
+
+# Keep a catalog of pushed images in object storage (s3, swift, google-storage
+# and dropbox) for search, instead of walking every collection and image
+SREGISTRY_CATALOG = convert2boolean(getenv("SREGISTRY_CATALOG", False))
+
 #########################
 # Database and Storage
 #########################
@@ -121,6 +184,12 @@ if not DISABLE_CACHE and DISABLE_DATABASE is False:
     SREGISTRY_STORAGE = getenv("SREGISTRY_STORAGE", _storage)
     SREGISTRY_DATABASE = "%s/sregistry.db" % SREGISTRY_BASE
 
+# Seconds to wait for a lock on the database (e.g., job processes writing at
+# once), and the journal mode (wal lets readers run alongside a writer, use
+# delete for a database on a network filesystem without shared memory)
+SREGISTRY_DATABASE_TIMEOUT = float(getenv("SREGISTRY_DATABASE_TIMEOUT", 30))
+SREGISTRY_DATABASE_JOURNAL = getenv("SREGISTRY_DATABASE_JOURNAL", "wal")
+
 #########################
 # Caches
 #########################
@@ -130,10 +199,25 @@ DISABLE_CREDENTIAL_CACHE = getenv("SREGISTRY_DISABLE_CREDENTIAL_CACHE", False)
 DISABLE_CREDENTIAL_CACHE = convert2boolean(DISABLE_CREDENTIAL_CACHE)
 CREDENTIAL_CACHE = None
 
+# Registry tokens expiring within this many seconds are refreshed before use
+SREGISTRY_TOKEN_MARGIN = int(getenv("SREGISTRY_TOKEN_MARGIN", 60))
+
 # Download Cache for Singularity layers (not complete images)
 _cache = os.path.join(USERHOME, ".singularity")
 SINGULARITY_CACHE = getenv("SINGULARITY_CACHEDIR", default=_cache)
 
+# Content addressed store for layer blobs, shared by docker, nvidia and aws
+_blobs = os.path.join(SINGULARITY_CACHE, "blobs")
+SREGISTRY_BLOBS = getenv("SREGISTRY_BLOBS", default=_blobs)
+
+# Manifests (and image configs) shared by pulls. Those pulled by digest are
+# kept, and by tag are revalidated (If-None-Match) after a ttl in seconds
+_manifests = os.path.join(SINGULARITY_CACHE, "manifests")
+SREGISTRY_MANIFESTS = getenv("SREGISTRY_MANIFESTS", default=_manifests)
+SREGISTRY_MANIFEST_TTL = int(getenv("SREGISTRY_MANIFEST_TTL", 300))
+if DISABLE_CACHE:
+    SREGISTRY_MANIFESTS = None
+
 #########################
 # Temporary Storage
 #########################
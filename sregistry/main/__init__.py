@@ -96,9 +96,13 @@ def get_client(image=None, quiet=False, **kwargs):
             mv,
             rm,
             images,
+            search_images,
             inspect,
             rename,
             get_container,
+            get_container_by_digest,
+            get_image_hash,
+            add_image_hash,
             get_collection,
             get_or_create_collection,
         )
@@ -113,10 +117,14 @@ def get_client(image=None, quiet=False, **kwargs):
         Client.rename = rename
         Client.rm = rm
         Client.images = images
+        Client.search_images = search_images
 
         # Collections
         Client.get_or_create_collection = get_or_create_collection
         Client.get_container = get_container
+        Client.get_container_by_digest = get_container_by_digest
+        Client.get_image_hash = get_image_hash
+        Client.add_image_hash = add_image_hash
         Client.get_collection = get_collection
 
     # If no database, import dummy functions that return the equivalent
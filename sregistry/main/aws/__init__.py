@@ -22,7 +22,9 @@ from sregistry.main.docker.api import (
     get_size,
 )
 from sregistry.main.aws.api import (
+    download_images,
     download_layers,
+    remove_batch,
     update_token,
     get_digests,
     get_manifest,
@@ -114,6 +116,8 @@ Client.pull = pull
 Client._pull = _pull
 
 # Api functions for image layers and manifests (hidden)
+Client._download_images = download_images
+Client._remove_batch = remove_batch
 Client._download_layers = download_layers
 Client._get_digests = get_digests
 Client._get_download_cache = get_download_cache
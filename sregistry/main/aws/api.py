@@ -9,8 +9,11 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
 
 from sregistry.logger import bot
+from sregistry.main.base.batch import download_batch, remove_batch
+from sregistry.utils import get_tmpdir
 import json
 import os
+import shutil
 
 ################################################################################
 
@@ -18,7 +21,8 @@ import os
 def update_token(self):
     """update_token uses HTTP basic authentication to get a token for
     Docker registry API V2 operations. We get here if a 401 is
-    returned for a request.
+    returned for a request. The token is kept in a cache shared with
+    the layer download workers (and later pulls) until it expires.
 
     Parameters
     ==========
@@ -26,12 +30,14 @@ def update_token(self):
 
     https://docs.docker.com/registry/spec/auth/token/
     """
-    # Add Amazon headers
+    from sregistry.auth import get_token_cache
+    from sregistry.main.workers.aws import get_ecr_key, get_ecr_token
 
-    tokens = self.aws.get_authorization_token()
-    token = tokens["authorizationData"][0]["authorizationToken"]
+    # Add Amazon headers
+    key = get_ecr_key(self.base)
 
     try:
+        token = get_token_cache().get(key, lambda: get_ecr_token(self.aws))
         token = {"Authorization": "Basic %s" % token}
         self.headers.update(token)
 
@@ -39,7 +45,37 @@ def update_token(self):
         bot.exit("Error getting token.")
 
 
-def download_layers(self, repo_name, digest=None, destination=None):
+def download_images(self, names):
+    """download the layers of many images at once, for a batch pull (see
+    download_batch).
+
+    Parameters
+    ==========
+    names: a list of parsed image names (see parse_image_name)
+
+    Returns
+    =======
+    layers: a dictionary with the images (uri) that use each layer digest
+    """
+    from sregistry.main.workers.aws import download_task
+
+    def get_layers(name):
+        tag = name["version"] or name["tag"]
+        self._get_manifest(name["url"], tag)
+        return [
+            (
+                layer["digest"],
+                "%s/%s/blobs/%s" % (self.base, name["url"], layer["digest"]),
+                self.headers,
+            )
+            for layer in self._get_digests(name["url"], tag)
+        ]
+
+    self._update_token()
+    return download_batch(self, names, get_layers, download_task)
+
+
+def download_layers(self, repo_name, digest=None, destination=None, sandbox=None):
     """download layers is a wrapper to do the following for a client loaded
     with a manifest for an image:
 
@@ -47,44 +83,101 @@ def download_layers(self, repo_name, digest=None, destination=None):
     2. atomically download the list to destination (get_layers)
 
     This function uses the MultiProcess client to download layers
-    at the same time.
+    at the same time. Layers already present in the shared blob store
+    (e.g., pulled by another registry client) are not downloaded again.
+    If a sandbox is provided, each layer is extracted into it (in order)
+    as soon as it is downloaded, while the next layers are downloading.
+    If SREGISTRY_KEEP_LAYERS is false, these layers are downloaded to a
+    temporary folder and removed as soon as they are extracted. Layers in
+    the temporary store of a batch (see download_images) are linked too.
     """
-    from sregistry.main.workers import Workers
+    from sregistry.defaults import SREGISTRY_KEEP_LAYERS
+    from sregistry.main.docker.utils import extract_layer
+    from sregistry.main.workers import BlobStore, Workers
     from sregistry.main.workers.aws import download_task
 
     # Obtain list of digets, and destination for download
     self._get_manifest(repo_name, digest)
     digests = self._get_digests(repo_name, digest)
-    destination = self._get_download_cache(destination)
+    keep = sandbox is None or SREGISTRY_KEEP_LAYERS
+    if keep:
+        destination = self._get_download_cache(destination)
+    else:
+        destination = get_tmpdir(prefix="sregistry-layers")
 
     # Create multiprocess download client
     workers = Workers()
+    blobs = BlobStore()
+    batch = getattr(self, "batch_blobs", None)
 
     # Download each layer atomically
     tasks = []
     layers = []
-
-    # Start with a fresh token
-    self._update_token()
+    media_types = {}
 
     for digest in digests:
+        media_types[digest["digest"]] = digest.get("mediaType")
         targz = "%s/%s.tar.gz" % (destination, digest["digest"])
         url = "%s/%s/blobs/%s" % (self.base, repo_name, digest["digest"])
 
-        # Only download if not in cache already
-        if not os.path.exists(targz):
-            tasks.append((url, self.headers, targz))
+        # Layers in the blob store aren't downloaded, and cached layers are
+        # verified (by the download task) before they are used
+        if blobs.exists(digest["digest"]):
+            blobs.link(digest["digest"], targz)
+        elif batch is not None and batch.exists(digest["digest"]):
+            batch.link(digest["digest"], targz)
+        tasks.append((url, self.headers, targz, "layer", digest["digest"]))
         layers.append(targz)
 
+    def publish(targz):
+        digest = os.path.basename(targz).replace(".tar.gz", "")
+        if keep and os.path.exists(targz) and not blobs.exists(digest):
+            blobs.add(digest, targz)
+        return targz
+
+    def apply(targz):
+        digest = os.path.basename(targz).replace(".tar.gz", "")
+        extract_layer(targz, sandbox, media_type=media_types.get(digest))
+        if not keep:
+            os.remove(targz)
+        return publish(targz)
+
+    # Start with a fresh token, if any layers need to be downloaded
+    if not all(os.path.exists(task[2]) for task in tasks):
+        self._update_token()
+
+    # Extract each layer once it (and the layers before it) are downloaded
+    if sandbox is not None:
+        workers.run_ordered(func=download_task, tasks=tasks, apply=apply)
+
     # Download layers with multiprocess workers
-    if len(tasks) > 0:
+    else:
         workers.run(func=download_task, tasks=tasks)
 
+    # Publish the layers (downloaded, or cached and verified) to the blob store
+    for targz in layers:
+        publish(targz)
+
+    if not keep:
+        shutil.rmtree(destination)
     return layers, url
 
 
 def get_manifest(self, repo_name, tag):
-    """return the image manifest via the aws client, saved in self.manifest"""
+    """return the image manifest via the aws client, saved in self.manifest.
+    Manifests are kept in the manifest cache. A cached manifest that is no
+    longer fresh is revalidated with the image digest, and only requested
+    again (batch_get_image) if the digest of the tag changed.
+    """
+    from sregistry.main.base.manifests import get_manifest_cache
+
+    cache = get_manifest_cache()
+    url = "%s/%s/manifests/%s" % (self.base, repo_name, tag)
+    entry = cache.get(url)
+    if cache.is_fresh(entry):
+        bot.debug("Using cached manifest %s" % url)
+        self.manifest = entry["manifest"]
+        return self.manifest
 
     image = None
     repo = self.aws.describe_images(repositoryName=repo_name)
@@ -99,11 +192,17 @@ def get_manifest(self, repo_name, tag):
         bot.exit("Cannot find %s:%s, is the uri correct?" % (repo_name, tag))
 
     digest = image["imageDigest"]
+    if entry is not None and entry.get("etag") == digest:
+        bot.debug("Manifest %s was not modified" % url)
+        self.manifest = cache.touch(entry)["manifest"]
+        return self.manifest
+
     digests = self.aws.batch_get_image(
         repositoryName=repo_name, imageIds=[{"imageDigest": digest, "imageTag": tag}]
     )
 
     self.manifest = json.loads(digests["images"][0]["imageManifest"])
+    cache.add(url, self.manifest, etag=digest)
     return self.manifest
 
 
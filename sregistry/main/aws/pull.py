@@ -9,8 +9,10 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
 
 from spython.main import Client as Singularity
+from sregistry.defaults import SREGISTRY_PULL_PIPELINE
 from sregistry.logger import bot
-from sregistry.utils import get_tmpdir, parse_image_name, remove_uri, extract_tar
+from sregistry.main.docker.utils import extract_layer
+from sregistry.utils import get_tmpdir, parse_image_name, remove_uri
 import shutil
 import os
 
@@ -45,18 +47,28 @@ def pull(self, images, file_name=None, save=True, force=False, **kwargs):
 
     bot.debug("Execution of PULL for %s images" % len(images))
 
+    names = [
+        parse_image_name(remove_uri(image), default_collection="aws")
+        for image in images
+    ]
+
+    # A batch downloads the layers of all images first, each layer once
+    if len(names) > 1:
+        self._download_images(names)
+
     # If used internally we want to return a list to the user.
 
     finished = []
-    for image in images:
-        q = parse_image_name(remove_uri(image), default_collection="aws")
-
+    for q in names:
         image_file = self._pull(
             file_name=file_name, save=save, force=force, names=q, kwargs=kwargs
         )
 
         finished.append(image_file)
 
+    # The layers of a batch are removed, if they aren't kept
+    self._remove_batch()
+
     if len(finished) == 1:
         finished = finished[0]
     return finished
@@ -98,19 +110,22 @@ def _pull(self, file_name, names, save=True, force=False, **kwargs):
     # Build from sandbox
     sandbox = get_tmpdir(prefix="sregistry-sandbox")
 
-    # First effort, get image via Sregistry
-    layers, url = self._download_layers(names["url"], digest)
-
     # Add environment to the layers
     envtar = self._get_environment_tar()
-    layers = [envtar] + layers
-
-    # Create singularity image from an empty folder
-    for layer in layers:
-        bot.info("Exploding %s" % layer)
-        result = extract_tar(layer, sandbox, handle_whiteout=True)
-        if result["return_code"] != 0:
-            bot.exit(result["message"])
+
+    # Extract layers as they download, the environment first
+    if SREGISTRY_PULL_PIPELINE:
+        extract_layer(envtar, sandbox)
+        _, url = self._download_layers(names["url"], digest, sandbox=sandbox)
+
+    # First effort, get image via Sregistry
+    else:
+        layers, url = self._download_layers(names["url"], digest)
+        layers = [envtar] + layers
+
+        # Create singularity image from an empty folder
+        for layer in layers:
+            extract_layer(layer, sandbox)
 
     sudo = kwargs.get("sudo", False)
 
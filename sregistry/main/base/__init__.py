@@ -19,6 +19,7 @@ from sregistry.main.base.http import (
     delete,
     download,
     get,
+    get_segment,
     head,
     healthy,
     paginate_get,
@@ -26,6 +27,7 @@ from sregistry.main.base.http import (
     put,
     stream,
     stream_response,
+    stream_segments,
     verify,
 )
 
@@ -144,6 +146,7 @@ ApiConnection._call = call
 ApiConnection._delete = delete
 ApiConnection.download = download
 ApiConnection._get = get
+ApiConnection._get_segment = get_segment
 ApiConnection._head = head
 ApiConnection._healthy = healthy
 ApiConnection._paginate_get = paginate_get
@@ -151,4 +154,5 @@ ApiConnection._post = post
 ApiConnection._put = put
 ApiConnection.stream = stream
 ApiConnection._stream = stream_response
+ApiConnection._stream_segments = stream_segments
 ApiConnection._verify = verify
@@ -0,0 +1,93 @@
+"""
+
+sregistry.batch: download the layers of many images at once
+
+Copyright (C) 2017-2021 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+from sregistry.logger import bot
+from sregistry.utils import get_tmpdir
+import os
+import shutil
+
+
+def download_batch(self, names, get_layers, func):
+    """download the layers of many images at once, for a batch pull of the
+    docker, nvidia or aws clients. The manifests of all images are resolved
+    first (by get_layers), and then each unique layer (that isn't in the
+    download cache or blob store already) is downloaded once, by one pool
+    of workers, and published to the blob store. Each image is then
+    assembled by _pull, which finds its layers there. If
+    SREGISTRY_KEEP_LAYERS is false, the layers are published to a temporary
+    store of the batch instead (self.batch_blobs), that the pull removes
+    once all images are assembled (see remove_batch).
+
+    Parameters
+    ==========
+    names: a list of parsed image names (see parse_image_name)
+    get_layers: a function to resolve the manifests of an image (a name),
+                that returns its layers, a list of (digest, url, headers)
+    func: the task to download a layer with (see sregistry.main.workers)
+
+    Returns
+    =======
+    layers: a dictionary with the images (uri) that use each layer digest
+    """
+    from sregistry.defaults import SREGISTRY_KEEP_LAYERS
+    from sregistry.main.workers import BlobStore, Workers
+
+    if SREGISTRY_KEEP_LAYERS:
+        destination = self._get_download_cache(None)
+        self.batch_blobs = None
+        store = BlobStore()
+    else:
+        destination = get_tmpdir(prefix="sregistry-layers")
+        self.batch_blobs = BlobStore(get_tmpdir(prefix="sregistry-batch"))
+        store = self.batch_blobs
+
+    blobs = BlobStore()
+    layers = {}
+    tasks = []
+    for name in names:
+        for digest, url, headers in get_layers(name):
+            if digest in layers:
+                layers[digest].append(name["uri"])
+                continue
+            layers[digest] = [name["uri"]]
+
+            targz = "%s/%s.tar.gz" % (destination, digest)
+            if blobs.exists(digest):
+                blobs.link(digest, targz)
+            if not os.path.exists(targz):
+                tasks.append((url, headers, targz, "layer", digest))
+
+    bot.info(
+        "%s images have %s layers, %s unique, %s to download"
+        % (len(names), sum(len(x) for x in layers.values()), len(layers), len(tasks))
+    )
+    if len(tasks) > 0:
+        Workers().run(func=func, tasks=tasks)
+
+    # Publish the layers to the blob store, where each image pull finds them
+    for task in tasks:
+        targz, digest = task[2], task[4]
+        if os.path.exists(targz) and not store.exists(digest):
+            store.add(digest, targz)
+
+    if not SREGISTRY_KEEP_LAYERS:
+        shutil.rmtree(destination)
+    return layers
+
+
+def remove_batch(self):
+    """remove the temporary store of the layers of a batch pull, if layers
+    aren't kept (see download_batch)
+    """
+    if getattr(self, "batch_blobs", None) is not None:
+        shutil.rmtree(self.batch_blobs.root)
+        self.batch_blobs = None
@@ -0,0 +1,172 @@
+"""
+
+sregistry.main.base.catalog: an index of the images in object storage
+
+Copyright (C) 2017-2021 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+from sregistry.logger import bot
+from sregistry.defaults import SREGISTRY_CATALOG
+from datetime import datetime, timezone
+import json
+import random
+import re
+import time
+
+# Attempts to write a new version of the catalog when others are writing
+CATALOG_RETRIES = 10
+
+# Older versions are kept for readers that listed them before a write
+CATALOG_KEEP = 3
+
+
+class Catalog(object):
+    """a catalog of the images that a client (s3, swift, google-storage or
+    dropbox) has pushed, kept in storage with the images, so a search (or
+    the suggestions of a pull) is a list and a get instead of a walk of
+    every collection and image.
+
+    The catalog is versioned: each change writes the next version as a new
+    object (<prefix><version>.json) that must not exist yet, so when two
+    clients change the catalog at once, one of them finds that version
+    written, reads it, and tries again with its change. Older versions are
+    removed once a newer one is written.
+
+    The client provides the storage, as functions to list the names of
+    catalog objects with a prefix (_list_catalog), read one (_read_catalog,
+    None if it doesn't exist), create one (_create_catalog, False if it
+    already exists), and remove one (_delete_catalog). The first catalog is
+    made from a walk of the images (_list_images).
+
+    Each image is an entry (a dictionary) with a unique "path" (the object
+    name, or collection/object) and the fields the search of the client
+    shows, e.g., size and updated.
+    """
+
+    prefix = ".sregistry/catalog/"
+
+    def __init__(self, client):
+        self.client = client
+        self.versions = []
+
+    def __str__(self):
+        return "<Catalog %s>" % self.client.client_name
+
+    def get_name(self, version):
+        return "%s%012d.json" % (self.prefix, version)
+
+    def read(self):
+        """return the latest version of the catalog, and its images (by path),
+        or (None, None) if there isn't one.
+        """
+        self.versions = []
+        for name in self.client._list_catalog(self.prefix):
+            match = re.search(r"(\d+)\.json$", name)
+            if match:
+                self.versions.append(int(match.group(1)))
+        self.versions.sort()
+
+        # A writer can remove the latest version we found for a newer one
+        for version in reversed(self.versions[-2:]):
+            content = self.client._read_catalog(self.get_name(version))
+            if content is not None:
+                if isinstance(content, bytes):
+                    content = content.decode("utf-8")
+                images = json.loads(content)["images"]
+                return version, dict((image["path"], image) for image in images)
+        return None, None
+
+    def images(self):
+        """return the images in the catalog (a list of entries), or None if
+        there isn't a catalog yet.
+        """
+        _, images = self.read()
+        if images is None:
+            return None
+        return [images[path] for path in sorted(images)]
+
+    def update(self, add=None, remove=None):
+        """add (or replace) and remove images, writing a new version of the
+        catalog. If there isn't a catalog yet (or the latest versions can't
+        be read), it starts with the images of a walk of storage (that
+        includes the images added).
+
+        Parameters
+        ==========
+        add: a list of entries (dictionaries with a path) to add or replace
+        remove: a list of paths to remove
+        """
+        for attempt in range(CATALOG_RETRIES):
+            version, images = self.read()
+
+            # Versions that can't be read are replaced by the next version
+            if version is None:
+                version = self.versions[-1] if self.versions else 0
+                images = dict(
+                    (image["path"], image) for image in self.client._list_images()
+                )
+
+            for image in add or []:
+                images[image["path"]] = image
+            for path in remove or []:
+                images.pop(path, None)
+
+            content = json.dumps(
+                {
+                    "version": version + 1,
+                    "images": [images[path] for path in sorted(images)],
+                },
+                separators=(",", ":"),
+            )
+            if self.client._create_catalog(self.get_name(version + 1), content):
+                self.prune(version + 1)
+                return version + 1
+
+            # Another client wrote this version first
+            bot.debug("Catalog version %s exists, trying again." % (version + 1))
+            time.sleep(random.uniform(0, 0.05 * 2**attempt))
+
+        bot.warning("Could not update the catalog, others are writing to it.")
+
+    def prune(self, version):
+        """remove the versions (that were found) before the last few"""
+        for old in self.versions:
+            if old <= version - CATALOG_KEEP:
+                self.client._delete_catalog(self.get_name(old))
+
+
+def get_catalog(client):
+    """return the catalog of a client, or None if it's disabled
+    (SREGISTRY_CATALOG), e.g., for storage that other tools write to.
+    """
+    if SREGISTRY_CATALOG:
+        return Catalog(client)
+
+
+def get_images(client, walk):
+    """return the images of a client (a list of catalog entries), from the
+    catalog if there is one (a list and a read), otherwise from a walk of
+    the storage.
+
+    Parameters
+    ==========
+    client: the client, with the storage of the catalog (see Catalog)
+    walk: a function that returns the images from a walk of the storage
+    """
+    images = None
+    catalog = get_catalog(client)
+    if catalog is not None:
+        images = catalog.images()
+    if images is None:
+        images = walk()
+    return images
+
+
+def get_updated():
+    """return the time (now) for the updated field of an image"""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
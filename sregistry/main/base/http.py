@@ -10,14 +10,30 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 """
 
-from requests.exceptions import HTTPError
-import requests
-
-from sregistry.utils import get_tmpfile
+from requests.exceptions import ChunkedEncodingError, ConnectionError, HTTPError
+
+from sregistry.main.base.ranges import (
+    get_content_range,
+    get_resume_headers,
+    get_resume_metadata,
+    get_resume_offset,
+    lock_partial,
+    get_validator,
+    preallocate,
+    remove_partial,
+    save_resume_metadata,
+    save_segments_metadata,
+    seed_hasher,
+)
+from sregistry.main.base.session import get_session
+from sregistry.utils import get_partial_file
 from sregistry.logger import bot
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import shutil
 import json
+import os
 import sys
+import threading
 
 
 def delete(self, url, headers=None, return_json=True, default_headers=True):
@@ -26,7 +42,7 @@ def delete(self, url, headers=None, return_json=True, default_headers=True):
     return self._call(
         url,
         headers=headers,
-        func=requests.delete,
+        func=get_session().delete,
         return_json=return_json,
         default_headers=default_headers,
     )
@@ -35,7 +51,7 @@ def delete(self, url, headers=None, return_json=True, default_headers=True):
 def head(self, url):
     """head request, typically used for status code retrieval, etc."""
     bot.debug("HEAD %s" % url)
-    return self._call(url, func=requests.head)
+    return self._call(url, func=get_session().head)
 
 
 def healthy(self, url):
@@ -47,7 +63,7 @@ def healthy(self, url):
     url: the URL to check status for, based on the status_code of HEAD
 
     """
-    response = requests.get(url)
+    response = get_session().get(url)
     status_code = response.status_code
     if status_code != 200:
         bot.error("%s, response status code %s." % (url, status_code))
@@ -61,7 +77,7 @@ def put(self, url, headers=None, data=None, return_json=True, default_headers=Tr
     return self._call(
         url,
         headers=headers,
-        func=requests.put,
+        func=get_session().put,
         data=data,
         return_json=return_json,
         default_headers=default_headers,
@@ -75,7 +91,7 @@ def post(self, url, headers=None, data=None, return_json=True, default_headers=T
     return self._call(
         url,
         headers=headers,
-        func=requests.post,
+        func=get_session().post,
         data=data,
         return_json=return_json,
         default_headers=default_headers,
@@ -97,7 +113,7 @@ def get(
     return self._call(
         url,
         headers=headers,
-        func=requests.get,
+        func=get_session().get,
         data=data,
         return_json=return_json,
         default_headers=default_headers,
@@ -141,8 +157,15 @@ def verify(self):
     return not DISABLE_SSL_CHECK
 
 
-def download(self, url, file_name, headers=None, show_progress=True):
-    """stream to a temporary file, rename on successful completion
+def download(self, url, file_name, headers=None, show_progress=True, digest=None):
+    """stream to a partial file, rename on successful completion. We don't
+    check that the url exists first (e.g., with a HEAD request), the
+    response of the streaming GET tells us about existence and permission.
+    The partial file is named by the digest (or url, without a query string
+    that might hold a signature) so if a download is interrupted, the next
+    attempt (or the next pull) resumes it with a Range request. Unless
+    SREGISTRY_DOWNLOAD_SEGMENTS is 1, large files are downloaded in
+    segments (see stream_segments).
 
     Parameters
     ==========
@@ -151,25 +174,56 @@ def download(self, url, file_name, headers=None, show_progress=True):
     headers: additional headers to add
     force: If the final image exists, don't overwrite
     show_progress: boolean to show progress bar
+    digest: if provided, verify the content against this digest
     """
+    from sregistry.defaults import (
+        SREGISTRY_DOWNLOAD_RETRIES,
+        SREGISTRY_DOWNLOAD_SEGMENTS,
+    )
 
-    tmp_file = get_tmpfile(prefix="%s.tmp." % file_name)
-
-    # Should we verify the request?
-    verify = self._verify()
+    partial_file = get_partial_file(digest or url.split("?")[0])
 
-    # Check here if exists
-    if requests.head(url, verify=verify).status_code in [200, 401]:
-        response = self.stream(
-            url, headers=headers, stream_to=tmp_file, show_progress=show_progress
-        )
+    # Lock the partial file, another pull might be resuming the same download
+    with lock_partial(partial_file):
+        for attempt in range(1, SREGISTRY_DOWNLOAD_RETRIES + 1):
+            try:
+                if SREGISTRY_DOWNLOAD_SEGMENTS > 1:
+                    response = self._stream_segments(
+                        url,
+                        headers=headers,
+                        stream_to=partial_file,
+                        show_progress=show_progress,
+                        digest=digest,
+                    )
+                else:
+                    response = self.stream(
+                        url,
+                        headers=headers,
+                        stream_to=partial_file,
+                        show_progress=show_progress,
+                        quiet=True,
+                        resume=True,
+                        digest=digest,
+                    )
+                break
+            except (ChunkedEncodingError, ConnectionError) as e:
+                bot.warning(
+                    "Download of %s interrupted (attempt %s of %s): %s"
+                    % (url, attempt, SREGISTRY_DOWNLOAD_RETRIES, e)
+                )
+        else:
+            bot.exit("Error downloading %s, try again to resume." % url)
 
         if isinstance(response, HTTPError):
             bot.exit("Error downloading %s, exiting." % url)
 
-        shutil.move(tmp_file, file_name)
-    else:
-        bot.error("Invalid url or permissions %s" % url)
+        # A missing url or permission error (after a token refresh)
+        if response is None:
+            remove_partial(partial_file)
+            bot.error("Invalid url or permissions %s" % url)
+        else:
+            shutil.move(partial_file, file_name)
+            remove_partial(partial_file)
     return file_name
 
 
@@ -181,11 +235,14 @@ def stream(
     retry=True,
     default_headers=True,
     show_progress=True,
+    quiet=False,
+    resume=False,
+    digest=None,
 ):
     """
     stream is a get that will stream to file_name. This stream is intended
     to take a url and (optionally) a set of headers and file to stream to,
-    and will generate a response with requests.get.
+    and will generate a response with a (pooled) requests.get.
 
     Parameters
     ==========
@@ -195,37 +252,290 @@ def stream(
     show_progress: boolean to show progress bar
     retry: should the client retry? (intended for use after token refresh)
            by default we retry once after token refresh, then fail.
+    quiet: if True, return None for a missing url or permission error
+           (403, 404, or 401 after a retry) instead of exiting.
+    resume: if stream_to is a partial download, request the rest of it
+    digest: if provided, verify the content against this digest
     """
     bot.debug("GET %s" % url)
 
     # Ensure headers are present, update if not
-    if headers is None:
+    request_headers = headers
+    if request_headers is None:
         if self.headers is None:
             self._reset_headers()
-        headers = self.headers.copy()
+        request_headers = self.headers.copy()
+
+    if resume is True:
+        request_headers = dict(request_headers)
+        request_headers.update(get_resume_headers(stream_to, digest))
 
-    response = requests.get(url, headers=headers, verify=self._verify(), stream=True)
+    response = get_session().get(
+        url, headers=request_headers, verify=self._verify(), stream=True
+    )
 
     # Deal with token if necessary
     if response.status_code == 401 and retry is True:
         if hasattr(self, "_update_token"):
             self._update_token(response)
             return self.stream(
-                url, headers, stream_to, retry=False, show_progress=show_progress
+                url,
+                headers,
+                stream_to,
+                retry=False,
+                show_progress=show_progress,
+                quiet=quiet,
+                resume=resume,
+                digest=digest,
             )
 
-    if response.status_code == 200:
-        return self._stream(response, stream_to=stream_to, show_progress=show_progress)
+    # The partial download is no longer valid, start over
+    if response.status_code == 416 and "Range" in request_headers:
+        response.close()
+        remove_partial(stream_to)
+        return self.stream(
+            url,
+            headers,
+            stream_to,
+            retry=retry,
+            show_progress=show_progress,
+            quiet=quiet,
+            resume=resume,
+            digest=digest,
+        )
+
+    if response.status_code in [200, 206]:
+        if resume is True:
+            save_resume_metadata(stream_to, response)
+        return self._stream(
+            response, stream_to=stream_to, show_progress=show_progress, digest=digest
+        )
+
+    if quiet is True and response.status_code in [401, 403, 404]:
+        response.close()
+        return None
 
     bot.exit("Problem with stream, response %s" % (response.status_code))
 
 
-def stream_response(self, response, stream_to=None, show_progress=True):
+def stream_segments(
+    self, url, headers=None, stream_to=None, show_progress=True, digest=None
+):
+    """
+    stream_segments downloads a file as byte ranges (segments) that are
+    fetched at once (SREGISTRY_DOWNLOAD_SEGMENTS at a time) and written at
+    their offset into a preallocated file. The first range request tells us
+    the size of the file and if the server supports ranges, so we don't
+    need a HEAD request. If the server answers it with the whole file (200)
+    we stream that instead. Segments that were written are saved with the
+    validators of the file, so an interrupted download (the next attempt
+    of download) only requests the segments that are missing.
+
+    Parameters
+    ==========
+    url: the url to do a requests.get to
+    headers: any updated headers to use for the requests
+    stream_to: the (partial) file to download to
+    show_progress: boolean to show progress bar
+    digest: if provided, verify the content against this digest
+    """
+    from sregistry.defaults import (
+        SREGISTRY_DOWNLOAD_SEGMENTS,
+        SREGISTRY_DOWNLOAD_SEGMENT_SIZE,
+    )
+    from sregistry.main.workers.blobs import get_hasher, verify_digest
+
+    segment_size = SREGISTRY_DOWNLOAD_SEGMENT_SIZE
+    if show_progress is False:
+        bot.quiet = True
+
+    # Continue a segmented download, if it can be validated
+    metadata = get_resume_metadata(stream_to)
+    validator = get_validator(metadata)
+    done = set(metadata.get("segments", []))
+    first = None
+
+    resumable = done and (validator is not None or digest is not None)
+    size = os.path.getsize(stream_to) if os.path.exists(stream_to) else None
+    if not resumable or size != metadata.get("size"):
+        response = self._get_segment(url, headers, 0, segment_size - 1)
+
+        if response.status_code in [401, 403, 404]:
+            response.close()
+            return None
+
+        # The server doesn't support ranges, and sent the whole file
+        if response.status_code == 200:
+            bot.debug("%s does not support ranges, using one stream" % url)
+            save_resume_metadata(stream_to, response)
+            return self._stream(
+                response,
+                stream_to=stream_to,
+                show_progress=show_progress,
+                digest=digest,
+            )
+
+        content_range = get_content_range(response)
+        metadata = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "size": content_range[2] if content_range else None,
+        }
+
+        # Without a validator (or digest) to check them, segments of a file
+        # that changed would be stitched together, so one stream is used
+        checked = get_validator(metadata) is not None or digest is not None
+        if response.status_code != 206 or not metadata["size"] or not checked:
+            response.close()
+            remove_partial(stream_to)
+            return self.stream(
+                url,
+                headers,
+                stream_to,
+                show_progress=show_progress,
+                quiet=True,
+                resume=True,
+                digest=digest,
+            )
+
+        validator = get_validator(metadata)
+        done = set()
+        preallocate(stream_to, metadata["size"])
+        save_segments_metadata(stream_to, metadata, done)
+        first = response
+
+    size = metadata["size"]
+    starts = [start for start in range(0, size, segment_size) if start not in done]
+    progress = [size - sum(min(segment_size, size - start) for start in starts)]
+    lock = threading.Lock()
+    changed = threading.Event()
+    stopped = threading.Event()
+    bot.show_progress(progress[0], size, length=35)
+
+    def write_segment(start, response=None):
+        end = min(start + segment_size, size) - 1
+        if response is None:
+            response = self._get_segment(url, headers, start, end, validator)
+
+        # If-Range didn't match, the file changed since the download started
+        if response.status_code == 200:
+            response.close()
+            changed.set()
+            raise ConnectionError("%s changed during download" % url)
+
+        content_range = get_content_range(response)
+        if content_range is None or content_range[0] != start:
+            response.close()
+            raise ConnectionError(
+                "Response %s for bytes %s-%s" % (response.status_code, start, end)
+            )
+
+        # Write the segment only, a server might send more than we asked for
+        offset = start
+        for chunk in response.iter_content(chunk_size=1 << 20):
+            if stopped.is_set():
+                response.close()
+                raise ConnectionError("Download of %s was stopped" % url)
+            chunk = chunk[: end + 1 - offset]
+            os.pwrite(fd, chunk, offset)
+            offset += len(chunk)
+            with lock:
+                progress[0] += len(chunk)
+                bot.show_progress(
+                    iteration=progress[0],
+                    total=size,
+                    length=35,
+                    carriage_return=False,
+                )
+            if offset > end:
+                break
+        response.close()
+
+        if offset != end + 1:
+            raise ConnectionError(
+                "Connection closed at byte %s of %s-%s" % (offset, start, end)
+            )
+        with lock:
+            done.add(start)
+            save_segments_metadata(stream_to, metadata, done)
+
+    fd = os.open(stream_to, os.O_WRONLY)
+    try:
+        with ThreadPoolExecutor(max_workers=SREGISTRY_DOWNLOAD_SEGMENTS) as executor:
+            futures = [
+                executor.submit(write_segment, start, first if start == 0 else None)
+                for start in starts
+            ]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except (ChunkedEncodingError, ConnectionError):
+                stopped.set()
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        os.close(fd)
+
+        # A file that changed is removed once no segment is written to it
+        if changed.is_set():
+            remove_partial(stream_to)
+
+    # Newline to finish download
+    sys.stdout.write("\n")
+
+    # Segments are written out of order, so the digest is checked at the end
+    hasher = seed_hasher(get_hasher(digest), stream_to, size)
+    if hasher is not None and not verify_digest(digest, hasher):
+        remove_partial(stream_to)
+        bot.exit("Content of %s does not match %s" % (url, digest))
+
+    return stream_to
+
+
+def get_segment(self, url, headers, start, end, validator=None, retry=True):
+    """request a byte range (segment) of a url, refreshing the token once
+    for a 401 response. If a validator is provided, it is sent with If-Range
+    so a server responds with the whole file (200) if it has changed.
+
+    Parameters
+    ==========
+    url: the url to do a requests.get to
+    headers: any updated headers to use for the request
+    start: the first byte of the segment
+    end: the last byte of the segment (inclusive)
+    validator: the ETag or Last-Modified of the file, for If-Range
+    """
+    request_headers = headers
+    if request_headers is None:
+        if self.headers is None:
+            self._reset_headers()
+        request_headers = self.headers
+    request_headers = dict(request_headers)
+    request_headers["Range"] = "bytes=%s-%s" % (start, end)
+    if validator is not None:
+        request_headers["If-Range"] = validator
+
+    bot.debug("GET %s bytes=%s-%s" % (url, start, end))
+    response = get_session().get(
+        url, headers=request_headers, verify=self._verify(), stream=True
+    )
+
+    if response.status_code == 401 and retry is True:
+        if hasattr(self, "_update_token"):
+            response.close()
+            self._update_token(response)
+            return self._get_segment(url, headers, start, end, validator, retry=False)
+    return response
+
+
+def stream_response(self, response, stream_to=None, show_progress=True, digest=None):
     """
     stream response is one level higher up than stream, starting with a
     response object and then performing the stream without making the
     requests.get. The expectation is that the request was successful
-    (status code 20*).
+    (status code 20*). A partial content (206) response is appended to
+    the partial download in stream_to.
     show_progress: boolean to show progress bar
 
     Parameters
@@ -233,41 +543,85 @@ def stream_response(self, response, stream_to=None, show_progress=True):
     response: a response that is ready to be iterated over to download in
               streamed chunks
     stream_to: the file to stream to
+    digest: if provided, verify the content against this digest
 
 
     """
-    if response.status_code == 200:
+    if response.status_code in [200, 206]:
         if show_progress is False:
             bot.quiet = True
 
-        # Keep user updated with Progress Bar, if not quiet
-        content_size = None
-        if "Content-Length" in response.headers:
-            progress = 0
-            content_size = int(response.headers["Content-Length"])
-            bot.show_progress(progress, content_size, length=35)
-
-        chunk_size = 1 << 20
-        with open(stream_to, "wb") as filey:
-            for chunk in response.iter_content(chunk_size=chunk_size):
-                filey.write(chunk)
-                if content_size is not None:
-                    progress += chunk_size
-                    bot.show_progress(
-                        iteration=progress,
-                        total=content_size,
-                        length=35,
-                        carriage_return=False,
-                    )
-
-        # Newline to finish download
-        sys.stdout.write("\n")
-
+        # Content that doesn't match the digest was quarantined
+        if write_stream(response, stream_to, digest=digest) is None:
+            bot.exit("Content of %s does not match %s" % (response.url, digest))
         return stream_to
 
     bot.exit("Problem with stream, response %s" % (response.status_code))
 
 
+def write_stream(response, stream_to, digest=None, resume=False):
+    """write a successful (200 or 206) streaming response to stream_to, the
+    one place a download is written for the client and the workers. A
+    partial content (206) response is appended to the partial download,
+    and with resume the validators of the response are saved so the
+    download can be resumed if the connection closes early (and a
+    ConnectionError is raised). If a digest is provided, chunks are hashed
+    as they are written, and a file that doesn't match is quarantined
+    (and None returned).
+
+    Parameters
+    ==========
+    response: a response that is ready to be iterated over in chunks
+    stream_to: the file to stream to
+    digest: if provided, verify the content against this digest
+    resume: save the metadata needed to resume the download
+    """
+    from sregistry.main.workers.blobs import BlobStore, get_hasher, verify_digest
+
+    if resume is True:
+        save_resume_metadata(stream_to, response)
+    offset = get_resume_offset(response, stream_to)
+    hasher = seed_hasher(get_hasher(digest), stream_to, offset)
+
+    # Keep user updated with Progress Bar, if not quiet
+    progress = offset
+    content_size = None
+    if "Content-Length" in response.headers:
+        content_size = offset + int(response.headers["Content-Length"])
+        bot.show_progress(progress, content_size, length=35)
+
+    chunk_size = 1 << 20
+    with open(stream_to, "ab" if offset else "wb") as filey:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            filey.write(chunk)
+            progress += len(chunk)
+            if hasher is not None:
+                hasher.update(chunk)
+            if content_size is not None:
+                bot.show_progress(
+                    iteration=progress,
+                    total=content_size,
+                    length=35,
+                    carriage_return=False,
+                )
+
+    # Newline to finish download
+    sys.stdout.write("\n")
+
+    # The connection closed early, what we have can be resumed
+    if content_size is not None and progress < content_size:
+        raise ConnectionError(
+            "Connection closed at %s of %s bytes" % (progress, content_size)
+        )
+
+    # Never keep content that doesn't match the digest that names it
+    if hasher is not None and not verify_digest(digest, hasher):
+        BlobStore().quarantine(digest, stream_to)
+        return None
+
+    return stream_to
+
+
 def call(
     self,
     url,
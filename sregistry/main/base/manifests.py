@@ -0,0 +1,139 @@
+"""
+
+sregistry.manifests: a persistent cache of manifests shared by pulls
+
+Copyright (C) 2017-2021 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+from sregistry.logger import bot
+from sregistry.utils import mkdir_p, read_json, write_json
+import hashlib
+import os
+import re
+import threading
+import time
+
+# One manifest cache per process, shared by threads
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class ManifestCache(object):
+    """A cache of manifests (and image configs) on disk, shared by pulls of
+    the docker, nvidia and aws clients (e.g., the tasks of a job array).
+    Entries are keyed by the manifest url (registry, repository and
+    reference) and the accepted media types, and are kept as json files
+    under fan-out folders:
+
+        <root>/ab/abcdef....json
+
+    A reference that is a digest can't change, so it's cached for good. A
+    tag is fresh for ttl seconds, and after that the caller revalidates it
+    (e.g., with If-None-Match and the saved ETag) and calls touch if it
+    didn't change.
+
+    Parameters
+    ==========
+    root: the folder for the cache. If None, nothing is cached.
+    ttl: seconds that a manifest for a tag is used without revalidation
+    """
+
+    def __init__(self, root=None, ttl=300):
+        self.root = root
+        self.ttl = ttl
+
+    def __str__(self):
+        return "[manifests][%s]" % self.root
+
+    def __repr__(self):
+        return self.__str__()
+
+    def path(self, url, accept=None):
+        """return the path to the cache entry for a url and accepted types"""
+        key = "%s %s" % (url, accept or "")
+        key = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, key[0:2], "%s.json" % key)
+
+    def get(self, url, accept=None):
+        """return the cache entry (with the manifest, etag and time it was
+        validated) for a url, or None if it isn't cached.
+        """
+        if self.root is None:
+            return None
+        filename = self.path(url, accept)
+        if not os.path.exists(filename):
+            return None
+        try:
+            return read_json(filename)
+        except ValueError:
+            bot.warning("Ignoring malformed manifest cache %s" % filename)
+        return None
+
+    def is_fresh(self, entry):
+        """determine if a cache entry can be used without revalidation"""
+        if entry is None:
+            return False
+        if entry.get("pinned"):
+            return True
+        return time.time() - entry.get("time", 0) < self.ttl
+
+    def add(self, url, manifest, accept=None, etag=None):
+        """add (or replace) the manifest for a url, and return the entry
+
+        Parameters
+        ==========
+        url: the url of the manifest, ending with the reference
+        manifest: the manifest (or image config) to cache
+        accept: the media types that were accepted for the manifest
+        etag: the validator to revalidate the manifest with
+        """
+        entry = {
+            "url": url,
+            "accept": accept,
+            "etag": etag,
+            "pinned": is_pinned(url),
+            "time": time.time(),
+            "manifest": manifest,
+        }
+        if self.root is not None:
+            self._write(self.path(url, accept), entry)
+        return entry
+
+    def touch(self, entry):
+        """mark a cache entry as validated now (e.g., after a 304)"""
+        return self.add(
+            entry["url"], entry["manifest"], accept=entry["accept"], etag=entry["etag"]
+        )
+
+    def _write(self, filename, entry):
+        """write an entry atomically, so concurrent pulls never read half"""
+        mkdir_p(os.path.dirname(filename))
+        tmp_file = "%s.tmp.%s.%s" % (filename, os.getpid(), threading.get_ident())
+        write_json(entry, tmp_file, print_pretty=False)
+        os.rename(tmp_file, filename)
+
+
+def is_pinned(url):
+    """determine if a manifest url ends with a digest (sha256:...), and so
+    its content can't change.
+    """
+    reference = url.rstrip("/").rsplit("/", 1)[-1]
+    return re.match("^[a-z0-9]+:[a-f0-9]{32,}$", reference) is not None
+
+
+def get_manifest_cache():
+    """return the manifest cache for the current process, in
+    SREGISTRY_MANIFESTS (or disabled if the Singularity cache is).
+    """
+    from sregistry.defaults import SREGISTRY_MANIFESTS, SREGISTRY_MANIFEST_TTL
+
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ManifestCache(SREGISTRY_MANIFESTS, ttl=SREGISTRY_MANIFEST_TTL)
+    return _cache
@@ -0,0 +1,192 @@
+"""
+
+sregistry.ranges: helpers to resume partial downloads with Range requests
+
+Copyright (C) 2017-2021 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+from sregistry.logger import bot
+from sregistry.utils import read_json, write_json
+from contextlib import contextmanager
+import fcntl
+import os
+import re
+
+
+def get_resume_headers(filename, digest=None):
+    """return headers to resume a partial download, or an empty dictionary
+    to start from byte zero. A partial download is only resumed if we can
+    tell that the content hasn't changed since it was started: the server
+    honors the If-Range validator (ETag or Last-Modified) that we saved, or
+    the final content is verified against a digest.
+
+    Parameters
+    ==========
+    filename: the partial download
+    digest: the digest that the final content will be verified against
+    """
+    if not os.path.exists(filename):
+        return {}
+
+    size = os.path.getsize(filename)
+    if size == 0:
+        return {}
+
+    # A segmented download is preallocated, and can't be resumed at the end
+    metadata = get_resume_metadata(filename)
+    if "segments" in metadata:
+        return {}
+
+    validator = get_validator(metadata)
+    if validator is None and digest is None:
+        bot.debug("Cannot validate partial download %s, restarting." % filename)
+        return {}
+
+    bot.info("Resuming download from byte %s" % size)
+    headers = {"Range": "bytes=%s-" % size}
+    if validator is not None:
+        headers["If-Range"] = validator
+    return headers
+
+
+def get_validator(metadata):
+    """return the validator to send with If-Range for a partial download,
+    the ETag (if it isn't weak) or Last-Modified, or None if neither exist.
+    """
+    validator = metadata.get("etag")
+
+    # A weak ETag can't be used with If-Range
+    if validator is None or validator.startswith("W/"):
+        validator = metadata.get("last_modified")
+    return validator
+
+
+def get_content_range(response):
+    """return the (start, end, total) of the Content-Range of a partial
+    (206) response, or None if it isn't provided. The total is None if the
+    server doesn't know it.
+    """
+    match = re.match(
+        r"bytes\s+(\d+)-(\d+)/(\d+|\*)", response.headers.get("Content-Range", "")
+    )
+    if not match:
+        return None
+    start, end, total = match.groups()
+    return int(start), int(end), None if total == "*" else int(total)
+
+
+def get_resume_metadata(filename):
+    """return the validators saved for a partial download"""
+    metadata_file = "%s.json" % filename
+    if os.path.exists(metadata_file):
+        try:
+            return read_json(metadata_file)
+        except ValueError:
+            pass
+    return {}
+
+
+def save_resume_metadata(filename, response):
+    """save the validators (ETag and Last-Modified) of a full (200) response
+    next to the partial download, to send back with If-Range on resume.
+    """
+    if response.status_code != 200:
+        return
+    metadata = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+    write_json(metadata, "%s.json" % filename, print_pretty=False)
+
+
+def save_segments_metadata(filename, metadata, segments):
+    """save the validators and total size of a segmented download, along
+    with the start of each segment that was written, so an interrupted
+    download only requests the segments that are missing.
+    """
+    metadata = dict(metadata)
+    metadata["segments"] = sorted(segments)
+    write_json(metadata, "%s.json" % filename, print_pretty=False)
+
+
+def get_resume_offset(response, filename):
+    """return the byte offset that a response starts at: zero for a full
+    (200) response, or the start of the Content-Range of a partial (206)
+    response, which must be the size of the partial download.
+    """
+    if response.status_code != 206:
+        return 0
+
+    content_range = get_content_range(response)
+    size = os.path.getsize(filename) if os.path.exists(filename) else 0
+    if content_range is None or content_range[0] != size:
+        bot.exit(
+            "Unexpected Content-Range %s for partial download of %s bytes"
+            % (response.headers.get("Content-Range"), size)
+        )
+    return size
+
+
+def seed_hasher(hasher, filename, offset):
+    """update a hasher with the first offset bytes of a partial download,
+    so the digest of the resumed download covers the whole file.
+    """
+    if hasher is None or offset == 0:
+        return hasher
+    with open(filename, "rb") as filey:
+        for chunk in iter(lambda: filey.read(1 << 20), b""):
+            hasher.update(chunk)
+    return hasher
+
+
+def preallocate(filename, size):
+    """preallocate a file of a given size for a segmented download, so that
+    segments can be written at their offset in any order.
+    """
+    with open(filename, "r+b" if os.path.exists(filename) else "wb") as filey:
+        filey.truncate(size)
+        try:
+            os.posix_fallocate(filey.fileno(), 0, size)
+        except (AttributeError, OSError):
+            pass
+    return filename
+
+
+def remove_partial(filename):
+    """remove a partial download and the validators saved for it"""
+    for path in [filename, "%s.json" % filename]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+@contextmanager
+def lock_partial(filename):
+    """hold an exclusive lock on a partial download, for another pull that
+    might be resuming the same download. The lock is a file of its own
+    (<partial>.lock). Once the partial file is moved or removed (the
+    download finished, or can't be resumed) the lock file is removed while
+    it's held, so a pull that was waiting on it finds the file it locked
+    gone, and locks a new one.
+    """
+    lock_file = "%s.lock" % filename
+    while True:
+        lock = open(lock_file, "a")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if os.path.samestat(os.fstat(lock.fileno()), os.stat(lock_file)):
+                break
+        except FileNotFoundError:
+            pass
+        lock.close()
+
+    try:
+        yield lock
+    finally:
+        if not os.path.exists(filename):
+            os.remove(lock_file)
+        lock.close()
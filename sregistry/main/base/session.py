@@ -0,0 +1,81 @@
+"""
+
+sregistry.session: pooled, keep-alive http sessions shared by a process
+
+Copyright (C) 2017-2021 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+from requests.adapters import HTTPAdapter
+import requests
+
+from sregistry.defaults import SREGISTRY_HTTP_POOLS, SREGISTRY_HTTP_POOLSIZE
+from sregistry.logger import bot
+import os
+import threading
+
+# One session per process, created on first use
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """return the requests.Session for the current process. The session keeps
+    connections alive and pooled per host, so repeated requests to the same
+    registry (manifests, layers, tokens) reuse one TLS connection instead
+    of a handshake per request. Connections can't be shared across a fork,
+    so each process of the Workers pool creates its own session on first
+    use, and threads within a process share it.
+    """
+    global _session, _session_pid
+
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                bot.debug(
+                    "Creating http session (%s hosts, %s connections per host)"
+                    % (SREGISTRY_HTTP_POOLS, SREGISTRY_HTTP_POOLSIZE)
+                )
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=SREGISTRY_HTTP_POOLS,
+                    pool_maxsize=SREGISTRY_HTTP_POOLSIZE,
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+                _session_pid = pid
+    return _session
+
+
+def get_session_stats():
+    """return statistics about connection reuse for the session of the
+    current process, summed over the connection pools for each host:
+
+    hosts: the number of hosts with a connection pool
+    connections: the number of connections opened (each is a handshake)
+    requests: the number of requests made
+    reused: the number of requests that reused an open connection
+    """
+    stats = {"hosts": 0, "connections": 0, "requests": 0, "reused": 0}
+    if _session is None or _session_pid != os.getpid():
+        return stats
+
+    for adapter in set(_session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats["hosts"] += 1
+            stats["connections"] += pool.num_connections
+            stats["requests"] += pool.num_requests
+
+    stats["reused"] = max(stats["requests"] - stats["connections"], 0)
+    return stats
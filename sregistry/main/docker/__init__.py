@@ -19,14 +19,19 @@ import os
 # folder that you add to your client (at the bottom)
 from .api import (
     create_metadata_tar,
+    download_images,
     download_layers,
+    remove_batch,
     get_manifest_selfLink,
     get_config,
     get_digests,
+    get_image_digest,
     get_layer,
     get_layerLink,
     get_manifest,
     get_manifests,
+    get_cached_manifest,
+    wait_manifests,
     get_download_cache,
     get_size,
     extract_env,
@@ -35,7 +40,7 @@ from .api import (
     update_token,
     get_environment_tar,
 )
-from .pull import _pull, pull
+from .pull import _build_image, _pull, pull
 
 
 class Client(ApiConnection):
@@ -70,19 +75,25 @@ class Client(ApiConnection):
             "Content-Type": "application/json; charset=utf-8",
         }
 
+    def _get_registry(self, image):
+        """return the registry of an image name, if it isn't the default
+        (None), for the base to be updated to (see _update_base)
+        """
+        # Google Container Cloud
+        if "gcr.io" in image:
+            return "gcr.io"
+
     def _update_base(self, image):
         """update a base based on an image name, meaning detecting a particular
         registry and if necessary, updating the self.base. When the image
-        name is parsed, the base will be given to remove the registry.
+        name is parsed, the base will be given to remove the registry. An
+        image of the default registry sets the default base again, so the
+        registry of one image isn't used for the next.
         """
-        base = None
-
-        # Google Container Cloud
-        if "gcr.io" in image:
-            base = "gcr.io"
-            self._set_base(default_base=base)
+        base = self._get_registry(image)
+        self._set_base(default_base=base)
+        if base is not None:
             self._update_secrets()
-
         return base
 
     def _set_base(self, default_base=None):
@@ -173,21 +184,27 @@ class Client(ApiConnection):
 # Functions exposed to the client
 Client.pull = pull
 Client._pull = _pull
+Client._build_image = _build_image
 
 # Api functions for image layers and manifests (hidden)
 Client._create_metadata_tar = create_metadata_tar
+Client._download_images = download_images
+Client._remove_batch = remove_batch
 Client._download_layers = download_layers
 Client._extract_runscript = extract_runscript
 Client._extract_labels = extract_labels
 Client._extract_env = extract_env
 Client._get_config = get_config
 Client._get_digests = get_digests
+Client._get_image_digest = get_image_digest
 Client._get_download_cache = get_download_cache
 Client._get_layer = get_layer
 Client._get_layerLink = get_layerLink
 Client._get_manifest = get_manifest
 Client._get_manifests = get_manifests
+Client._get_cached_manifest = get_cached_manifest
 Client._get_size = get_size
 Client._update_token = update_token
+Client._wait_manifests = wait_manifests
 Client._get_manifest_selfLink = get_manifest_selfLink
 Client._get_environment_tar = get_environment_tar
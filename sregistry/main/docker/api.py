@@ -10,8 +10,10 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from sregistry.defaults import SINGULARITY_CACHE
 from sregistry.logger import bot
+from sregistry.main.base.batch import download_batch, remove_batch
 from sregistry.utils import get_tmpdir, mkdir_p, print_json
-from .utils import get_template, create_tar
+from .utils import get_template, create_tar, extract_layer, select_manifest
+from concurrent.futures import ThreadPoolExecutor
 import json
 import math
 import os
@@ -23,39 +25,75 @@ import tempfile
 ###############################################################################
 
 
-def update_token(self, response):
+def update_token(self, response=None, repository=None):
     """update_token uses HTTP basic authentication to get a token for
     Docker registry API V2 operations. We get here if a 401 is
-    returned for a request.
+    returned for a request. Tokens are kept in a cache shared with the
+    layer download workers (and later pulls) until they expire. Without
+    a response, the token of the last challenge is refreshed if it
+    expires soon, so workers don't start with a token about to expire.
 
     Parameters
     ==========
     response: the http request response to parse for the challenge.
+    repository: without a response, the repository to get a token for from
+                the realm of the last challenge (e.g., the next image of a
+                batch), instead of the repository of the challenge.
 
     https://docs.docker.com/registry/spec/auth/token/
     """
+    from sregistry.auth import get_token_cache, get_token_key
+
+    rejected = None
+    if response is None:
+        if not hasattr(self, "_token_url"):
+            return
+        if repository is not None:
+            self._token_url = re.sub(
+                "scope=repository:[^:&]+:",
+                "scope=repository:%s:" % repository,
+                self._token_url,
+            )
 
-    not_asking_auth = "Www-Authenticate" not in response.headers
-    if response.status_code != 401 or not_asking_auth:
-        bot.exit("Authentication error, exiting.")
-
-    challenge = response.headers["Www-Authenticate"]
-    regexp = '^Bearer\s+realm="(.+)",service="(.+)",scope="(.+)",?'
-    match = re.match(regexp, challenge)
-
-    if not match:
-        bot.exit("Unrecognized authentication challenge, exiting.")
-
-    realm = match.group(1)
-    service = match.group(2)
-    scope = match.group(3).split(",")[0]
-    token_url = realm + "?service=" + service + "&expires_in=900&scope=" + scope
-
-    # Default headers must be False so that client's current headers not used
-    response = self._get(token_url)
+    else:
+        not_asking_auth = "Www-Authenticate" not in response.headers
+        if response.status_code != 401 or not_asking_auth:
+            bot.exit("Authentication error, exiting.")
+
+        challenge = response.headers["Www-Authenticate"]
+        regexp = '^Bearer\s+realm="(.+)",service="(.+)",scope="(.+)",?'
+        match = re.match(regexp, challenge)
+
+        if not match:
+            bot.exit("Unrecognized authentication challenge, exiting.")
+
+        realm = match.group(1)
+        service = match.group(2)
+        scope = match.group(3).split(",")[0]
+        self._token_url = (
+            realm + "?service=" + service + "&expires_in=900&scope=" + scope
+        )
+
+        # The token that was sent with the request was rejected
+        rejected = self.headers.get("Authorization", "").replace("Bearer ", "", 1)
+
+    # Tokens for different credentials are cached separately
+    auth = self.headers.get("Authorization", "")
+    if not auth.startswith("Basic"):
+        auth = getattr(self, "_basic_auth", "")
+    self._basic_auth = auth
+
+    def fetch():
+        # Ask for the token with the basic credential (not a prior token)
+        headers = None
+        if auth:
+            headers = {"Authorization": auth}
+        response = self._get(self._token_url, headers=headers)
+        return response["token"], response.get("expires_in")
 
     try:
-        token = response["token"]
+        key = get_token_key(self._token_url, auth)
+        token = get_token_cache().get(key, fetch, rejected=rejected)
         token = {"Authorization": "Bearer %s" % token}
         self.headers.update(token)
 
@@ -63,40 +101,81 @@ def update_token(self, response):
         bot.exit("Error getting token.")
 
 
-def get_manifests(self, repo_name, digest=None):
-    """get_manifests calls get_manifest for each of the schema versions,
-    including v2 and v1. Version 1 includes image layers and metadata,
-    and version 2 must be parsed for a specific manifest, and the 2nd
-    call includes the layers. If a digest is not provided
-    latest is used.
+def get_manifests(self, repo_name, digest=None, config=True):
+    """get_manifests negotiates the image manifest with one request that
+    accepts any manifest type (OCI or Docker, version 2 or 1). If the
+    registry returns a manifest list (or OCI index), the manifest for the
+    platform (SREGISTRY_PLATFORM, or the host) is requested by its digest.
+    A version 2 manifest is saved as v2, and its image config is requested
+    in the background, so layers can be downloaded as soon as the manifest
+    is returned (see wait_manifests). A version 1 manifest is saved as v1,
+    and as the config (its history has the metadata). If a digest is not
+    provided latest is used.
 
     Parameters
     ==========
     repo_name: reference to the <username>/<repository>:<tag> to obtain
     digest: a tag or shasum version
+    config: if False, the image config isn't requested (e.g., to find the
+            layers of a batch, where each image is pulled later)
 
     """
 
     if not hasattr(self, "manifests"):
         self.manifests = {}
 
-    # Obtain schema version 1 (metadata) and 2, and image config
-    schemaVersions = ["v1", "v2", "config"]
-    for schemaVersion in schemaVersions:
-        manifest = self._get_manifest(repo_name, digest, schemaVersion)
-        if manifest is not None:
-            # If we don't have a config yet, try to get from version 2 manifest
-            if schemaVersion == "v2" and "config" in manifest:
-                bot.debug("Attempting to get config as blob in verison 2 manifest")
-                url = self._get_layerLink(repo_name, manifest["config"]["digest"])
-                headers = {"Accept": manifest["config"]["mediaType"]}
-                self.manifests["config"] = self._get(url, headers=headers)
+    manifest = self._get_manifest(repo_name, digest, "all")
 
-            self.manifests[schemaVersion] = manifest
+    # A manifest list (or OCI index) has a manifest for each platform
+    if manifest is not None and "manifests" in manifest:
+        selected = select_manifest(manifest)
+        bot.debug("Selected manifest %s for %s" % (selected["digest"], selected))
+        manifest = self._get_manifest(repo_name, selected["digest"], "all")
+
+    if manifest is None:
+        return self.manifests
+
+    if manifest.get("schemaVersion") == 1:
+        self.manifests["v1"] = manifest
+        self.manifests["config"] = manifest
+
+    else:
+        self.manifests["v2"] = manifest
+        if "config" in manifest and config:
+            bot.debug("Requesting config blob of version 2 manifest")
+            url = self._get_layerLink(repo_name, manifest["config"]["digest"])
+            accept = manifest["config"]["mediaType"]
+
+            # The request has its own headers (and token), so it doesn't
+            # change the headers that layers are downloaded with
+            self._update_token()
+            executor = ThreadPoolExecutor(max_workers=1)
+            request = executor.submit(
+                self._get_cached_manifest, url, accept, self.headers.copy()
+            )
+            self._config_request = (request, url, accept)
+            executor.shutdown(wait=False)
 
     return self.manifests
 
 
+def wait_manifests(self):
+    """wait for the image config that get_manifests requested in the
+    background, and add it to the manifests as the config. If the request
+    failed (e.g., the token expired), it is made again here, where the
+    token can be updated.
+    """
+    if getattr(self, "_config_request", None) is not None:
+        request, url, accept = self._config_request
+        self._config_request = None
+        config = request.result()
+        if config is None:
+            config = self._get_cached_manifest(url, accept)
+        if config is not None:
+            self.manifests["config"] = config
+    return getattr(self, "manifests", {})
+
+
 def get_manifest_selfLink(self, repo_name, digest=None):
     """get a selfLink for the manifest, for use by the client get_manifest
      function, along with the parents pull
@@ -125,7 +204,8 @@ def get_manifest(self, repo_name, digest=None, version="v1"):
     ==========
     repo_name: reference to the <username>/<repository>:<tag> to obtain
     digest: a tag or shasum version
-    version: one of v1, v2, and config (for image config)
+    version: one of v1, v2, oci, list, index and config (for image config),
+             or all to accept any manifest (in that order of preference)
 
     """
 
@@ -133,15 +213,20 @@ def get_manifest(self, repo_name, digest=None, version="v1"):
         "config": "application/vnd.docker.container.image.v1+json",
         "v1": "application/vnd.docker.distribution.manifest.v1+json",
         "v2": "application/vnd.docker.distribution.manifest.v2+json",
+        "oci": "application/vnd.oci.image.manifest.v1+json",
+        "list": "application/vnd.docker.distribution.manifest.list.v2+json",
+        "index": "application/vnd.oci.image.index.v1+json",
     }
+    accepts["all"] = ", ".join(
+        accepts[kind] for kind in ["index", "list", "oci", "v2", "v1"]
+    )
 
     url = self._get_manifest_selfLink(repo_name, digest)
 
     bot.verbose("Obtaining manifest: %s %s" % (url, version))
-    headers = {"Accept": accepts[version]}
 
     try:
-        manifest = self._get(url, headers=headers, quiet=True)
+        manifest = self._get_cached_manifest(url, accepts[version])
         manifest["selfLink"] = url
     except:
         manifest = None
@@ -149,7 +234,64 @@ def get_manifest(self, repo_name, digest=None, version="v1"):
     return manifest
 
 
-def download_layers(self, repo_name, digest=None, destination=None):
+def get_cached_manifest(self, url, accept, headers=None):
+    """return a manifest (or image config) from the manifest cache, or
+    request it and add it to the cache. A cached manifest for a tag that
+    is no longer fresh is revalidated with If-None-Match, so an unchanged
+    manifest costs a conditional request (304) instead of a download.
+    Returns None if the manifest isn't found.
+
+    Parameters
+    ==========
+    url: the url of the manifest (or blob), ending with the reference
+    accept: the media types to accept
+    headers: headers to request with instead of the client headers, for a
+             request in the background. A 401 response isn't retried with
+             a new token, and None is returned.
+    """
+    from sregistry.main.base.manifests import get_manifest_cache
+    from sregistry.main.base.session import get_session
+
+    cache = get_manifest_cache()
+    entry = cache.get(url, accept)
+    if cache.is_fresh(entry):
+        bot.debug("Using cached manifest %s" % url)
+        return entry["manifest"]
+
+    request_headers = {"Accept": accept}
+    if entry is not None and entry.get("etag"):
+        request_headers["If-None-Match"] = entry["etag"]
+
+    if headers is None:
+        response = self._get(
+            url, headers=request_headers, return_json=False, quiet=True
+        )
+    else:
+        request_headers = dict(headers, **request_headers)
+        response = get_session().get(
+            url, headers=request_headers, verify=self._verify()
+        )
+    if response.status_code == 304 and entry is not None:
+        bot.debug("Manifest %s was not modified" % url)
+        return cache.touch(entry)["manifest"]
+
+    if response.status_code != 200:
+        return None
+
+    try:
+        manifest = response.json()
+    except ValueError:
+        bot.exit("The server returned a malformed response.")
+
+    # Registries set the ETag to the quoted digest of the manifest
+    etag = response.headers.get("ETag")
+    if etag is None and "Docker-Content-Digest" in response.headers:
+        etag = '"%s"' % response.headers["Docker-Content-Digest"]
+    cache.add(url, manifest, accept=accept, etag=etag)
+    return manifest
+
+
+def download_layers(self, repo_name, digest=None, destination=None, sandbox=None):
     """download layers is a wrapper to do the following for a client loaded
     with a manifest for an image:
 
@@ -157,9 +299,16 @@ def download_layers(self, repo_name, digest=None, destination=None):
     2. atomically download the list to destination (get_layers)
 
     This function uses the MultiProcess client to download layers
-    at the same time.
+    at the same time. Layers already present in the shared blob store
+    (e.g., pulled by another registry client) are not downloaded again.
+    If a sandbox is provided, each layer is extracted into it (in order)
+    as soon as it is downloaded, while the next layers are downloading.
+    If SREGISTRY_KEEP_LAYERS is false, these layers are downloaded to a
+    temporary folder and removed as soon as they are extracted. Layers in
+    the temporary store of a batch (see download_images) are linked too.
     """
-    from sregistry.main.workers import Workers, download_task
+    from sregistry.defaults import SREGISTRY_KEEP_LAYERS
+    from sregistry.main.workers import BlobStore, Workers, download_task
 
     # 1. Get manifests if not retrieved
     if not hasattr(self, "manifests"):
@@ -167,35 +316,116 @@ def download_layers(self, repo_name, digest=None, destination=None):
 
     # Obtain list of digets, and destination for download
     digests = self._get_digests()
-    destination = self._get_download_cache(destination)
+    keep = sandbox is None or SREGISTRY_KEEP_LAYERS
+    if keep:
+        destination = self._get_download_cache(destination)
+    else:
+        destination = get_tmpdir(prefix="sregistry-layers")
 
     # Create multiprocess download client
     workers = Workers()
+    blobs = BlobStore()
+    batch = getattr(self, "batch_blobs", None)
+
+    # Refresh the token if it would expire soon, before workers use it
+    self._update_token()
 
     # Download each layer atomically
     tasks = []
     layers = []
     for digest in digests:
         targz = "%s/%s.tar.gz" % (destination, digest)
-
-        # Only download if not in cache already
-        if not os.path.exists(targz):
-            url = "%s/%s/blobs/%s" % (self.base, repo_name, digest)
-            tasks.append((url, self.headers, targz))
+        url = "%s/%s/blobs/%s" % (self.base, repo_name, digest)
+
+        # Layers in the blob store aren't downloaded, and cached layers are
+        # verified (by the download task) before they are used
+        if blobs.exists(digest):
+            blobs.link(digest, targz)
+        elif batch is not None and batch.exists(digest):
+            batch.link(digest, targz)
+        tasks.append((url, self.headers, targz, "layer", digest))
         layers.append(targz)
 
+    def publish(targz):
+        digest = os.path.basename(targz).replace(".tar.gz", "")
+        if keep and os.path.exists(targz) and not blobs.exists(digest):
+            blobs.add(digest, targz)
+        return targz
+
+    def apply(targz):
+        digest = os.path.basename(targz).replace(".tar.gz", "")
+        media_type = getattr(self, "media_types", {}).get(digest)
+        extract_layer(targz, sandbox, media_type=media_type)
+        if not keep:
+            os.remove(targz)
+        return publish(targz)
+
+    # Extract each layer once it (and the layers before it) are downloaded
+    if sandbox is not None:
+        workers.run_ordered(func=download_task, tasks=tasks, apply=apply)
+
     # Download layers with multiprocess workers
-    if len(tasks) > 0:
+    else:
         workers.run(func=download_task, tasks=tasks)
 
-    # Create the metadata tar
+    # Publish the layers (downloaded, or cached and verified) to the blob store
+    for targz in layers:
+        publish(targz)
+
+    # Create the metadata tar, once the image config is returned
+    self._wait_manifests()
     metadata = self._create_metadata_tar(destination)
     if metadata is not None:
         layers.append(metadata)
+        if sandbox is not None:
+            extract_layer(metadata, sandbox)
 
+    if not keep:
+        shutil.rmtree(destination)
     return layers
 
 
+def download_images(self, names):
+    """download the layers of many images at once, for a batch pull (see
+    download_batch). An image that would be reused (built from the same
+    content before) is skipped.
+
+    Parameters
+    ==========
+    names: a list of parsed image names (see parse_image_name)
+
+    Returns
+    =======
+    layers: a dictionary with the images (uri) that use each layer digest
+    """
+    from sregistry.main.workers import download_task
+
+    def get_layers(name):
+        # The token of the last image is scoped to its repository, and
+        # manifests from the cache wouldn't get a challenge for this one
+        self._update_token(repository=name["url"])
+
+        # The config is requested when the image is pulled
+        self.manifests = {}
+        self._get_manifests(name["url"], name["version"] or name["tag"], config=False)
+
+        # An image built from the same content is reused, without its layers
+        image_digest = self._get_image_digest()
+        if image_digest is not None and hasattr(self, "get_container_by_digest"):
+            if self.get_container_by_digest(image_digest) is not None:
+                bot.debug("Image %s is unchanged, skipping" % name["uri"])
+                return []
+
+        # Each image downloads with the token for its repository
+        headers = self.headers.copy()
+        return [
+            (digest, self._get_layerLink(name["url"], digest), headers)
+            for digest in self._get_digests()
+        ]
+
+    return download_batch(self, names, get_layers, download_task)
+
+
 def get_download_cache(self, destination, subfolder="docker"):
     """determine the user preference for atomic download of layers. If
     the user has set a singularity cache directory, honor it. Otherwise,
@@ -235,9 +465,9 @@ def get_digests(self):
 
     digests = []
 
+    # The config isn't a manifest, prefer version 2 to 1
     reverseLayers = False
-    schemaVersions = list(self.manifests.keys())
-    schemaVersions.reverse()
+    schemaVersions = [v for v in ["v2", "v1"] if v in self.manifests]
     manifest = None
 
     # Select the manifest to use
@@ -272,10 +502,14 @@ def get_digests(self):
     if manifest is None:
         bot.exit("Failed to find manifest. Check image name and login.")
 
+    # Media types (e.g., tar+gzip or tar+zstd) choose how layers are extracted
+    self.media_types = {}
     for layer in manifest[layer_key]:
         if digest_key in layer:
             bot.debug("Adding digest %s" % layer[digest_key])
             digests.append(layer[digest_key])
+            if "mediaType" in layer:
+                self.media_types[layer[digest_key]] = layer["mediaType"]
 
     # Reverse layer order for manifest version 1.0
     if reverseLayers is True:
@@ -286,6 +520,19 @@ def get_digests(self):
     return digests
 
 
+def get_image_digest(self):
+    """return the digest that identifies the content of an image, the digest
+    of its config for a version 2 (or OCI) manifest. Two pulls with the same
+    image digest build the same image. A version 1 manifest has no config,
+    so None is returned.
+    """
+    if not hasattr(self, "manifests"):
+        bot.exit("Please retrieve manifests for an image first.")
+
+    manifest = self.manifests.get("v2") or {}
+    return manifest.get("config", {}).get("digest")
+
+
 def get_layerLink(self, repo_name, digest):
     """get the url for a layer based on a digest and repo name
 
@@ -320,7 +567,7 @@ def get_layer(self, image_id, repo_name, download_folder=None):
     # Step 1: Download the layer atomically
     file_name = "%s.%s" % (download_folder, next(tempfile._get_candidate_names()))
 
-    tar_download = self.download(url, file_name)
+    tar_download = self.download(url, file_name, digest=image_id)
 
     try:
         shutil.move(tar_download, download_folder)
@@ -384,6 +631,7 @@ def get_config(self, key="Entrypoint", delim=None):
     if not hasattr(self, "manifests"):
         bot.exit("Please retrieve manifests for an image first.")
 
+    self._wait_manifests()
     cmd = None
 
     # If we didn't find the config value in version 2
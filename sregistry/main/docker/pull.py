@@ -9,8 +9,12 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
 
 from spython.main import Client as Singularity
+from sregistry.defaults import SREGISTRY_PULL_PIPELINE
 from sregistry.logger import bot
-from sregistry.utils import get_tmpdir, parse_image_name, remove_uri, extract_tar
+from sregistry.main.base.session import get_session_stats
+from sregistry.main.docker.utils import extract_layer
+from sregistry.utils import get_tmpdir, link_file, parse_image_name, remove_uri
+import json
 import shutil
 import os
 
@@ -47,18 +51,29 @@ def pull(self, images, file_name=None, save=True, force=False, base=None, **kwar
 
     bot.debug("Execution of PULL for %s images" % len(images))
 
+    # Images are pulled in groups, one for each registry (base)
+    groups = {}
+    for index, image in enumerate(images):
+        groups.setdefault(self._get_registry(image), []).append(index)
+
     # If used internally we want to return a list to the user.
-    finished = []
-    for image in images:
+    finished = [None] * len(images)
+    for indices in groups.values():
         # 0. Update the base in case we aren't working with default
-        base = self._update_base(image)
-        q = parse_image_name(remove_uri(image), base=base)
+        base = self._update_base(images[indices[0]])
+        names = [parse_image_name(remove_uri(images[i]), base=base) for i in indices]
 
-        image_file = self._pull(
-            file_name=file_name, save=save, force=force, names=q, kwargs=kwargs
-        )
+        # A batch downloads the layers of all images first, each layer once
+        if len(names) > 1:
+            self._download_images(names)
 
-        finished.append(image_file)
+        for index, q in zip(indices, names):
+            finished[index] = self._pull(
+                file_name=file_name, save=save, force=force, names=q, kwargs=kwargs
+            )
+
+        # The layers of a batch are removed, if they aren't kept
+        self._remove_batch()
 
     if len(finished) == 1:
         finished = finished[0]
@@ -100,46 +115,42 @@ def _pull(self, file_name, names, save=True, force=False, uri="docker://", **kwa
 
     digest = names["version"] or names["tag"]
 
-    # Build from sandbox, prefix with sandbox
-    sandbox = get_tmpdir(prefix="sregistry-sandbox")
-
-    # First effort, get image via Sregistry
-    layers = self._download_layers(names["url"], digest)
+    # Resolve the manifests of this image (cached, if pulled in a batch)
+    self.manifests = {}
+    self._get_manifests(names["url"], digest)
 
     # This is the url where the manifests were obtained
     url = self._get_manifest_selfLink(names["url"], digest)
 
-    # Add environment to the layers
-    envtar = self._get_environment_tar()
-    layers = [envtar] + layers
-
-    # Create singularity image from an empty folder
-    for layer in layers:
-        bot.info("Exploding %s" % layer)
-        result = extract_tar(layer, sandbox, handle_whiteout=True)
-        if result["return_code"] != 0:
-            bot.exit(result["message"])
+    # An image built from the same content (config) is linked, not built
+    image_digest = self._get_image_digest()
+    existing = None
+    if image_digest is not None and hasattr(self, "get_container_by_digest"):
+        existing = self.get_container_by_digest(image_digest)
 
-    sudo = kwargs.get("sudo", False)
-
-    # Build from a sandbox (recipe) into the image_file (squashfs)
-    image_file = Singularity.build(image=file_name, recipe=sandbox, sudo=sudo)
+    # The metadata (from inspect) of the image that is reused, if any
+    inspected = None
+    if existing is not None:
+        bot.info("Image %s is unchanged, reusing %s" % (image_digest, existing.uri))
+        image_file = link_file(existing.image, file_name)
+        inspected = json.loads(existing.metrics or "{}")
+        sandbox = None
 
-    # Fall back to using Singularity
-    if image_file is None:
-        bot.info("Downloading with native Singularity, please wait...")
-        image = file_name.replace("docker://", uri)
-        image_file = Singularity.pull(image, pull_folder=sandbox)
+    else:
+        image_file, sandbox = self._build_image(file_name, names, uri, **kwargs)
 
     # Save to local storage
     if save is True:
-        # Did we get the manifests?
-        manifests = {}
-        if hasattr(self, "manifests"):
-            manifests = self.manifests
+        # The manifests, with the config requested in the background
+        manifests = self._wait_manifests()
 
         container = self.add(
-            image_path=image_file, image_uri=names["uri"], metadata=manifests, url=url
+            image_path=image_file,
+            image_uri=names["uri"],
+            metadata=manifests,
+            url=url,
+            digest=image_digest,
+            inspected=inspected,
         )
 
         # When the container is created, this is the path to the image
@@ -150,6 +161,59 @@ def _pull(self, file_name, names, save=True, force=False, uri="docker://", **kwa
         bot.custom(prefix="Success!", message=image_file)
 
     # Clean up sandbox
-    shutil.rmtree(sandbox)
+    if sandbox is not None:
+        shutil.rmtree(sandbox)
+
+    bot.debug("Http connection reuse: %s" % get_session_stats())
 
     return image_file
+
+
+def _build_image(self, file_name, names, uri="docker://", **kwargs):
+    """download and extract the layers of an image (with its manifests
+    resolved) into a sandbox, and build the image file from it. If the
+    build isn't possible, the image is pulled with Singularity instead.
+
+    Parameters
+    ==========
+    file_name: the path to build the image file at
+    names: the parsed name of the image (see parse_image_name)
+    uri: the uri for Singularity to pull from, if the build fails
+
+    Returns
+    =======
+    (image_file, sandbox): the image file, and the sandbox to clean up
+    """
+    digest = names["version"] or names["tag"]
+
+    # Build from sandbox, prefix with sandbox
+    sandbox = get_tmpdir(prefix="sregistry-sandbox")
+
+    # Add environment to the layers
+    envtar = self._get_environment_tar()
+
+    # Extract layers as they download, the environment first
+    if SREGISTRY_PULL_PIPELINE:
+        extract_layer(envtar, sandbox)
+        self._download_layers(names["url"], digest, sandbox=sandbox)
+
+    # First effort, get image via Sregistry
+    else:
+        layers = [envtar] + self._download_layers(names["url"], digest)
+
+        # Create singularity image from an empty folder
+        for layer in layers:
+            extract_layer(layer, sandbox)
+
+    sudo = kwargs.get("sudo", False)
+
+    # Build from a sandbox (recipe) into the image_file (squashfs)
+    image_file = Singularity.build(image=file_name, recipe=sandbox, sudo=sudo)
+
+    # Fall back to using Singularity
+    if image_file is None:
+        bot.info("Downloading with native Singularity, please wait...")
+        image = file_name.replace("docker://", uri)
+        image_file = Singularity.pull(image, pull_folder=sandbox)
+
+    return image_file, sandbox
@@ -13,9 +13,25 @@ import datetime
 import hashlib
 import io
 import os
+import platform
 import tempfile
 import tarfile
 
+# Docker (GOARCH) names for the machine types of platform.machine()
+ARCHITECTURES = {
+    "x86_64": ("amd64", None),
+    "amd64": ("amd64", None),
+    "i386": ("386", None),
+    "i686": ("386", None),
+    "aarch64": ("arm64", None),
+    "arm64": ("arm64", None),
+    "armv7l": ("arm", "v7"),
+    "armv6l": ("arm", "v6"),
+    "ppc64le": ("ppc64le", None),
+    "s390x": ("s390x", None),
+    "riscv64": ("riscv64", None),
+}
+
 
 def get_template(name):
     """return a default template for some function in sregistry
@@ -117,3 +133,71 @@ def get_content_hash(contents):
             content = bytes(content)
         hasher.update(content)
     return hasher.hexdigest()
+
+
+def extract_layer(layer, sandbox, media_type=None):
+    """extract (explode) a layer into a sandbox, handling whiteout files,
+    and exit if the extraction fails.
+
+    Parameters
+    ==========
+    layer: the path to the layer (.tar.gz) to extract
+    sandbox: the sandbox folder to extract to
+    media_type: the media type of the layer (e.g., tar+gzip or tar+zstd)
+    """
+    from sregistry.utils import extract_tar
+
+    bot.info("Exploding %s" % layer)
+    result = extract_tar(layer, sandbox, handle_whiteout=True, media_type=media_type)
+    if result["return_code"] != 0:
+        bot.exit(result["message"])
+    return layer
+
+
+def get_platform(name=None):
+    """return the (os, architecture, variant) of a platform to select from
+    a manifest list or OCI index. The variant is None if any is accepted.
+
+    Parameters
+    ==========
+    name: the platform, e.g., linux/amd64 or linux/arm/v7. If not set,
+          SREGISTRY_PLATFORM or else the host is used.
+    """
+    from sregistry.defaults import SREGISTRY_PLATFORM
+
+    name = name or SREGISTRY_PLATFORM
+    if name:
+        parts = name.strip("/").split("/") + [None, None]
+        return parts[0], parts[1], parts[2]
+
+    machine = platform.machine().lower()
+    architecture, variant = ARCHITECTURES.get(machine, (machine, None))
+    return platform.system().lower(), architecture, variant
+
+
+def select_manifest(index, name=None):
+    """select the manifest for a platform from a manifest list or OCI index,
+    and exit if the image isn't built for it.
+
+    Parameters
+    ==========
+    index: the manifest list or OCI index, with a list of manifests
+    name: the platform (e.g., linux/arm64), see get_platform
+    """
+    wanted = get_platform(name)
+    available = []
+    for manifest in index.get("manifests", []):
+        found = manifest.get("platform", {})
+        found = (found.get("os"), found.get("architecture"), found.get("variant"))
+
+        # Attestations and signatures have an unknown platform
+        if found[0] in [None, "unknown"]:
+            continue
+        available.append("/".join([part for part in found if part]))
+        if found[:2] == wanted[:2] and wanted[2] in [None, found[2]]:
+            return manifest
+
+    bot.exit(
+        "No manifest for platform %s, the image has: %s"
+        % ("/".join([part for part in wanted if part]), ", ".join(available))
+    )
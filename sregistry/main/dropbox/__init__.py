@@ -13,8 +13,15 @@ from sregistry.logger import bot
 from sregistry.main import ApiConnection
 import datetime
 
+from .catalog import (
+    create_catalog,
+    delete_catalog,
+    list_catalog,
+    list_images,
+    read_catalog,
+)
 from .pull import pull
-from .push import push
+from .push import push, push_chunk, push_chunks
 from .query import search, search_all, container_query
 from .share import share
 
@@ -88,9 +95,18 @@ class Client(ApiConnection):
 # Add your different functions imported at the top to the client here
 Client.pull = pull
 Client.push = push
+Client._push_chunk = push_chunk
+Client._push_chunks = push_chunks
 Client.share = share
 
 # Query functions
 Client.search = search
 Client._search_all = search_all
 Client._container_query = container_query
+
+# Catalog storage
+Client._create_catalog = create_catalog
+Client._delete_catalog = delete_catalog
+Client._list_catalog = list_catalog
+Client._list_images = list_images
+Client._read_catalog = read_catalog
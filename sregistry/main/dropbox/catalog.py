@@ -0,0 +1,93 @@
+"""
+
+Copyright (C) 2017-2021 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+from sregistry.main.base.catalog import Catalog
+from dropbox.exceptions import ApiError
+from dropbox.files import FileMetadata, FolderMetadata, WriteMode
+
+# Storage of the catalog (see sregistry.main.base.catalog) in the Dropbox,
+# the names of catalog objects are paths from the root
+
+
+def list_folder(self, path):
+    """return all entries of a folder, following the cursor of each page"""
+    result = self.dbx.files_list_folder(path)
+    entries = result.entries
+    while result.has_more:
+        result = self.dbx.files_list_folder_continue(result.cursor)
+        entries += result.entries
+    return entries
+
+
+def list_catalog(self, prefix):
+    """return the names of the catalog objects with a prefix (a folder)"""
+    try:
+        entries = list_folder(self, "/" + prefix.rstrip("/"))
+    except ApiError:
+        return []
+    return [prefix + entry.name for entry in entries]
+
+
+def read_catalog(self, name):
+    """return the content of a catalog object, or None if it doesn't exist"""
+    try:
+        _, response = self.dbx.files_download("/" + name)
+    except ApiError:
+        return None
+    return response.content
+
+
+def create_catalog(self, name, content):
+    """create a catalog object, only if it doesn't exist (add mode, without
+    renaming). Returns False if it exists.
+    """
+    try:
+        self.dbx.files_upload(
+            content.encode("utf-8"),
+            "/" + name,
+            mode=WriteMode.add,
+            autorename=False,
+        )
+    except ApiError as e:
+        if e.error.is_path() and e.error.get_path().reason.is_conflict():
+            return False
+        raise
+    return True
+
+
+def delete_catalog(self, name):
+    """remove a catalog object"""
+    try:
+        self.dbx.files_delete_v2("/" + name)
+    except ApiError:
+        pass
+
+
+def list_images(self):
+    """return the images in all collections (folders) as catalog entries
+    (path, size and updated), a listing of each folder. The folder of the
+    catalog isn't a collection.
+    """
+    images = []
+    folder = Catalog.prefix.split("/")[0]
+    for entry in list_folder(self, ""):
+        if not isinstance(entry, FolderMetadata) or entry.name == folder:
+            continue
+        for item in list_folder(self, entry.path_lower):
+            if not isinstance(item, FileMetadata):
+                continue
+            images.append(
+                {
+                    "path": "%s/%s" % (entry.name, item.name),
+                    "size": item.size,
+                    "updated": item.server_modified.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                }
+            )
+    return images
@@ -9,12 +9,29 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
 
 from sregistry.logger import bot
-from sregistry.utils import parse_image_name, remove_uri
+from sregistry.defaults import (
+    SREGISTRY_DROPBOX_CHUNK_SIZE,
+    SREGISTRY_DROPBOX_CHUNKS,
+    SREGISTRY_DROPBOX_RETRIES,
+)
+from sregistry.main.base.catalog import get_catalog, get_updated
+from sregistry.utils import get_segments, parse_image_name, remove_uri
 
 # see the registry push for example of how to do this
+from concurrent.futures import ThreadPoolExecutor
 import dropbox
+import hashlib
+import requests
 import sys
 import os
+import threading
+import time
+
+# The data of a concurrent upload session is appended in multiples of 4MB
+# (blocks, also those of the content hash), and a request has up to 150MB
+BLOCK_SIZE = 4 * 1024 * 1024
+MAX_CHUNK_SIZE = 128 * 1024 * 1024
+MIN_CHUNK_SIZE = 16 * 1024 * 1024
 
 
 def push(self, path, name, tag=None):
@@ -26,8 +43,11 @@ def push(self, path, name, tag=None):
     name: should be the complete uri that the user has requested to push.
     tag: should correspond with an image tag. This is provided to mirror Docker
 
-    if the image is less than 150MB, the standard file_upload is used. If
-    larger, the image is uploaded in chunks with a progress bar.
+    if the image fits in one chunk (see get_chunk_size), the standard
+    file_upload is used. If larger, the image is uploaded in chunks to a
+    concurrent upload session, SREGISTRY_DROPBOX_CHUNKS at once, with a
+    progress bar. The content hash that Dropbox returns is checked against
+    the hash of the chunks.
 
     """
     path = os.path.abspath(path)
@@ -41,52 +61,37 @@ def push(self, path, name, tag=None):
 
     # Get the size of the file
     file_size = os.path.getsize(path)
-    chunk_size = 4 * 1024 * 1024
+    workers = max(SREGISTRY_DROPBOX_CHUNKS, 1)
+    chunk_size = get_chunk_size(file_size, workers, SREGISTRY_DROPBOX_CHUNK_SIZE)
     storage_path = "/%s" % names["storage"]
 
-    # This is MB
-    # image_size = os.path.getsize(path) >> 20
-
     # prepare the progress bar
-    progress = 0
-    bot.show_progress(progress, file_size, length=35)
+    progress = _Progress(file_size)
+    bot.show_progress(0, file_size, length=35)
 
-    # If image is smaller than 150MB, use standard upload
-    with open(path, "rb") as F:
-        if file_size <= chunk_size:
-            self.dbx.files_upload(F.read(), storage_path)
-
-        # otherwise upload in chunks
-        else:
-            start = self.dbx.files_upload_session_start(F.read(chunk_size))
-            cursor = dropbox.files.UploadSessionCursor(
-                session_id=start.session_id, offset=F.tell()
-            )
-            commit = dropbox.files.CommitInfo(path=storage_path)
+    # If the image is one chunk, use standard upload
+    if file_size <= chunk_size:
+        with open(path, "rb") as F:
+            data = F.read()
+        metadata = self.dbx.files_upload(data, storage_path)
+        content_hash = get_content_hash([get_block_hashes(data)])
+        progress.update(file_size)
 
-            while F.tell() < file_size:
-                progress += chunk_size
+    # otherwise upload in chunks
+    else:
+        metadata, content_hash = self._push_chunks(
+            path, storage_path, chunk_size, workers, progress
+        )
 
-                # Finishing up the file, less than chunk_size to go
-                if file_size - F.tell() <= chunk_size:
-                    self.dbx.files_upload_session_finish(
-                        F.read(chunk_size), cursor, commit
-                    )
+    # Older versions of the Dropbox sdk don't have the content hash
+    if getattr(metadata, "content_hash", content_hash) != content_hash:
+        bot.exit("Upload of %s is corrupt (content hash does not match)." % path)
 
-                # Finishing up the file, less than chunk_size to go
-                else:
-                    self.dbx.files_upload_session_append(
-                        F.read(chunk_size), cursor.session_id, cursor.offset
-                    )
-                    cursor.offset = F.tell()
-
-                # Update the progress bar
-                bot.show_progress(
-                    iteration=progress,
-                    total=file_size,
-                    length=35,
-                    carriage_return=False,
-                )
+    # The image is added to the catalog, for search
+    catalog = get_catalog(self)
+    if catalog is not None:
+        image = {"path": names["storage"], "size": file_size, "updated": get_updated()}
+        catalog.update(add=[image])
 
     # Finish up
     bot.show_progress(
@@ -95,3 +100,217 @@ def push(self, path, name, tag=None):
 
     # Newline to finish download
     sys.stdout.write("\n")
+
+
+def push_chunks(self, path, storage_path, chunk_size, workers, progress):
+    """upload an image in chunks to an upload session, and finish it to
+    the storage path. In a concurrent upload session, the chunks are
+    appended in threads (workers at once), each reading its chunk while the
+    others send theirs. A version of the Dropbox sdk without concurrent
+    sessions appends the chunks in order.
+
+    Returns
+    =======
+    metadata: the FileMetadata of the uploaded image
+    content_hash: the Dropbox content hash of the chunks that were read
+    """
+    file_size = os.path.getsize(path)
+    chunks = get_segments(file_size, chunk_size)
+    session_type = getattr(dropbox.files, "UploadSessionType", None)
+
+    if session_type is not None:
+        start = self.dbx.files_upload_session_start(
+            b"", session_type=session_type.concurrent
+        )
+        bot.debug("Pushing %s chunks of %s" % (len(chunks), storage_path))
+
+        # The last chunk closes the session, so it's appended once the
+        # others are, and a close can't reject an append still running
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(
+                    self._push_chunk,
+                    path,
+                    start.session_id,
+                    offset,
+                    length,
+                    progress=progress,
+                    concurrent=True,
+                )
+                for offset, length in chunks[:-1]
+            ]
+            try:
+                hashes = [future.result() for future in futures]
+                offset, length = chunks[-1]
+                hashes.append(
+                    self._push_chunk(
+                        path,
+                        start.session_id,
+                        offset,
+                        length,
+                        close=True,
+                        progress=progress,
+                        concurrent=True,
+                    )
+                )
+            except (KeyboardInterrupt, SystemExit):
+                for future in futures:
+                    future.cancel()
+                raise
+            except (
+                dropbox.exceptions.DropboxException,
+                requests.exceptions.RequestException,
+            ) as e:
+                for future in futures:
+                    future.cancel()
+                bot.exit("Could not push a chunk of %s: %s" % (path, e))
+
+    else:
+        start = self.dbx.files_upload_session_start(b"")
+        hashes = [
+            self._push_chunk(path, start.session_id, offset, length, progress=progress)
+            for offset, length in chunks
+        ]
+
+    # The data was appended, so the finish has none
+    cursor = dropbox.files.UploadSessionCursor(
+        session_id=start.session_id, offset=file_size
+    )
+    commit = dropbox.files.CommitInfo(path=storage_path)
+    metadata = self.dbx.files_upload_session_finish(b"", cursor, commit)
+    return metadata, get_content_hash(hashes)
+
+
+def push_chunk(
+    self,
+    path,
+    session_id,
+    offset,
+    length,
+    close=False,
+    progress=None,
+    concurrent=False,
+):
+    """append a chunk (length bytes from an offset) of an image to an upload
+    session. A chunk that fails from a connection error, a server error or
+    a rate limit is tried again (SREGISTRY_DROPBOX_RETRIES attempts), with
+    a backoff. If a retry of a sequential session finds that the session is
+    past the chunk (the append that failed was written), the chunk is done.
+    In a concurrent session, the offset of the session says nothing about
+    one chunk, so an incorrect offset is an error. Returns the sha256 of
+    each block of the chunk.
+
+    Parameters
+    ==========
+    path: the path to the image file
+    session_id: the id of the upload session
+    offset: the offset of the chunk in the file (and session)
+    length: the length of the chunk in bytes
+    close: close the session with this chunk (the last of a concurrent one)
+    progress: the progress of the upload, updated with bytes uploaded
+    concurrent: the session is a concurrent one (chunks appended at once)
+    """
+    with open(path, "rb") as F:
+        F.seek(offset)
+        data = F.read(length)
+    cursor = dropbox.files.UploadSessionCursor(session_id=session_id, offset=offset)
+
+    attempts = max(SREGISTRY_DROPBOX_RETRIES, 1)
+    for attempt in range(attempts):
+        try:
+            self.dbx.files_upload_session_append_v2(data, cursor, close=close)
+            break
+        except (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+            dropbox.exceptions.InternalServerError,
+            dropbox.exceptions.RateLimitError,
+        ) as e:
+            if attempt == attempts - 1:
+                raise
+            backoff = getattr(e, "backoff", None) or min(2**attempt, 30)
+            bot.debug("Chunk at %s failed (%s), retrying in %ss" % (offset, e, backoff))
+            time.sleep(backoff)
+
+        # An append that failed (e.g., timed out) may have been written, and
+        # then a sequential session is past the chunk when it's tried again
+        except dropbox.exceptions.ApiError as e:
+            correct_offset = get_correct_offset(e.error)
+            if concurrent or attempt == 0 or (correct_offset or 0) < offset + length:
+                raise
+            bot.debug("Chunk at %s was appended, continuing." % offset)
+            break
+
+    if progress is not None:
+        progress.update(length)
+    return get_block_hashes(data)
+
+
+def get_correct_offset(error):
+    """return the offset that an upload session expected, if an append
+    failed with an incorrect offset (UploadSessionAppendError, or the
+    UploadSessionLookupError of older versions of the sdk), otherwise None.
+    """
+    if getattr(error, "is_incorrect_offset", lambda: False)():
+        return error.get_incorrect_offset().correct_offset
+    return None
+
+
+def get_chunk_size(file_size, workers, chunk_size=None):
+    """return the size of the chunks to upload an image in. A chunk size
+    that is set is rounded up to a multiple of 4MB (BLOCK_SIZE), and
+    otherwise it adapts to the image, so each worker has a few chunks to
+    upload (from 16MB to 128MB).
+
+    Parameters
+    ==========
+    file_size: the size of the image in bytes
+    workers: the number of chunks uploaded at once
+    chunk_size: the size of chunks that is set (0 or None to adapt)
+    """
+    if not chunk_size:
+        chunk_size = file_size // (workers * 4)
+        chunk_size = min(max(chunk_size, MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+    chunk_size = -(-chunk_size // BLOCK_SIZE) * BLOCK_SIZE
+    return min(chunk_size, MAX_CHUNK_SIZE)
+
+
+def get_block_hashes(data):
+    """return the sha256 (bytes) of each block (4MB) of data"""
+    view = memoryview(data)
+    return [
+        hashlib.sha256(view[start : start + BLOCK_SIZE]).digest()
+        for start in range(0, len(data), BLOCK_SIZE)
+    ]
+
+
+def get_content_hash(hashes):
+    """return the Dropbox content hash of a file, the sha256 of the sha256 of
+    each block, from the block hashes of its chunks (in order)
+    """
+    content_hash = hashlib.sha256()
+    for chunk in hashes:
+        for block in chunk:
+            content_hash.update(block)
+    return content_hash.hexdigest()
+
+
+class _Progress(object):
+    """the progress of an upload in bytes, shown as a progress bar. Chunks
+    are uploaded in threads, so updates are locked.
+    """
+
+    def __init__(self, total):
+        self.total = max(total, 1)
+        self.done = 0
+        self.lock = threading.Lock()
+
+    def update(self, count):
+        with self.lock:
+            self.done += count
+            bot.show_progress(
+                iteration=self.done,
+                total=self.total,
+                length=35,
+                carriage_return=False,
+            )
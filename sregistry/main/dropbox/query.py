@@ -9,6 +9,7 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
 
 from sregistry.logger import bot
+from sregistry.main.base.catalog import get_images
 from sregistry.utils import remove_uri
 import sys
 
@@ -33,12 +34,9 @@ def search_all(self):
 
     results = []
 
-    # Parse through folders (collections):
-    for entry in self.dbx.files_list_folder("").entries:
-        # Parse through containers
-        for item in self.dbx.files_list_folder(entry.path_lower).entries:
-            name = item.name.replace(".simg", "")
-            results.append(["%s/%s" % (entry.name, name)])
+    # The path of each image is <collection>/<name>
+    for image in get_images(self, self._list_images):
+        results.append([image["path"].replace(".simg", "")])
 
     if len(results) == 0:
         bot.info("No container collections found.")
@@ -59,14 +57,10 @@ def container_query(self, query):
 
     query = remove_uri(query)
 
-    # Parse through folders (collections):
-    for entry in self.dbx.files_list_folder("").entries:
-        # Parse through containers
-        for item in self.dbx.files_list_folder(entry.path_lower).entries:
-            name = item.name.replace(".simg", "")
-            name = "%s/%s" % (entry.name, name)
-            if query in name:
-                results.append([name])
+    for image in get_images(self, self._list_images):
+        name = image["path"].replace(".simg", "")
+        if query in name:
+            results.append([name])
 
     if len(results) == 0:
         bot.info("No container collections found.")
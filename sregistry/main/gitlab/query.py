@@ -9,7 +9,7 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
 
 from sregistry.logger import bot
-import requests
+from sregistry.main.base.session import get_session
 import sys
 
 try:
@@ -38,7 +38,7 @@ def search_all(self, collection, job_id=None):
 
     url = "%s/projects/%s/jobs" % (self.api_base, quote_plus(collection.strip("/")))
 
-    response = requests.get(url, headers=self.headers)
+    response = get_session().get(url, headers=self.headers)
     if response.status_code == 200:
         jobs = response.json()
 
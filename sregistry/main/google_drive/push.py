@@ -9,7 +9,13 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
 
 from sregistry.logger import bot
-from sregistry.utils import get_file_hash, get_thumbnail, parse_image_name, remove_uri
+from sregistry.utils import (
+    get_file_hashes,
+    get_file_hashes_background,
+    get_thumbnail,
+    parse_image_name,
+    remove_uri,
+)
 
 from googleapiclient.http import MediaFileUpload
 from googleapiclient.errors import HttpError
@@ -35,10 +41,18 @@ def push(self, path, name, tag=None):
         bot.exit("%s does not exist." % path)
 
     names = parse_image_name(remove_uri(name), tag=tag)
+
+    # One read of the image for the version and the md5 to check the upload
     if names["version"] is None:
-        version = get_file_hash(path, "sha256")
+        hashes = None
+        digests = get_file_hashes(path, ["sha256", "md5"])
+        version = digests["sha256"]
         names = parse_image_name(remove_uri(name), tag=tag, version=version)
 
+    # Or the md5 is computed while the image uploads
+    else:
+        hashes = get_file_hashes_background(path, ["md5"])
+
     # Update metadata with names, flatten to only include labels
     metadata = self.get_metadata(path, names=names)
 
@@ -54,10 +68,19 @@ def push(self, path, name, tag=None):
         bot.spinner.start()
         image = (
             self._service.files()
-            .create(body=file_metadata, media_body=media, fields="id")
+            .create(body=file_metadata, media_body=media, fields="id,md5Checksum")
             .execute()
         )
 
+        # Drive returns the md5 of what it received, and a file that doesn't
+        # match is removed, so a pull doesn't find it
+        if hashes is not None:
+            digests = hashes.result()
+        if image.get("md5Checksum", digests["md5"]) != digests["md5"]:
+            self._service.files().delete(fileId=image["id"]).execute()
+            bot.spinner.stop()
+            bot.exit("Upload of %s is corrupt (md5 does not match), try again." % path)
+
         # Add a thumbnail!
         thumbnail = get_thumbnail()
 
@@ -31,6 +31,13 @@ from .build import (
     get_ipaddress,
     get_instances,
 )
+from .catalog import (
+    create_catalog,
+    delete_catalog,
+    list_catalog,
+    list_images,
+    read_catalog,
+)
 from .delete import delete, destroy
 from .logs import logs, list_logs, print_log
 from .pull import pull
@@ -157,3 +164,10 @@ Client.search = search
 Client._search_all = search_all
 Client._container_query = container_query
 Client._list_containers = list_containers
+
+# Catalog storage
+Client._create_catalog = create_catalog
+Client._delete_catalog = delete_catalog
+Client._list_catalog = list_catalog
+Client._list_images = list_images
+Client._read_catalog = read_catalog
@@ -0,0 +1,69 @@
+"""
+
+Copyright (C) 2018-2021 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+# Storage of the catalog (see sregistry.main.base.catalog) in the bucket
+
+
+def list_catalog(self, prefix):
+    """return the names of the catalog objects with a prefix"""
+    return [blob.name for blob in self._bucket.list_blobs(prefix=prefix)]
+
+
+def read_catalog(self, name):
+    """return the content of a catalog object, or None if it doesn't exist"""
+    try:
+        return self._bucket.blob(name).download_as_bytes()
+    except NotFound:
+        return None
+
+
+def create_catalog(self, name, content):
+    """create a catalog object, only if it doesn't exist (a generation match
+    of 0). Returns False if it exists.
+    """
+    try:
+        self._bucket.blob(name).upload_from_string(
+            content, content_type="application/json", if_generation_match=0
+        )
+    except PreconditionFailed:
+        return False
+    return True
+
+
+def delete_catalog(self, name):
+    """remove a catalog object"""
+    try:
+        self._bucket.blob(name).delete()
+    except NotFound:
+        pass
+
+
+def list_images(self):
+    """return the containers in the bucket (see list_containers) as catalog
+    entries, with the fields that search and pull use.
+    """
+    return [get_image(blob) for blob in self._list_containers()]
+
+
+def get_image(blob):
+    """return the catalog entry of a container (a blob)"""
+    return {
+        "path": blob.name,
+        "size": blob.size,
+        "updated": blob.updated.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "md5": blob.md5_hash,
+        "id": blob.id,
+        "uri": blob.metadata["uri"],
+        "media_link": blob.media_link,
+        "self_link": blob.self_link,
+        "metadata": blob.metadata,
+    }
@@ -9,6 +9,7 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
 
 from sregistry.logger import bot
+from sregistry.main.base.catalog import get_catalog
 from sregistry.utils import confirm_delete
 from retrying import retry
 
@@ -25,9 +26,16 @@ def delete(self, image, force=False):
     bot.debug("DELETE %s" % image)
     files = self._container_query(image)
 
+    removed = []
     for file_object in files:
-        if confirm_delete(file_object.name, force):
-            file_object.delete()
+        if confirm_delete(file_object["path"], force):
+            self._bucket.blob(file_object["path"]).delete()
+            removed.append(file_object["path"])
+
+    # The images are removed from the catalog of the bucket
+    catalog = get_catalog(self)
+    if catalog is not None and removed:
+        catalog.update(remove=removed)
 
 
 @retry(
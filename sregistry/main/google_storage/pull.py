@@ -55,25 +55,25 @@ def pull(self, images, file_name=None, save=True, **kwargs):
         # We give the first match, the uri should be unique and known
         image = matches[0]
         image_file = self.download(
-            url=image.media_link, file_name=file_name, show_progress=True
+            url=image["media_link"], file_name=file_name, show_progress=True
         )
 
         # If the user is saving to local storage, you need to assumble the uri
         # here in the expected format <collection>/<namespace>:<tag>@<version>
         if save is True:
             image_uri = q["uri"]
-            if "uri" in image.metadata:
-                image_uri = image.metadata["uri"]
+            if "uri" in image["metadata"]:
+                image_uri = image["metadata"]["uri"]
 
             # Update metadata with selfLink
-            metadata = image.metadata
-            metadata["selfLink"] = image.self_link
+            metadata = image["metadata"]
+            metadata["selfLink"] = image["self_link"]
 
             container = self.add(
                 image_path=image_file,
                 image_uri=image_uri,
                 metadata=metadata,
-                url=image.media_link,
+                url=image["media_link"],
             )
 
             # When the container is created, this is the path to the image
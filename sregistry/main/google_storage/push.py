@@ -9,10 +9,17 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
 
 from sregistry.logger import bot, ProgressBar
-from sregistry.utils import get_file_hash, parse_image_name, remove_uri
+from sregistry.main.base.catalog import get_catalog
+from sregistry.utils import (
+    get_file_hashes,
+    get_file_hashes_background,
+    parse_image_name,
+    remove_uri,
+)
 
 from googleapiclient.http import MediaFileUpload
 from retrying import retry
+import base64
 import os
 
 
@@ -34,10 +41,17 @@ def push(self, path, name, tag=None):
     # This returns a data structure with collection, container, based on uri
     names = parse_image_name(remove_uri(name), tag=tag)
 
+    # One read of the image for the version and the md5 to check the upload
     if names["version"] is None:
-        version = get_file_hash(path, "sha256")
+        hashes = None
+        digests = get_file_hashes(path, ["sha256", "md5"])
+        version = digests["sha256"]
         names = parse_image_name(remove_uri(name), tag=tag, version=version)
 
+    # Or the md5 is computed while the image uploads
+    else:
+        hashes = get_file_hashes_background(path, ["md5"])
+
     # Update metadata with names
     metadata = self.get_metadata(path, names=names)
 
@@ -45,6 +59,32 @@ def push(self, path, name, tag=None):
         source=path, destination=names["storage"], metadata=metadata
     )
 
+    # Storage returns the md5 (base64) of what it received, and an object
+    # that doesn't match is removed, so a pull doesn't find it
+    if hashes is not None:
+        digests = hashes.result()
+    md5 = base64.b64encode(bytes.fromhex(digests["md5"])).decode("utf-8")
+    if manifest.get("md5Hash", md5) != md5:
+        self._bucket.blob(manifest["name"]).delete()
+        bot.exit("Upload of %s is corrupt (md5 does not match), try again." % path)
+
+    # The image is added to the catalog, for search (storage keeps strings)
+    catalog = get_catalog(self)
+    if catalog is not None:
+        metadata = dict((key, str(value)) for key, value in metadata.items())
+        image = {
+            "path": manifest["name"],
+            "size": int(manifest["size"]),
+            "updated": manifest["updated"],
+            "md5": manifest.get("md5Hash", md5),
+            "id": manifest["id"],
+            "uri": metadata["uri"],
+            "media_link": manifest["mediaLink"],
+            "self_link": manifest["selfLink"],
+            "metadata": metadata,
+        }
+        catalog.update(add=[image])
+
     print(manifest["mediaLink"])
 
 
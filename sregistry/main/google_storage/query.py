@@ -9,6 +9,7 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
 
 from sregistry.logger import bot
+from sregistry.main.base.catalog import get_images
 
 
 def search(self, query=None, args=None):
@@ -56,15 +57,15 @@ def search_all(self):
     be found by the client, it must have the type as container in metadata.
     """
 
-    results = self._list_containers()
+    results = get_images(self, self._list_images)
 
     bot.info("[gs://%s] Containers" % self._bucket_name)
 
     rows = []
     for i in results:
-        size = round(i.size / (1024 * 1024.0))
+        size = round(i["size"] / (1024 * 1024.0))
         size = ("%s MB" % size).rjust(10)
-        rows.append([size, i.metadata["uri"]])
+        rows.append([size, i["uri"]])
 
     bot.table(rows)
     return rows
@@ -73,27 +74,28 @@ def search_all(self):
 def container_query(self, query, quiet=False):
     """search for a specific container.
     This function would likely be similar to the above, but have different
-    filter criteria from the user (based on the query)
+    filter criteria from the user (based on the query). Matches are catalog
+    entries (see catalog.get_image).
     """
-    results = self._list_containers()
+    results = get_images(self, self._list_images)
 
     matches = []
     for result in results:
-        for _, val in result.metadata.items():
+        for _, val in result["metadata"].items():
             if query in val and result not in matches:
                 matches.append(result)
-            elif query in result.name and result not in matches:
+            elif query in result["path"] and result not in matches:
                 matches.append(result)
 
     if not quiet:
         bot.info("[gs://%s] Found %s containers" % (self._bucket_name, len(matches)))
         for image in matches:
-            size = round(image.size / (1024 * 1024.0))
-            bot.custom(prefix=image.name, color="CYAN")
-            bot.custom(prefix="id:     ", message=image.id)
-            bot.custom(prefix="uri:    ", message=image.metadata["uri"])
-            bot.custom(prefix="updated:", message=image.updated)
+            size = round(image["size"] / (1024 * 1024.0))
+            bot.custom(prefix=image["path"], color="CYAN")
+            bot.custom(prefix="id:     ", message=image["id"])
+            bot.custom(prefix="uri:    ", message=image["uri"])
+            bot.custom(prefix="updated:", message=image["updated"])
             bot.custom(prefix="size:  ", message=" %s MB" % (size))
-            bot.custom(prefix="md5:    ", message=image.md5_hash)
+            bot.custom(prefix="md5:    ", message=image["md5"])
             bot.newline()
     return matches
@@ -18,15 +18,20 @@ import os
 # The core of nvidia is actually docker
 from sregistry.main.docker.api import (
     create_metadata_tar,
+    download_images,
     download_layers,
+    remove_batch,
     get_manifest_selfLink,
     get_config,
     get_digests,
+    get_image_digest,
     get_environment_tar,
     get_layer,
     get_layerLink,
     get_manifest,
     get_manifests,
+    get_cached_manifest,
+    wait_manifests,
     get_download_cache,
     get_size,
     extract_env,
@@ -35,7 +40,7 @@ from sregistry.main.docker.api import (
     update_token,
 )
 
-from sregistry.main.docker.pull import _pull
+from sregistry.main.docker.pull import _build_image, _pull
 from .pull import pull
 
 
@@ -130,21 +135,27 @@ class Client(ApiConnection):
 # Functions exposed to the client
 Client.pull = pull
 Client._pull = _pull
+Client._build_image = _build_image
 
 # Api functions for image layers and manifests (hidden)
 Client._create_metadata_tar = create_metadata_tar
+Client._download_images = download_images
+Client._remove_batch = remove_batch
 Client._download_layers = download_layers
 Client._extract_runscript = extract_runscript
 Client._extract_labels = extract_labels
 Client._extract_env = extract_env
 Client._get_config = get_config
 Client._get_digests = get_digests
+Client._get_image_digest = get_image_digest
 Client._get_download_cache = get_download_cache
 Client._get_layer = get_layer
 Client._get_layerLink = get_layerLink
 Client._get_manifest = get_manifest
 Client._get_manifests = get_manifests
+Client._get_cached_manifest = get_cached_manifest
 Client._get_size = get_size
 Client._update_token = update_token
+Client._wait_manifests = wait_manifests
 Client._get_manifest_selfLink = get_manifest_selfLink
 Client._get_environment_tar = get_environment_tar
@@ -42,12 +42,19 @@ def pull(self, images, file_name=None, save=True, force=False, **kwargs):
 
     bot.debug("Execution of PULL for %s images" % len(images))
 
+    names = [
+        parse_image_name(remove_uri(image), default_collection="nvidia")
+        for image in images
+    ]
+
+    # A batch downloads the layers of all images first, each layer once
+    if len(names) > 1:
+        self._download_images(names)
+
     # If used internally we want to return a list to the user.
 
     finished = []
-    for image in images:
-        q = parse_image_name(remove_uri(image), default_collection="nvidia")
-
+    for q in names:
         image_file = self._pull(
             file_name=file_name,
             uri="nvidia://",
@@ -59,6 +66,9 @@ def pull(self, images, file_name=None, save=True, force=False, **kwargs):
 
         finished.append(image_file)
 
+    # The layers of a batch are removed, if they aren't kept
+    self._remove_batch()
+
     if len(finished) == 1:
         finished = finished[0]
     return finished
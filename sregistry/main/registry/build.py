@@ -13,6 +13,7 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 from sregistry.logger import bot, ProgressBar
 from sregistry.utils import parse_image_name, remove_uri
 
+from sregistry.main.base.session import get_session
 from requests_toolbelt import MultipartEncoder, MultipartEncoderMonitor
 
 import requests
@@ -93,7 +94,7 @@ def build(self, recipe, name, extra=None):
     headers = {"Content-Type": monitor.content_type, "Authorization": SREGISTRY_EVENT}
 
     try:
-        r = requests.post(url, data=monitor, headers=headers)
+        r = get_session().post(url, data=monitor, headers=headers)
         r.raise_for_status()
         print("\n[Return status {0} Created]".format(r.status_code))
     except requests.HTTPError as e:
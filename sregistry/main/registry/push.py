@@ -12,6 +12,7 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from sregistry.logger import bot, ProgressBar
 from sregistry.utils import parse_image_name, remove_uri
+from sregistry.main.base.session import get_session
 from requests_toolbelt import MultipartEncoder, MultipartEncoderMonitor
 
 import requests
@@ -58,7 +59,7 @@ def push(self, path, name, tag=None):
 
     headers = {"Authorization": SREGISTRY_EVENT}
 
-    r = requests.post(auth_url, json=fields, headers=headers)
+    r = get_session().post(auth_url, json=fields, headers=headers)
 
     # Always tell the user what's going on!
     message = self._read_response(r)
@@ -93,7 +94,7 @@ def push(self, path, name, tag=None):
     headers = {"Content-Type": monitor.content_type, "Authorization": SREGISTRY_EVENT}
 
     try:
-        r = requests.post(url, data=monitor, headers=headers)
+        r = get_session().post(url, data=monitor, headers=headers)
         r.raise_for_status()
         message = r.json()["message"]
         print("\n[Return status {0} {1}]".format(r.status_code, message))
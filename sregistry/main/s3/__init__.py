@@ -18,10 +18,18 @@ from botocore import UNSIGNED
 import json
 import os
 
-from .query import search, search_all, container_search
+from .query import search, search_all, container_search, list_objects, add_metadata
 from .pull import pull
 from .push import push
 from .delete import delete
+from .transfer import download_object, get_object_metadata, get_transfer_config
+from .catalog import (
+    create_catalog,
+    delete_catalog,
+    list_catalog,
+    list_images,
+    read_catalog,
+)
 
 
 class Client(ApiConnection):
@@ -179,3 +187,15 @@ Client.search = search
 Client.delete = delete
 Client._search_all = search_all
 Client._container_search = container_search
+Client._list_objects = list_objects
+Client._add_metadata = add_metadata
+Client._get_object_metadata = get_object_metadata
+Client._get_transfer_config = get_transfer_config
+Client._download_object = download_object
+
+# Catalog storage
+Client._create_catalog = create_catalog
+Client._delete_catalog = delete_catalog
+Client._list_catalog = list_catalog
+Client._list_images = list_images
+Client._read_catalog = read_catalog
@@ -0,0 +1,104 @@
+"""
+
+Copyright (C) 2018-2021 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+from sregistry.main.base.catalog import Catalog
+import botocore
+
+# Storage of the catalog (see sregistry.main.base.catalog) in the bucket
+
+
+def list_catalog(self, prefix):
+    """return the names of the catalog objects with a prefix"""
+    paginator = self.s3.meta.client.get_paginator("list_objects_v2")
+    names = []
+    for page in paginator.paginate(Bucket=self.bucket.name, Prefix=prefix):
+        names += [obj["Key"] for obj in page.get("Contents", [])]
+    return names
+
+
+def read_catalog(self, name):
+    """return the content of a catalog object, or None if it doesn't exist"""
+    try:
+        response = self.s3.meta.client.get_object(Bucket=self.bucket.name, Key=name)
+    except botocore.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] in ["404", "NoSuchKey"]:
+            return None
+        raise
+    return response["Body"].read()
+
+
+def create_catalog(self, name, content):
+    """create a catalog object, only if it doesn't exist (If-None-Match).
+    Returns False if it exists. A version of botocore (or an s3 server)
+    without conditional writes checks for the object with a head request
+    first, which doesn't stop two clients that write at the same moment.
+    """
+    client = self.s3.meta.client
+    body = content.encode("utf-8")
+    try:
+        client.put_object(
+            Bucket=self.bucket.name,
+            Key=name,
+            Body=body,
+            ContentType="application/json",
+            IfNoneMatch="*",
+        )
+    except botocore.exceptions.ParamValidationError:
+        return create_catalog_unconditional(client, self.bucket.name, name, body)
+    except botocore.exceptions.ClientError as e:
+        code = e.response["Error"]["Code"]
+        if code in ["PreconditionFailed", "ConditionalRequestConflict"]:
+            return False
+        if code == "NotImplemented":
+            return create_catalog_unconditional(client, self.bucket.name, name, body)
+        raise
+    return True
+
+
+def create_catalog_unconditional(client, bucket, name, body):
+    """create a catalog object if a head request doesn't find it, for s3
+    without If-None-Match. Returns False if it exists.
+    """
+    try:
+        client.head_object(Bucket=bucket, Key=name)
+        return False
+    except botocore.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] not in ["404", "NoSuchKey", "NotFound"]:
+            raise
+    client.put_object(
+        Bucket=bucket, Key=name, Body=body, ContentType="application/json"
+    )
+    return True
+
+
+def delete_catalog(self, name):
+    """remove a catalog object"""
+    self.s3.meta.client.delete_object(Bucket=self.bucket.name, Key=name)
+
+
+def list_images(self, prefix=""):
+    """return the images in the bucket with a prefix (e.g., a collection)
+    as catalog entries (path, size and updated), from pages of ListObjectsV2
+    with up to 1000 objects each, instead of a request per object.
+    """
+    images = []
+    paginator = self.s3.meta.client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=self.bucket.name, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            if obj["Key"].startswith(Catalog.prefix):
+                continue
+            images.append(
+                {
+                    "path": obj["Key"],
+                    "size": obj["Size"],
+                    "updated": obj["LastModified"].strftime("%Y-%m-%dT%H:%M:%SZ"),
+                }
+            )
+    return images
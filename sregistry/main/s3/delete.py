@@ -11,6 +11,7 @@ Written by Tom Schoonjans (Tom.Schoonjans@diamond.ac.uk)
 """
 
 from sregistry.logger import bot
+from sregistry.main.base.catalog import get_catalog
 from sregistry.utils import parse_image_name, remove_uri, confirm_delete
 
 
@@ -27,6 +28,11 @@ def delete(self, image, force=False):
 
         if confirm_delete(uri, force) is True:
             _object.delete()
+
+            # The image is removed from the catalog of the bucket
+            catalog = get_catalog(self)
+            if catalog is not None:
+                catalog.update(remove=[uri])
         else:
             bot.info("Delete cancelled.")
     except Exception as e:  # pylint: disable=broad-except
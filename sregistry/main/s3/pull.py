@@ -9,7 +9,8 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
 
 from sregistry.logger import bot
-from sregistry.utils import parse_image_name, remove_uri
+from sregistry.utils import link_file, parse_image_name, remove_uri
+from .transfer import TransferProgress
 import botocore
 import os
 import sys
@@ -39,6 +40,9 @@ def pull(self, images, file_name=None, save=True, **kwargs):
 
     bot.debug("Execution of PULL for %s images" % len(images))
 
+    # An image that is unchanged is linked to a file name the user asked for
+    requested = file_name is not None
+
     finished = []
     for image in images:
         image = remove_uri(image)
@@ -52,38 +56,61 @@ def pull(self, images, file_name=None, save=True, **kwargs):
 
         # First try to get the storage uri directly.
         try:
-            self.bucket.download_file(uri, file_name)
+            metadata = self._get_object_metadata(uri)
+        except botocore.exceptions.ClientError:
+            bot.exit("Error downloading image %s" % image)
 
         # If we can't find the file, help the user
-        except botocore.exceptions.ClientError as e:
-            if e.response["Error"]["Code"] == "404":
-                # Case 1, image not found, but not error with API
-                bot.error("Cannot find %s!" % file_name)
-
-                # Try to help the user with suggestions
-                results = self._search_all()
-                if len(results) > 0:
-                    bot.info("Did you mean:\n" % "\n".join(results))
-                sys.exit(1)
-
+        if metadata is None:
+            bot.error("Cannot find %s!" % file_name)
+
+            # Try to help the user with suggestions
+            results = self._search_all()
+            if len(results) > 0:
+                bot.info("Did you mean:\n" % "\n".join(results))
+            sys.exit(1)
+
+        # An image that was pushed with its sha256 is pulled once
+        size = metadata.pop("size")
+        sha256 = metadata.get("sha256")
+        if save is True and sha256 is not None and hasattr(self, "get_image_hash"):
+            container = self.get(
+                parse_image_name(image, version=sha256)["uri"], quiet=True
+            )
+            if container is not None and container.image:
+                image_file = container.image
+                if os.path.exists(image_file) and (
+                    self.get_image_hash(image_file) == sha256
+                ):
+                    bot.info("%s is unchanged, skipping download." % image)
+                    if requested:
+                        image_file = link_file(image_file, file_name)
+                    bot.custom(prefix="Success!", message=image_file)
+                    finished.append(image_file)
+                    continue
+
+        # An image with a sha256 is hashed as it's written, in one stream
+        progress = TransferProgress(size, hide=self.quiet)
+        try:
+            if sha256 is not None:
+                digest = self._download_object(uri, file_name, callback=progress)
             else:
-                # Case 2: error with request, exit.
-                bot.exit("Error downloading image %s" % image)
-
-        # if we get down here, we have a uri
-        found = None
-        for obj in self.bucket.objects.filter(Prefix=image):
-            if image in obj.key:
-                found = obj
-
-        # If we find the object, get metadata
-        metadata = {}
-        if found is not None:
-            metadata = found.get()["Metadata"]
-
-            # Metadata bug will capitalize all fields, workaround is to lowercase
-            # https://github.com/boto/boto3/issues/1709
-            metadata = dict((k.lower(), v) for k, v in metadata.items())
+                self.bucket.download_file(
+                    uri,
+                    file_name,
+                    Callback=progress,
+                    Config=self._get_transfer_config(),
+                )
+        except botocore.exceptions.ClientError:
+            bot.exit("Error downloading image %s" % image)
+        progress.done()
+
+        if sha256 is not None:
+            if digest != sha256:
+                os.remove(file_name)
+                bot.exit("Download of %s is corrupt (sha256 does not match)." % image)
+            if hasattr(self, "add_image_hash"):
+                self.add_image_hash(file_name, sha256)
 
         metadata.update(names)
 
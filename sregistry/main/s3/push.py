@@ -9,14 +9,19 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
 
 from sregistry.logger import bot
-from sregistry.utils import parse_image_name, remove_uri
+from sregistry.utils import get_file_hashes, parse_image_name, remove_uri
+from sregistry.main.base.catalog import get_catalog, get_updated
+from .transfer import TransferProgress
 
 import os
 import botocore
 
 
 def push(self, path, name, tag=None):
-    """push an image to an S3 endpoint"""
+    """push an image to an S3 endpoint. The sha256 of the image is kept in
+    the metadata of the object, and an image that is unchanged (the object
+    has the same sha256) isn't uploaded again.
+    """
 
     path = os.path.abspath(path)
     bot.debug("PUSH %s" % path)
@@ -26,12 +31,46 @@ def push(self, path, name, tag=None):
 
     # Extract the metadata
     names = parse_image_name(remove_uri(name), tag=tag)
-    image_size = os.path.getsize(path) >> 20
+    file_size = os.path.getsize(path)
+    image_size = file_size >> 20
+
+    # The hash of an image in storage is usually known (see get_image_hash),
+    # and an unchanged image (the object has the same sha256) isn't read
+    existing = self._get_object_metadata(names["storage"]) or {}
+    known = None
+    if hasattr(self, "get_image_hash"):
+        known = self.get_image_hash(path, compute=False)
+    if known is not None and existing.get("sha256") == known:
+        bot.info("%s is unchanged, skipping upload." % names["storage"])
+        return
+
+    # Otherwise the image is read once for the sha256, and the ETag to check
+    # the upload with (with the part size of the transfer, if multipart)
+    config = self._get_transfer_config()
+    stat = os.stat(path)
+    hashes = get_file_hashes(
+        path,
+        ["sha256"],
+        part_size=config.multipart_chunksize,
+        threshold=config.multipart_threshold,
+    )
+    sha256 = hashes["sha256"]
+    if hasattr(self, "add_image_hash"):
+        self.add_image_hash(path, sha256, "sha256", stat=stat)
+
+    if existing.get("sha256") == sha256:
+        bot.info("%s is unchanged, skipping upload." % names["storage"])
+        return
 
     # Create extra metadata, this is how we identify the image later
     # *important* bug in boto3 will return these capitalized
     # see https://github.com/boto/boto3/issues/1709
-    metadata = {"sizemb": "%s" % image_size, "client": "sregistry", "type": "container"}
+    metadata = {
+        "sizemb": "%s" % image_size,
+        "client": "sregistry",
+        "type": "container",
+        "sha256": sha256,
+    }
 
     ExtraArgs = {"Metadata": metadata}
 
@@ -40,11 +79,34 @@ def push(self, path, name, tag=None):
     if acl is not None:
         ExtraArgs["ACL"] = acl
 
+    progress = TransferProgress(file_size, hide=self.quiet)
     try:
-        self.bucket.upload_file(path, names["storage"], ExtraArgs)
+        self.bucket.upload_file(
+            path, names["storage"], ExtraArgs, Callback=progress, Config=config
+        )
     except botocore.exceptions.ClientError as e:
         bot.exit(
             "Could not upload {} to bucket. Ensure you have sufficient permissions to put objects in the bucket (s3:PutObject), as well as modify the object ACL if SREGISTRY_S3_OBJECT_ACL is set (s3:PutObjectAcl): {}".format(
                 path, str(e)
             )
         )
+    progress.done()
+
+    # The ETag is the md5 of the object (or parts), unless it's encrypted (KMS)
+    etag = self.bucket.Object(names["storage"]).e_tag.strip('"')
+    if etag != hashes["etag"]:
+        bot.warning(
+            "The ETag of %s does not match the image, the upload may be corrupt."
+            % names["storage"]
+        )
+
+    # The image is added to the catalog of the bucket, for search
+    catalog = get_catalog(self)
+    if catalog is not None:
+        image = {
+            "path": names["storage"],
+            "size": file_size,
+            "updated": get_updated(),
+            "sha256": sha256,
+        }
+        catalog.update(add=[image])
@@ -9,6 +9,10 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
 
 from sregistry.logger import bot
+from sregistry.defaults import SREGISTRY_WORKERS
+from sregistry.main.base.catalog import get_images
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 import sys
 import botocore
 
@@ -21,13 +25,16 @@ def search(self, query=None, args=None):
     [empty]             list all container collections
     vsoch/dinosaur      look for containers with name vsoch/dinosaur
 
+    The metadata of each image (args.metadata) is a request per image, so
+    it's only shown when asked for.
     """
+    metadata = getattr(args, "metadata", False)
 
     if query is not None:
-        return self._container_search(query)
+        return self._container_search(query, metadata=metadata)
 
     # Search collections across all fields
-    return self._search_all()
+    return self._search_all(metadata=metadata)
 
 
 ################################################################################
@@ -35,41 +42,68 @@ def search(self, query=None, args=None):
 ################################################################################
 
 
-def search_all(self, quiet=False):
-    """a "show all" search that doesn't require a query
+def list_objects(self, prefix=""):
+    """return rows (key, date modified and size) of the images in the bucket
+    with a prefix (e.g., a collection), from the catalog if there is one,
+    otherwise from pages of ListObjectsV2 (see list_images).
 
     Parameters
     ==========
-    quiet: if quiet is True, we only are using the function to return
-           rows of results.
+    prefix: only list objects with keys that start with the prefix
     """
+    images = get_images(self, lambda: self._list_images(prefix))
 
     results = []
+    for image in images:
+        if image["path"].startswith(prefix):
+            modified = datetime.strptime(image["updated"], "%Y-%m-%dT%H:%M:%SZ")
 
-    for obj in self.bucket.objects.all():
-        subsrc = obj.Object()
+            # MM-DD-YYYY
+            datestr = "%s-%s-%s" % (modified.month, modified.day, modified.year)
+            results.append([image["path"], datestr, "%sMB" % (image["size"] >> 20)])
+    return results
 
-        # Metadata bug will capitalize all fields, workaround is to lowercase
-        # https://github.com/boto/boto3/issues/1709
-        try:
-            metadata = dict((k.lower(), v) for k, v in subsrc.metadata.items())
-        except botocore.exceptions.ClientError as e:
-            bot.warning("Could not get metadata for {}: {}".format(subsrc.key, str(e)))
-            continue
 
-        size = ""
+def add_metadata(self, results):
+    """add the metadata of each image to its row (of list_objects), with a
+    head request per image, SREGISTRY_PYTHON_THREADS at once.
+    """
+    if not results:
+        return results
+    with ThreadPoolExecutor(max_workers=SREGISTRY_WORKERS) as pool:
+        found = pool.map(lambda result: get_metadata(self, result), results)
+        return [result + [values] for result, values in zip(results, found)]
 
-        # MM-DD-YYYY
-        datestr = "%s-%s-%s" % (
-            obj.last_modified.month,
-            obj.last_modified.day,
-            obj.last_modified.year,
-        )
 
-        if "sizemb" in metadata:
-            size = "%sMB" % metadata["sizemb"]
+def get_metadata(self, result):
+    """return the metadata of an image (a row of list_objects) as key=value
+    pairs, or an empty string if it can't be read.
+    """
+    try:
+        metadata = self._get_object_metadata(result[0]) or {}
+    except botocore.exceptions.ClientError as e:
+        bot.warning("Could not get metadata for {}: {}".format(result[0], str(e)))
+        return ""
+    return ",".join(
+        "%s=%s" % (key, value)
+        for key, value in sorted(metadata.items())
+        if key not in ["size", "sizemb"]
+    )
+
+
+def search_all(self, quiet=False, metadata=False):
+    """a "show all" search that doesn't require a query
 
-        results.append([obj.key, datestr, size])
+    Parameters
+    ==========
+    quiet: if quiet is True, we only are using the function to return
+           rows of results.
+    metadata: if True, show the metadata of each image (a request per image)
+    """
+
+    results = self._list_objects()
+    if metadata:
+        results = self._add_metadata(results)
 
     if len(results) == 0:
         bot.info("No container collections found.")
@@ -81,20 +115,29 @@ def search_all(self, quiet=False):
     return results
 
 
-def container_search(self, query, across_collections=False):
+def container_search(self, query, across_collections=False, metadata=False):
     """search for a specific container. If across collections is False,
     the query is parsed as a full container name and a specific container
-    is returned. If across_collections is True, the container is searched
+    is returned, and only the collection of the query (a prefix) is
+    listed. If across_collections is True, the container is searched
     for across collections. If across collections is True, details are
     not shown"""
 
-    results = self._search_all(quiet=True)
+    prefix = ""
+    if not across_collections and "/" in query:
+        prefix = query.rsplit("/", 1)[0] + "/"
+
+    results = self._list_objects(prefix=prefix)
     matches = []
     for result in results:
         # This is the container name
         if query in result[0]:
             matches.append(result)
 
+    # The metadata is only needed for the matches
+    if metadata:
+        matches = self._add_metadata(matches)
+
     if len(matches) > 0:
         bot.info("Containers %s" % query)
         bot.table(matches)
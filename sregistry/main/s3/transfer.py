@@ -0,0 +1,104 @@
+"""
+
+Copyright (C) 2018-2021 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+from sregistry.logger import ProgressBar
+from boto3.s3.transfer import TransferConfig
+import botocore
+import hashlib
+import threading
+
+# Images are often many gigabytes, so parts are larger than the boto3 default
+MULTIPART_CHUNKSIZE = 64 * 1024 * 1024
+MAX_CONCURRENCY = 10
+
+
+def get_transfer_config(self):
+    """return the boto3 TransferConfig for uploads and downloads, from the
+    settings (environment or client secrets):
+
+    SREGISTRY_S3_MULTIPART_THRESHOLD: files this size (bytes) or larger are
+        transferred in parts (defaults to the chunksize)
+    SREGISTRY_S3_MULTIPART_CHUNKSIZE: the size of each part (64MB)
+    SREGISTRY_S3_MAX_CONCURRENCY: the number of parts transferred at once (10),
+        1 transfers parts one at a time in the calling thread
+    """
+    chunksize = int(
+        self._get_setting("SREGISTRY_S3_MULTIPART_CHUNKSIZE", MULTIPART_CHUNKSIZE)
+    )
+    threshold = int(self._get_setting("SREGISTRY_S3_MULTIPART_THRESHOLD", chunksize))
+    concurrency = int(
+        self._get_setting("SREGISTRY_S3_MAX_CONCURRENCY", MAX_CONCURRENCY)
+    )
+    return TransferConfig(
+        multipart_threshold=threshold,
+        multipart_chunksize=chunksize,
+        max_concurrency=max(concurrency, 1),
+        use_threads=concurrency > 1,
+    )
+
+
+def get_object_metadata(self, key):
+    """return the metadata of an object in the bucket (with lowercase keys),
+    and its size ("size"), from a head request. None if it doesn't exist.
+    """
+    try:
+        response = self.s3.meta.client.head_object(Bucket=self.bucket.name, Key=key)
+    except botocore.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] in ["404", "NoSuchKey"]:
+            return None
+        raise
+
+    # Metadata bug will capitalize all fields, workaround is to lowercase
+    # https://github.com/boto/boto3/issues/1709
+    metadata = dict((k.lower(), v) for k, v in response["Metadata"].items())
+    metadata["size"] = response["ContentLength"]
+    return metadata
+
+
+def download_object(self, key, file_name, callback=None):
+    """stream an object in the bucket to a file, and return the sha256 of the
+    content as it's written, so the file doesn't need to be read again.
+    The callback (e.g., a TransferProgress) is called with the bytes of each
+    chunk.
+    """
+    response = self.s3.meta.client.get_object(Bucket=self.bucket.name, Key=key)
+    hasher = hashlib.sha256()
+    with open(file_name, "wb") as filey:
+        for chunk in response["Body"].iter_chunks(chunk_size=1 << 20):
+            hasher.update(chunk)
+            filey.write(chunk)
+            if callback is not None:
+                callback(len(chunk))
+    return hasher.hexdigest()
+
+
+class TransferProgress(object):
+    """a progress bar (in MB) for a transfer, as the Callback of boto3. It's
+    called with the bytes of each part as they are transferred, from the
+    threads of the transfer.
+    """
+
+    def __init__(self, size, hide=None):
+        self.bar = ProgressBar(
+            expected_size=max(size >> 20, 1), filled_char="=", hide=hide
+        )
+        self.transferred = 0
+        self.shown = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, count):
+        with self.lock:
+            self.transferred += count
+            if self.transferred >> 20 != self.shown:
+                self.shown = self.transferred >> 20
+                self.bar.show(self.shown)
+
+    def done(self):
+        self.bar.done()
@@ -14,8 +14,15 @@ from sregistry.main import ApiConnection
 import sys
 
 from .pull import pull
-from .push import push
+from .push import push, push_segment, push_segments, remove_segments
 from .query import search, search_all, container_query
+from .catalog import (
+    create_catalog,
+    delete_catalog,
+    list_catalog,
+    list_images,
+    read_catalog,
+)
 
 
 class Client(ApiConnection):
@@ -84,7 +91,7 @@ class Client(ApiConnection):
             ]:
                 self.config[envar] = self._required_get_and_update(envar)
 
-            self.conn = swiftclient.Connection(
+            self._connection_args = dict(
                 preauthurl=self.config["SREGISTRY_SWIFT_OS_STORAGE_URL"],
                 preauthtoken=self.config["SREGISTRY_SWIFT_OS_AUTH_TOKEN"],
             )
@@ -108,7 +115,7 @@ class Client(ApiConnection):
             }
 
             # Save the connection to use for some command
-            self.conn = swiftclient.Connection(
+            self._connection_args = dict(
                 user=self.config["SREGISTRY_SWIFT_USER"],
                 key=self.config["SREGISTRY_SWIFT_TOKEN"],
                 os_options=_os_options,
@@ -137,7 +144,7 @@ class Client(ApiConnection):
             }
 
             # Save the connection to use for some command
-            self.conn = swiftclient.Connection(
+            self._connection_args = dict(
                 user=self.config["SREGISTRY_SWIFT_USER"],
                 key=self.config["SREGISTRY_SWIFT_TOKEN"],
                 os_options=_os_options,
@@ -158,12 +165,24 @@ class Client(ApiConnection):
             auth_url = "%s/auth/" % self.config["SREGISTRY_SWIFT_URL"]
 
             # Save the connection to use for some command
-            self.conn = swiftclient.Connection(
+            self._connection_args = dict(
                 user=self.config["SREGISTRY_SWIFT_USER"],
                 key=self.config["SREGISTRY_SWIFT_TOKEN"],
                 authurl=auth_url,
             )
 
+        self.conn = swiftclient.Connection(**self._connection_args)
+
+    def _get_connection(self):
+        """return a new connection with the same authentication as the
+        client, for a thread to use (a connection isn't thread safe). If the
+        client has a token, it's reused instead of authenticating again.
+        """
+        args = dict(self._connection_args)
+        if self.conn.url and self.conn.token:
+            args.update(preauthurl=self.conn.url, preauthtoken=self.conn.token)
+        return swiftclient.Connection(**args)
+
     def __str__(self):
         return type(self)
 
@@ -171,8 +190,18 @@ class Client(ApiConnection):
 # Add your different functions imported at the top to the client here
 Client.pull = pull
 Client.push = push
+Client._push_segment = push_segment
+Client._push_segments = push_segments
+Client._remove_segments = remove_segments
 
 # Query functions
 Client.search = search
 Client._search_all = search_all
 Client._container_query = container_query
+
+# Catalog storage
+Client._create_catalog = create_catalog
+Client._delete_catalog = delete_catalog
+Client._list_catalog = list_catalog
+Client._list_images = list_images
+Client._read_catalog = read_catalog
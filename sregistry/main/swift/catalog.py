@@ -0,0 +1,88 @@
+"""
+
+Copyright (C) 2018-2021 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+from swiftclient.exceptions import ClientException
+
+# The container of the catalog (see sregistry.main.base.catalog), swift
+# doesn't have a bucket for all collections
+CATALOG_CONTAINER = "sregistry_catalog"
+
+
+def list_catalog(self, prefix):
+    """return the names of the catalog objects with a prefix"""
+    try:
+        listing = self.conn.get_container(
+            CATALOG_CONTAINER, prefix=prefix, full_listing=True
+        )[1]
+    except ClientException as e:
+        if e.http_status == 404:
+            return []
+        raise
+    return [item["name"] for item in listing]
+
+
+def read_catalog(self, name):
+    """return the content of a catalog object, or None if it doesn't exist"""
+    try:
+        return self.conn.get_object(CATALOG_CONTAINER, name)[1]
+    except ClientException as e:
+        if e.http_status == 404:
+            return None
+        raise
+
+
+def create_catalog(self, name, content):
+    """create a catalog object, only if it doesn't exist (If-None-Match).
+    Returns False if it exists.
+    """
+    self.conn.put_container(CATALOG_CONTAINER)
+    try:
+        self.conn.put_object(
+            CATALOG_CONTAINER,
+            name,
+            contents=content,
+            content_type="application/json",
+            headers={"If-None-Match": "*"},
+        )
+    except ClientException as e:
+        if e.http_status == 412:
+            return False
+        raise
+    return True
+
+
+def delete_catalog(self, name):
+    """remove a catalog object"""
+    try:
+        self.conn.delete_object(CATALOG_CONTAINER, name)
+    except ClientException as e:
+        if e.http_status != 404:
+            raise
+
+
+def list_images(self):
+    """return the images in all collections (containers) as catalog entries
+    (path, size and updated), a listing of each container. The containers
+    of the catalog, and of the segments of large images, aren't collections.
+    """
+    images = []
+    for container in self.conn.get_account(full_listing=True)[1]:
+        name = container["name"]
+        if name == CATALOG_CONTAINER or name.endswith("_segments"):
+            continue
+        for item in self.conn.get_container(name, full_listing=True)[1]:
+            images.append(
+                {
+                    "path": "%s/%s" % (name, item["name"]),
+                    "size": item["bytes"],
+                    "updated": item["last_modified"],
+                }
+            )
+    return images
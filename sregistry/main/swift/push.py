@@ -9,15 +9,27 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
 
 from sregistry.logger import bot
-from sregistry.utils import parse_image_name, remove_uri
+from sregistry.defaults import SREGISTRY_SWIFT_SEGMENT_SIZE, SREGISTRY_SWIFT_SEGMENTS
+from sregistry.main.base.catalog import get_catalog, get_updated
+from sregistry.utils import get_segments, parse_image_name, remove_uri
+from swiftclient.exceptions import ClientException
+from concurrent.futures import ThreadPoolExecutor
 
+import hashlib
+import json
 import sys
 import os
+import threading
+
+# Bytes that swiftclient reads (and sends) at once
+CHUNK_SIZE = 1 << 20
 
 
 def push(self, path, name, tag=None):
     """push an image to your Storage. If the collection doesn't exist,
-    it is created.
+    it is created. The image is streamed from the file, and an image larger
+    than SREGISTRY_SWIFT_SEGMENT_SIZE is uploaded in segments (see
+    push_segments).
 
     Parameters
     ==========
@@ -45,17 +57,44 @@ def push(self, path, name, tag=None):
     image_name = os.path.basename(names["storage"])
 
     # prepare the progress bar
-    progress = 0
-    bot.show_progress(progress, file_size, length=35)
+    progress = _Progress(file_size)
 
     # Put the (actual) container into the collection
-    with open(path, "rb") as F:
-        self.conn.put_object(
-            names["collection"],
-            image_name,
-            contents=F.read(),
-            content_type="application/octet-stream",
-        )
+    if file_size > SREGISTRY_SWIFT_SEGMENT_SIZE:
+        prefix = self._push_segments(path, names["collection"], image_name, progress)
+    else:
+        reader = _SegmentReader(path, 0, file_size, progress)
+        try:
+            etag = self.conn.put_object(
+                names["collection"],
+                image_name,
+                contents=reader,
+                content_length=file_size,
+                chunk_size=CHUNK_SIZE,
+                content_type="application/octet-stream",
+            )
+        finally:
+            reader.close()
+        prefix = None
+
+        if etag != reader.md5.hexdigest():
+            bot.warning(
+                "The etag of %s does not match the image, the upload may be corrupt."
+                % image_name
+            )
+
+    # Segments of an image that was pushed before aren't used anymore
+    self._remove_segments(names["collection"], image_name, keep=prefix)
+
+    # The image is added to the catalog, for search
+    catalog = get_catalog(self)
+    if catalog is not None:
+        image = {
+            "path": "%s/%s" % (names["collection"], image_name),
+            "size": file_size,
+            "updated": get_updated(),
+        }
+        catalog.update(add=[image])
 
     # Finish up
     bot.show_progress(
@@ -64,3 +103,231 @@ def push(self, path, name, tag=None):
 
     # Newline to finish download
     sys.stdout.write("\n")
+
+
+def push_segments(self, path, collection, image_name, progress):
+    """push an image as a large object: segments are uploaded in parallel
+    (SREGISTRY_SWIFT_SEGMENTS at once) to the container <collection>_segments,
+    and a manifest of them is put as the image. A static large object (slo)
+    is used if the cluster has it, otherwise a dynamic one (dlo).
+
+    Segments are named by the image, its modification time and size, so a
+    push that was interrupted finds the segments it uploaded, and only
+    uploads those that are missing (or don't match the file).
+
+    Parameters
+    ==========
+    path: the path to the image file
+    collection: the container (collection) to put the image in
+    image_name: the name of the image object
+    progress: the progress of the upload, updated with bytes uploaded
+
+    Returns
+    =======
+    prefix: the prefix of the segments in the segments container
+    """
+    file_size = os.path.getsize(path)
+    segment_size = SREGISTRY_SWIFT_SEGMENT_SIZE
+    segments_container = "%s_segments" % collection
+
+    try:
+        slo = self.conn.get_capabilities().get("slo")
+    except ClientException:
+        slo = None
+
+    # A static manifest has a maximum number of segments
+    if slo is not None:
+        limit = slo.get("max_manifest_segments", 1000)
+        segment_size = max(segment_size, -(-file_size // limit))
+
+    mtime = int(os.path.getmtime(path))
+    prefix = "%s/%s/%s/%s/" % (image_name, mtime, file_size, segment_size)
+    self._get_or_create_collection(segments_container)
+
+    # Segments already uploaded (by an interrupted push) are resumed
+    try:
+        listing = self.conn.get_container(
+            segments_container, prefix=prefix, full_listing=True
+        )[1]
+    except ClientException:
+        listing = []
+    existing = dict((item["name"], item) for item in listing)
+
+    tasks = []
+    for index, (offset, length) in enumerate(get_segments(file_size, segment_size)):
+        segment_name = "%s%08d" % (prefix, index)
+        segment = existing.get(segment_name)
+        tasks.append(
+            (path, segments_container, segment_name, offset, length, progress, segment)
+        )
+
+    bot.debug("Pushing %s segments of %s" % (len(tasks), image_name))
+    with ThreadPoolExecutor(max_workers=max(SREGISTRY_SWIFT_SEGMENTS, 1)) as pool:
+        futures = [pool.submit(self._push_segment, *task) for task in tasks]
+        try:
+            etags = [future.result() for future in futures]
+        except (KeyboardInterrupt, SystemExit):
+            for future in futures:
+                future.cancel()
+            raise
+        except ClientException as e:
+            for future in futures:
+                future.cancel()
+            bot.exit("Could not push a segment of %s: %s" % (image_name, e))
+
+    if slo is not None:
+        manifest = [
+            {
+                "path": "/%s/%s" % (segments_container, task[2]),
+                "etag": etag,
+                "size_bytes": task[4],
+            }
+            for task, etag in zip(tasks, etags)
+        ]
+        self.conn.put_object(
+            collection,
+            image_name,
+            contents=json.dumps(manifest),
+            content_type="application/octet-stream",
+            query_string="multipart-manifest=put",
+        )
+    else:
+        self.conn.put_object(
+            collection,
+            image_name,
+            contents=b"",
+            content_type="application/octet-stream",
+            headers={"X-Object-Manifest": "%s/%s" % (segments_container, prefix)},
+        )
+    return prefix
+
+
+def push_segment(
+    self, path, container, segment_name, offset, length, progress, existing=None
+):
+    """push one segment of an image with a connection of its own (this is
+    run in a thread), unless the segment exists with the same md5, e.g.,
+    from an interrupted push. Returns the etag (md5) of the segment.
+
+    Parameters
+    ==========
+    path: the path to the image file
+    container: the container to put the segment in
+    segment_name: the name of the segment object
+    offset: the offset of the segment in the file
+    length: the length of the segment in bytes
+    progress: the progress of the upload, updated with bytes uploaded
+    existing: the listing (name, bytes and hash) of the segment, if it exists
+    """
+    reader = _SegmentReader(path, offset, length, progress)
+    try:
+        if existing is not None and existing["bytes"] == length:
+            for _ in iter(lambda: reader.read(CHUNK_SIZE), b""):
+                pass
+            if reader.md5.hexdigest() == existing["hash"]:
+                bot.debug("Segment %s exists, skipping." % segment_name)
+                return existing["hash"]
+            reader.seek(0)
+
+        conn = self._get_connection()
+        try:
+            etag = conn.put_object(
+                container,
+                segment_name,
+                contents=reader,
+                content_length=length,
+                chunk_size=CHUNK_SIZE,
+                content_type="application/octet-stream",
+            )
+        finally:
+            conn.close()
+    finally:
+        reader.close()
+
+    # The manifest of a static large object needs the md5 of each segment
+    if etag != reader.md5.hexdigest():
+        raise ClientException("The etag of segment %s does not match." % segment_name)
+    return etag
+
+
+def remove_segments(self, collection, image_name, keep=None):
+    """remove the segments of an image from <collection>_segments, other than
+    those with the prefix keep (the segments of the image that was pushed).
+    """
+    segments_container = "%s_segments" % collection
+    try:
+        listing = self.conn.get_container(
+            segments_container, prefix="%s/" % image_name, full_listing=True
+        )[1]
+    except ClientException:
+        return
+
+    for item in listing:
+        if keep is None or not item["name"].startswith(keep):
+            bot.debug("Removing old segment %s" % item["name"])
+            try:
+                self.conn.delete_object(segments_container, item["name"])
+            except ClientException:
+                bot.warning("Could not remove old segment %s" % item["name"])
+
+
+class _Progress(object):
+    """the progress of an upload in bytes, shown as a progress bar. Segments
+    are uploaded in threads, so updates are locked.
+    """
+
+    def __init__(self, total):
+        self.total = max(total, 1)
+        self.done = 0
+        self.percent = None
+        self.lock = threading.Lock()
+
+    def update(self, count):
+        with self.lock:
+            self.done += count
+            percent = 100 * self.done // self.total
+            if percent != self.percent:
+                self.percent = percent
+                bot.show_progress(self.done, self.total, length=35)
+
+
+class _SegmentReader(object):
+    """read a segment (length bytes from an offset) of a file for a put,
+    updating the progress with the bytes read, and the md5 of the segment
+    (to check the etag of the put). swiftclient seeks back to the start
+    (tell) to retry a put that failed, which takes the bytes back off the
+    progress.
+    """
+
+    def __init__(self, path, offset, length, progress):
+        self.fileobj = open(path, "rb")
+        self.fileobj.seek(offset)
+        self.offset = offset
+        self.length = length
+        self.position = 0
+        self.progress = progress
+        self.md5 = hashlib.md5()
+
+    def read(self, size=-1):
+        remaining = self.length - self.position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        chunk = self.fileobj.read(size)
+        self.position += len(chunk)
+        self.md5.update(chunk)
+        self.progress.update(len(chunk))
+        return chunk
+
+    def tell(self):
+        return self.position
+
+    def seek(self, position, whence=0):
+        if whence != 0 or position != 0:
+            raise ValueError("A segment can only seek to the start.")
+        self.md5 = hashlib.md5()
+        self.progress.update(position - self.position)
+        self.position = position
+        self.fileobj.seek(self.offset + position)
+
+    def close(self):
+        self.fileobj.close()
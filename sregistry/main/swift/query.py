@@ -9,6 +9,7 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
 
 from sregistry.logger import bot
+from sregistry.main.base.catalog import get_images
 from sregistry.utils import remove_uri
 
 import sys
@@ -32,13 +33,8 @@ def search(self, query=None, args=None):
 def search_all(self):
     """a "show all" search that doesn't require a query"""
 
-    results = set()
-
-    # Here we get names of collections, and then look up containers
-    for container in self.conn.get_account()[1]:
-        # The result here is just the name
-        for result in self.conn.get_container(container["name"])[1]:
-            results.add("%s/%s" % (container["name"], result["name"]))
+    # The path of each image is <collection>/<name>
+    results = set(image["path"] for image in get_images(self, self._list_images))
 
     if len(results) == 0:
         bot.info("No container collections found.")
@@ -59,12 +55,10 @@ def container_query(self, query):
 
     query = remove_uri(query)
 
-    # Here we get names of collections, and then look up containers
-    for container in self.conn.get_account()[1]:
-        # The result here is just the name
-        for result in self.conn.get_container(container["name"])[1]:
-            if query in result["name"]:
-                results.add("%s/%s" % (container["name"], result["name"]))
+    # The name of the image follows the collection
+    for image in get_images(self, self._list_images):
+        if query in image["path"].split("/", 1)[-1]:
+            results.add(image["path"])
 
     if len(results) == 0:
         bot.info("No container collections found.")
@@ -11,3 +11,4 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 # Multiprocess Worker
 from sregistry.main.workers.worker import Workers
 from sregistry.main.workers.tasks import download_task
+from sregistry.main.workers.blobs import BlobStore
@@ -10,21 +10,39 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 """
 
-from sregistry.defaults import DISABLE_SSL_CHECK
+from sregistry.auth import get_token_cache
+from sregistry.defaults import DISABLE_SSL_CHECK, SREGISTRY_DOWNLOAD_RETRIES
 from sregistry.logger import bot
+from sregistry.main.base.ranges import (
+    get_resume_headers,
+    lock_partial,
+    remove_partial,
+)
+from sregistry.main.base.http import write_stream
+from sregistry.main.base.session import get_session
+from sregistry.main.workers.blobs import BlobStore
+from sregistry.utils import get_partial_file
+from requests.exceptions import ChunkedEncodingError, ConnectionError
+from datetime import datetime
 import os
-import requests
 import shutil
-import sys
 import tempfile
 
+try:
+    from urllib.parse import urlparse  # python 3.*
+except:
+    from urlparse import urlparse  # python 2.*
+
+# One ecr client per process, created on first token refresh
+_ecr = None
+
 
 ################################################################################
 ## Shared Tasks for the Worker
 ################################################################################
 
 
-def download_task(url, headers, download_to, download_type="layer"):
+def download_task(url, headers, download_to, download_type="layer", digest=None):
     """download an image layer (.tar.gz) to a specified download folder.
     This task is done by using local versions of the same download functions
     that are used for the client.
@@ -35,16 +53,41 @@ def download_task(url, headers, download_to, download_type="layer"):
     image_id: the shasum id of the layer, already determined to not exist
     repo_name: the image name (library/ubuntu) to retrieve
     download_to: download to this folder. If not set, uses temp.
+    digest: if provided, verify the content against this digest
 
 
     """
+    # A layer already in the cache (or linked from the blob store) is kept,
+    # if it matches the digest. Otherwise it is quarantined and downloaded
+    if os.path.exists(download_to):
+        blobs = BlobStore()
+        if digest is None or blobs.verify(digest, download_to):
+            return download_to
+        blobs.quarantine(digest, download_to)
+
     # Update the user what we are doing
     bot.verbose("Downloading %s from %s" % (download_type, url))
 
-    # Step 1: Download the layer atomically
-    file_name = "%s.%s" % (download_to, next(tempfile._get_candidate_names()))
-
-    tar_download = download(url, file_name, headers=headers)
+    # Step 1: Download the layer atomically, retry if the digest doesn't match
+    # An interrupted download is resumed by the next attempt
+    for attempt in range(1, SREGISTRY_DOWNLOAD_RETRIES + 1):
+        file_name = "%s.%s" % (download_to, next(tempfile._get_candidate_names()))
+        try:
+            tar_download = download(url, file_name, headers=headers, digest=digest)
+        except (ChunkedEncodingError, ConnectionError) as e:
+            bot.warning(
+                "Download of %s interrupted (attempt %s of %s): %s"
+                % (url, attempt, SREGISTRY_DOWNLOAD_RETRIES, e)
+            )
+            continue
+        if tar_download is not None:
+            break
+        bot.warning(
+            "Digest mismatch for %s (attempt %s of %s)"
+            % (url, attempt, SREGISTRY_DOWNLOAD_RETRIES)
+        )
+    else:
+        bot.exit("Cannot verify %s, was there a problem with download?" % url)
 
     try:
         shutil.move(tar_download, download_to)
@@ -67,98 +110,103 @@ def download_task(url, headers, download_to, download_type="layer"):
 ################################################################################
 
 
-def download(url, file_name, headers=None, show_progress=True):
-    """stream to a temporary file, rename on successful completion
+def download(url, file_name, headers=None, show_progress=True, digest=None):
+    """stream to a partial file, rename on successful completion. If a
+    digest is provided and the content does not match, None is returned.
+    The partial file is named by the digest (or url) so that an interrupted
+    download is resumed by the next attempt with a Range request.
 
     Parameters
     ==========
     file_name: the file name to stream to
     url: the url to stream from
     headers: additional headers to add
+    digest: if provided, verify the content against this digest
     """
 
-    fd, tmp_file = tempfile.mkstemp(prefix=("%s.tmp." % file_name))
-    os.close(fd)
+    partial_file = get_partial_file(digest or url.split("?")[0])
 
     if DISABLE_SSL_CHECK is True:
         bot.warning("Verify of certificates disabled! ::TESTING USE ONLY::")
 
-    stream(url, headers=headers, stream_to=tmp_file)
-    shutil.move(tmp_file, file_name)
+    # Lock the partial file, another pull might be resuming the same download
+    with lock_partial(partial_file):
+        # The content did not match the digest (and was quarantined)
+        response = stream(
+            url, headers=headers, stream_to=partial_file, digest=digest, resume=True
+        )
+        if response is None:
+            remove_partial(partial_file)
+            return None
+
+        shutil.move(partial_file, file_name)
+        remove_partial(partial_file)
     return file_name
 
 
-def stream(url, headers, stream_to=None, retry=True):
+def stream(url, headers, stream_to=None, retry=True, digest=None, resume=False):
     """stream is a get that will stream to file_name. Since this is a worker
     task, it differs from the client provided version in that it requires
-    headers.
+    headers. If a digest is provided, chunks are hashed as they are written,
+    and a file that doesn't match is quarantined (and None returned). If
+    resume is True and stream_to is a partial download, the rest of it is
+    requested with a Range header.
     """
     bot.debug("GET %s" % url)
 
     if DISABLE_SSL_CHECK is True:
         bot.warning("Verify of certificates disabled! ::TESTING USE ONLY::")
 
+    request_headers = dict(headers or {})
+    if resume is True:
+        request_headers.update(get_resume_headers(stream_to, digest))
+
     # Ensure headers are present, update if not
-    response = requests.get(
-        url, headers=headers, verify=not DISABLE_SSL_CHECK, stream=True
+    response = get_session().get(
+        url, headers=request_headers, verify=not DISABLE_SSL_CHECK, stream=True
     )
 
     # If we get permissions error, one more try with updated token
-    if response.status_code in [401, 403]:
-        headers = update_token(headers)
-        return stream(url, headers, stream_to, retry=False)
+    if response.status_code in [401, 403] and retry is True:
+        headers = update_token(headers, url)
+        return stream(
+            url, headers, stream_to, retry=False, digest=digest, resume=resume
+        )
+
+    # The partial download is no longer valid, start over
+    elif response.status_code == 416 and "Range" in request_headers:
+        response.close()
+        remove_partial(stream_to)
+        return stream(
+            url, headers, stream_to, retry=retry, digest=digest, resume=resume
+        )
 
     # Successful Response
-    elif response.status_code == 200:
-        # Keep user updated with Progress Bar
-        content_size = None
-        if "Content-Length" in response.headers:
-            progress = 0
-            content_size = int(response.headers["Content-Length"])
-            bot.show_progress(progress, content_size, length=35)
-
-        chunk_size = 1 << 20
-        with open(stream_to, "wb") as filey:
-            for chunk in response.iter_content(chunk_size=chunk_size):
-                filey.write(chunk)
-                if content_size is not None:
-                    progress += chunk_size
-                    bot.show_progress(
-                        iteration=progress,
-                        total=content_size,
-                        length=35,
-                        carriage_return=False,
-                    )
-
-        # Newline to finish download
-        sys.stdout.write("\n")
-
-        return stream_to
+    elif response.status_code in [200, 206]:
+        return write_stream(response, stream_to, digest=digest, resume=resume)
 
     bot.exit("Problem with stream, response %s" % (response.status_code))
 
 
-def update_token(headers):
+def update_token(headers, url=None):
     """update_token uses HTTP basic authentication to attempt to authenticate
     given a 401 response. We take as input previous headers, and update
-    them.
+    them. The token is shared with other workers (and the client) via the
+    token cache, so only one worker initializes awscli to fetch it.
 
     Parameters
     ==========
-    response: the http request response to parse for the challenge.
+    headers: the headers of the request, updated with the token
+    url: the url of the request, to determine the registry of the token
 
     """
-    try:
-        from awscli.clidriver import create_clidriver
-    except:
-        bot.exit("Please install pip install sregistry[aws]")
+    rejected = headers.get("Authorization", "").replace("Basic ", "", 1)
 
-    driver = create_clidriver()
-    aws = driver.session.create_client("ecr")
-    tokens = aws.get_authorization_token()
-    token = tokens["authorizationData"][0]["authorizationToken"]
+    def fetch():
+        return get_ecr_token(get_ecr_client())
 
     try:
+        token = get_token_cache().get(get_ecr_key(url), fetch, rejected=rejected)
         token = {"Authorization": "Basic %s" % token}
         headers.update(token)
 
@@ -166,3 +214,38 @@ def update_token(headers):
         bot.exit("Error getting token.")
 
     return headers
+
+
+def get_ecr_client():
+    """return the ecr client for this process, created on first use"""
+    global _ecr
+    if _ecr is None:
+        try:
+            from awscli.clidriver import create_clidriver
+        except:
+            bot.exit("Please install pip install sregistry[aws]")
+
+        driver = create_clidriver()
+        _ecr = driver.session.create_client("ecr")
+    return _ecr
+
+
+def get_ecr_token(aws):
+    """get an authorization token from an ecr client, returned as a tuple
+    (token, expires_in) for the token cache.
+    """
+    tokens = aws.get_authorization_token()
+    data = tokens["authorizationData"][0]
+    expires_in = None
+    if data.get("expiresAt") is not None:
+        expires = data["expiresAt"]
+        expires_in = (expires - datetime.now(expires.tzinfo)).total_seconds()
+    return data["authorizationToken"], expires_in
+
+
+def get_ecr_key(url=None):
+    """return the token cache key for an ecr registry, based on a url"""
+    registry = ""
+    if url is not None:
+        registry = urlparse(url).netloc
+    return "ecr %s" % registry
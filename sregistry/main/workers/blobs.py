@@ -0,0 +1,259 @@
+"""
+
+Copyright (C) 2017-2021 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+from sregistry.defaults import SREGISTRY_BLOBS
+from sregistry.logger import bot
+from sregistry.utils import mkdir_p
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+
+class BlobStore(object):
+    """A content addressed store for image layers, shared by all registry
+    clients that download layers (docker, nvidia, aws). Blobs are kept
+    under fan-out folders named by their digest:
+
+        <root>/sha256/ab/abcdef...
+
+    A blob is published atomically (linked from the store tmp folder) and
+    referenced by hard linking it into a client download cache, so the
+    reference count for a blob is the link count of the file minus one.
+    If the filesystem doesn't support hard links, we fall back to a copy.
+    """
+
+    def __init__(self, root=None):
+        if root is None:
+            root = SREGISTRY_BLOBS
+        self.root = root
+        self.tmpdir = os.path.join(self.root, "tmp")
+        self.quarantine_dir = os.path.join(self.root, "quarantine")
+        mkdir_p(self.tmpdir)
+
+    def __str__(self):
+        return "[blobs][%s]" % self.root
+
+    def __repr__(self):
+        return self.__str__()
+
+    def path(self, digest):
+        """return the path to a blob in the store, based on the digest
+
+        Parameters
+        ==========
+        digest: the digest of the blob, e.g., sha256:<hexdigest>
+        """
+        algorithm, hexdigest = parse_digest(digest)
+        return os.path.join(self.root, algorithm, hexdigest[0:2], hexdigest)
+
+    def exists(self, digest):
+        """determine if a blob exists in the store"""
+        return os.path.exists(self.path(digest))
+
+    def refcount(self, digest):
+        """return the number of references (links outside of the store) to
+        a blob, or None if the blob does not exist.
+        """
+        blob = self.path(digest)
+        if not os.path.exists(blob):
+            return None
+        return os.stat(blob).st_nlink - 1
+
+    def add(self, digest, filename):
+        """add a downloaded file to the store, and leave a reference to the
+        blob at the original filename. If the blob already exists (another
+        client published it first) the file is replaced by a reference.
+        The file must already be verified against the digest, either while
+        it was streamed (see get_hasher) or with verify.
+
+        Parameters
+        ==========
+        digest: the digest of the blob, e.g., sha256:<hexdigest>
+        filename: the downloaded file to add to the store
+        """
+        blob = self.path(digest)
+        if not os.path.exists(blob):
+            mkdir_p(os.path.dirname(blob))
+            self._publish(filename, blob)
+        return self.link(digest, filename)
+
+    def link(self, digest, filename):
+        """create a reference to a blob at a filename, typically the layer
+        path in a client download cache. The reference is created with a
+        temporary name and then renamed so readers never see a partial file.
+
+        Parameters
+        ==========
+        digest: the digest of the blob, e.g., sha256:<hexdigest>
+        filename: the path to create the reference at
+        """
+        blob = self.path(digest)
+        if os.path.exists(filename) and os.path.samefile(blob, filename):
+            return filename
+
+        tmp_file = self._get_tmpfile(os.path.dirname(os.path.abspath(filename)))
+        os.remove(tmp_file)
+        try:
+            os.link(blob, tmp_file)
+        except OSError:
+            shutil.copyfile(blob, tmp_file)
+        os.rename(tmp_file, filename)
+        return filename
+
+    def verify(self, digest, filename):
+        """determine if a file (e.g., a layer left in a download cache) matches
+        the digest that names it. A reference to the blob in the store was
+        verified when the blob was published, and isn't read again. If the
+        algorithm isn't supported, the file can't be verified (as for a
+        download) and is accepted.
+
+        Parameters
+        ==========
+        digest: the digest of the blob, e.g., sha256:<hexdigest>
+        filename: the file to verify
+        """
+        blob = self.path(digest)
+        if os.path.exists(blob) and os.path.samefile(blob, filename):
+            return True
+
+        hasher = get_hasher(digest)
+        if hasher is None:
+            return True
+        with open(filename, "rb") as filey:
+            for chunk in iter(lambda: filey.read(1 << 20), b""):
+                hasher.update(chunk)
+        if not verify_digest(digest, hasher):
+            bot.warning("%s does not match its digest %s" % (filename, digest))
+            return False
+        return True
+
+    def quarantine(self, digest, filename):
+        """move a download that failed digest verification out of the way,
+        so it is never cached, but is kept for inspection.
+
+        Parameters
+        ==========
+        digest: the digest that the file was expected to have
+        filename: the file that did not match the digest
+        """
+        _, hexdigest = parse_digest(digest)
+        mkdir_p(self.quarantine_dir)
+        fd, quarantined = tempfile.mkstemp(
+            prefix="%s." % hexdigest, dir=self.quarantine_dir
+        )
+        os.close(fd)
+        shutil.move(filename, quarantined)
+        bot.warning("Quarantined %s to %s" % (digest, quarantined))
+        return quarantined
+
+    def prune(self, max_age=86400):
+        """remove blobs that are no longer referenced by any download cache,
+        along with temporary files older than max_age seconds (possibly
+        left by an interrupted pull). Quarantined files are kept for
+        inspection. Returns the list of removed blobs.
+        """
+        skip = [os.path.basename(self.tmpdir), os.path.basename(self.quarantine_dir)]
+        removed = []
+        for algorithm in os.listdir(self.root):
+            if algorithm in skip:
+                continue
+            for dirpath, _, filenames in os.walk(os.path.join(self.root, algorithm)):
+                for filename in filenames:
+                    blob = os.path.join(dirpath, filename)
+                    if os.stat(blob).st_nlink == 1:
+                        bot.debug("Removing unreferenced blob %s" % blob)
+                        os.remove(blob)
+                        removed.append("%s:%s" % (algorithm, filename))
+
+        now = time.time()
+        for filename in os.listdir(self.tmpdir):
+            tmp_file = os.path.join(self.tmpdir, filename)
+            if now - os.stat(tmp_file).st_mtime > max_age:
+                os.remove(tmp_file)
+        return removed
+
+    def _get_tmpfile(self, dirname=None):
+        """get a temporary file in the store (or dirname), on the same
+        filesystem as the final destination so that rename is atomic.
+        """
+        fd, tmp_file = tempfile.mkstemp(prefix=".blob.", dir=dirname or self.tmpdir)
+        os.close(fd)
+        return tmp_file
+
+    def _publish(self, filename, blob):
+        """atomically publish a file to the blob path. The file is linked (or
+        copied, if it is on another filesystem) into the store tmp folder,
+        and then linked to the blob path, which fails if another client
+        published the blob first (with the same content) and is ignored.
+        """
+        tmp_file = self._get_tmpfile()
+        os.remove(tmp_file)
+        try:
+            os.link(filename, tmp_file)
+        except OSError:
+            shutil.copyfile(filename, tmp_file)
+
+        try:
+            os.link(tmp_file, blob)
+        except FileExistsError:
+            bot.debug("Blob %s was published by another client" % blob)
+        except OSError:
+            os.replace(tmp_file, blob)
+        else:
+            bot.debug("Published blob %s" % blob)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+        return blob
+
+
+def parse_digest(digest):
+    """split a digest into the algorithm and hex digest. If an algorithm is
+    not included, sha256 is assumed.
+
+    Parameters
+    ==========
+    digest: the digest of the blob, e.g., sha256:<hexdigest>
+    """
+    algorithm = "sha256"
+    hexdigest = digest
+    if ":" in digest:
+        algorithm, hexdigest = digest.split(":", 1)
+
+    if not hexdigest or "/" in hexdigest or "/" in algorithm:
+        bot.exit("%s is not a valid digest." % digest)
+    return algorithm, hexdigest
+
+
+def get_hasher(digest):
+    """return a hashlib object to verify content against a digest, or None
+    if the digest is not provided or the algorithm is not supported.
+
+    Parameters
+    ==========
+    digest: the digest of the blob, e.g., sha256:<hexdigest>
+    """
+    if digest is None:
+        return None
+    algorithm, _ = parse_digest(digest)
+    if algorithm not in hashlib.algorithms_available:
+        bot.warning("Cannot verify %s, unsupported algorithm." % digest)
+        return None
+    return hashlib.new(algorithm)
+
+
+def verify_digest(digest, hasher):
+    """determine if content fed to a hasher (from get_hasher) matches the
+    digest that names it.
+    """
+    _, hexdigest = parse_digest(digest)
+    return hasher.hexdigest() == hexdigest
@@ -8,17 +8,25 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 """
 
-from sregistry.defaults import DISABLE_SSL_CHECK
+from sregistry.auth import get_token_cache, get_token_key
+from sregistry.defaults import DISABLE_SSL_CHECK, SREGISTRY_DOWNLOAD_RETRIES
 from sregistry.logger import bot
-
-from requests.exceptions import HTTPError
-import requests
+from sregistry.main.base.ranges import (
+    get_resume_headers,
+    lock_partial,
+    remove_partial,
+)
+from sregistry.main.base.http import write_stream
+from sregistry.main.base.session import get_session
+from sregistry.main.workers.blobs import BlobStore
+from sregistry.utils import get_partial_file
+
+from requests.exceptions import ChunkedEncodingError, ConnectionError, HTTPError
 
 import json
 import os
 import re
 import shutil
-import sys
 import tempfile
 
 
@@ -27,7 +35,7 @@ import tempfile
 ################################################################################
 
 
-def download_task(url, headers, destination, download_type="layer"):
+def download_task(url, headers, destination, download_type="layer", digest=None):
     """download an image layer (.tar.gz) to a specified download folder.
     This task is done by using local versions of the same download functions
     that are used for the client.
@@ -38,16 +46,41 @@ def download_task(url, headers, destination, download_type="layer"):
     image_id: the shasum id of the layer, already determined to not exist
     repo_name: the image name (library/ubuntu) to retrieve
     download_folder: download to this folder. If not set, uses temp.
+    digest: if provided, verify the content against this digest
 
 
     """
+    # A layer already in the cache (or linked from the blob store) is kept,
+    # if it matches the digest. Otherwise it is quarantined and downloaded
+    if os.path.exists(destination):
+        blobs = BlobStore()
+        if digest is None or blobs.verify(digest, destination):
+            return destination
+        blobs.quarantine(digest, destination)
+
     # Update the user what we are doing
     bot.verbose("Downloading %s from %s" % (download_type, url))
 
-    # Step 1: Download the layer atomically
-    file_name = "%s.%s" % (destination, next(tempfile._get_candidate_names()))
-
-    tar_download = download(url, file_name, headers=headers)
+    # Step 1: Download the layer atomically, retry if the digest doesn't match
+    # An interrupted download is resumed by the next attempt
+    for attempt in range(1, SREGISTRY_DOWNLOAD_RETRIES + 1):
+        file_name = "%s.%s" % (destination, next(tempfile._get_candidate_names()))
+        try:
+            tar_download = download(url, file_name, headers=headers, digest=digest)
+        except (ChunkedEncodingError, ConnectionError) as e:
+            bot.warning(
+                "Download of %s interrupted (attempt %s of %s): %s"
+                % (url, attempt, SREGISTRY_DOWNLOAD_RETRIES, e)
+            )
+            continue
+        if tar_download is not None:
+            break
+        bot.warning(
+            "Digest mismatch for %s (attempt %s of %s)"
+            % (url, attempt, SREGISTRY_DOWNLOAD_RETRIES)
+        )
+    else:
+        bot.exit("Cannot verify %s, was there a problem with download?" % url)
 
     try:
         shutil.move(tar_download, destination)
@@ -74,7 +107,11 @@ def post(url, headers=None, data=None, return_json=True):
     """post will use requests to get a particular url"""
     bot.debug("POST %s" % url)
     return call(
-        url, headers=headers, func=requests.post, data=data, return_json=return_json
+        url,
+        headers=headers,
+        func=get_session().post,
+        data=data,
+        return_json=return_json,
     )
 
 
@@ -82,45 +119,56 @@ def get(url, headers=None, token=None, data=None, return_json=True):
     """get will use requests to get a particular url"""
     bot.debug("GET %s" % url)
     return call(
-        url, headers=headers, func=requests.get, data=data, return_json=return_json
+        url, headers=headers, func=get_session().get, data=data, return_json=return_json
     )
 
 
-def download(url, file_name, headers=None, show_progress=True):
-    """stream to a temporary file, rename on successful completion
+def download(url, file_name, headers=None, show_progress=True, digest=None):
+    """stream to a partial file, rename on successful completion. If a
+    digest is provided and the content does not match, None is returned.
+    The partial file is named by the digest (or url) so that an interrupted
+    download is resumed by the next attempt with a Range request.
 
     Parameters
     ==========
     file_name: the file name to stream to
     url: the url to stream from
     headers: additional headers to add
+    digest: if provided, verify the content against this digest
     """
 
-    fd, tmp_file = tempfile.mkstemp(prefix=("%s.tmp." % file_name))
-    os.close(fd)
+    partial_file = get_partial_file(digest or url.split("?")[0])
 
     if DISABLE_SSL_CHECK is True:
         bot.warning("Verify of certificates disabled! ::TESTING USE ONLY::")
 
-    verify = not DISABLE_SSL_CHECK
-
-    # Does the url being requested exist?
-    if requests.head(url, verify=verify).status_code in [200, 401]:
-        response = stream(url, headers=headers, stream_to=tmp_file)
+    # Lock the partial file, another pull might be resuming the same download
+    with lock_partial(partial_file):
+        # The streaming GET tells us if the url exists, a HEAD is not needed
+        response = stream(
+            url, headers=headers, stream_to=partial_file, digest=digest, resume=True
+        )
 
         if isinstance(response, HTTPError):
             bot.exit("Error downloading %s, exiting." % url)
 
-        shutil.move(tmp_file, file_name)
-    else:
-        bot.error("Invalid url or permissions %s" % url)
+        # The content did not match the digest (and was quarantined)
+        if response is None:
+            remove_partial(partial_file)
+            return None
+
+        shutil.move(partial_file, file_name)
+        remove_partial(partial_file)
     return file_name
 
 
-def stream(url, headers, stream_to=None, retry=True):
+def stream(url, headers, stream_to=None, retry=True, digest=None, resume=False):
     """stream is a get that will stream to file_name. Since this is a worker
     task, it differs from the client provided version in that it requires
-    headers.
+    headers. If a digest is provided, chunks are hashed as they are written,
+    and a file that doesn't match is quarantined (and None returned). If
+    resume is True and stream_to is a partial download, the rest of it is
+    requested with a Range header.
     """
 
     bot.debug("GET %s" % url)
@@ -128,41 +176,35 @@ def stream(url, headers, stream_to=None, retry=True):
     if DISABLE_SSL_CHECK is True:
         bot.warning("Verify of certificates disabled! ::TESTING USE ONLY::")
 
+    request_headers = dict(headers or {})
+    if resume is True:
+        request_headers.update(get_resume_headers(stream_to, digest))
+
     # Ensure headers are present, update if not
-    response = requests.get(
-        url, headers=headers, verify=not DISABLE_SSL_CHECK, stream=True
+    response = get_session().get(
+        url, headers=request_headers, verify=not DISABLE_SSL_CHECK, stream=True
     )
 
     # Deal with token if necessary
     if response.status_code == 401 and retry is True:
         headers = update_token(response, headers)
-        return stream(url, headers, stream_to, retry=False)
-
-    if response.status_code == 200:
-        # Keep user updated with Progress Bar
-        content_size = None
-        if "Content-Length" in response.headers:
-            progress = 0
-            content_size = int(response.headers["Content-Length"])
-            bot.show_progress(progress, content_size, length=35)
-
-        chunk_size = 1 << 20
-        with open(stream_to, "wb") as filey:
-            for chunk in response.iter_content(chunk_size=chunk_size):
-                filey.write(chunk)
-                if content_size is not None:
-                    progress += chunk_size
-                    bot.show_progress(
-                        iteration=progress,
-                        total=content_size,
-                        length=35,
-                        carriage_return=False,
-                    )
-
-        # Newline to finish download
-        sys.stdout.write("\n")
-
-        return stream_to
+        return stream(
+            url, headers, stream_to, retry=False, digest=digest, resume=resume
+        )
+
+    # The partial download is no longer valid, start over
+    if response.status_code == 416 and "Range" in request_headers:
+        response.close()
+        remove_partial(stream_to)
+        return stream(
+            url, headers, stream_to, retry=retry, digest=digest, resume=resume
+        )
+
+    if response.status_code in [200, 206]:
+        return write_stream(response, stream_to, digest=digest, resume=resume)
+
+    if response.status_code in [401, 403, 404]:
+        bot.exit("Invalid url or permissions %s" % url)
 
     bot.exit("Problem with stream, response %s" % response.status_code)
 
@@ -260,10 +302,23 @@ def update_token(response, headers):
 
     token_url = realm + "?service=" + service + "&expires_in=900&scope=" + scope
 
-    response = get(token_url)
+    if headers is None:
+        headers = {}
+
+    # A basic credential is kept apart from tokens (as in the client)
+    auth = headers.get("Authorization", "")
+    if not auth.startswith("Basic"):
+        auth = ""
+
+    def fetch():
+        response = get(token_url, headers={"Authorization": auth} if auth else None)
+        return response["token"], response.get("expires_in")
 
+    # Workers share one token (fetched once) via the token cache
+    rejected = headers.get("Authorization", "").replace("Bearer ", "", 1)
     try:
-        token = response["token"]
+        key = get_token_key(token_url, auth)
+        token = get_token_cache().get(key, fetch, rejected=rejected)
         token = {"Authorization": "Bearer %s" % token}
         headers.update(token)
 
@@ -9,7 +9,8 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
 
 from sregistry.logger import bot
-from sregistry.defaults import SREGISTRY_WORKERS
+from sregistry.defaults import SREGISTRY_WORKERS, SREGISTRY_WORKERS_ENGINE
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import multiprocessing
 import itertools
 import time
@@ -18,11 +19,25 @@ import sys
 
 
 class Workers(object):
-    def __init__(self, workers=None):
+    """run a list of tasks through a function in parallel, with an engine
+    that is either a multiprocessing pool ("process") or a pool of threads
+    ("thread"). Threads start instantly and share the connection pool and
+    headers (token) of the calling process, so they are preferred for
+    network bound tasks like layer downloads.
+    """
+
+    engines = ["process", "thread"]
+
+    def __init__(self, workers=None, engine=None):
         if workers is None:
             workers = SREGISTRY_WORKERS
+        if engine is None:
+            engine = SREGISTRY_WORKERS_ENGINE
+        if engine not in self.engines:
+            bot.exit("Workers engine must be one of %s" % ", ".join(self.engines))
         self.workers = workers
-        bot.debug("Using %s workers for multiprocess." % (self.workers))
+        self.engine = engine
+        bot.debug("Using %s %s workers." % (self.workers, self.engine))
 
     def start(self):
         bot.debug("Starting multiprocess")
@@ -52,6 +67,9 @@ class Workers(object):
         if len(tasks) == 0:
             return
 
+        if self.engine == "thread":
+            return self._run_threads(func, tasks, func2)
+
         # If two functions are run per task, double total jobs
         if func2 is not None:
             total = total * 2
@@ -101,6 +119,129 @@ class Workers(object):
 
         return finished
 
+    def _run_threads(self, func, tasks, func2=None):
+        """run tasks with a pool of threads. Progress is updated as each
+        task finishes (in any order), and a result is passed through
+        func2 as soon as it is ready.
+        """
+        total = len(tasks)
+        if func2 is not None:
+            total = total * 2
+
+        progress = 0
+        finished = []
+        bot.show_progress(progress, total, length=35, prefix="[0/%s]" % total)
+
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+        futures = set()
+        try:
+            self.start()
+            level1 = set(pool.submit(func, *task) for task in tasks)
+            futures.update(level1)
+
+            while futures:
+                for future in as_completed(list(futures)):
+                    futures.remove(future)
+                    progress += 1
+                    prefix = "[%s/%s]" % (progress, total)
+                    bot.show_progress(progress, total, length=35, prefix=prefix)
+
+                    # Pass the result through a second function?
+                    if func2 is not None and future in level1:
+                        futures.add(pool.submit(func2, future.result()))
+                        break
+                    finished.append(future.result())
+
+            self.end()
+            pool.shutdown()
+
+        except (KeyboardInterrupt, SystemExit):
+            bot.error("Keyboard interrupt or error, terminating workers!")
+            for future in futures:
+                future.cancel()
+            pool.shutdown(wait=False)
+            sys.exit(1)
+
+        # A task that fails stops the tasks that haven't started
+        except Exception as e:  # pylint: disable=broad-except
+            bot.error(e)
+            for future in futures:
+                future.cancel()
+            pool.shutdown(wait=False)
+
+        return finished
+
+    def run_ordered(self, func, tasks, apply):
+        """run a list of tasks through a function in parallel (like run), and
+        pass each result through apply in the order of the tasks, as soon as
+        it (and the results before it) are ready. apply is run in the calling
+        process, so work on one result (e.g., extracting a layer) overlaps
+        with the tasks that are still running (e.g., downloading the next
+        layers). Results of apply are returned in the order of the tasks. A
+        task (or apply) that fails stops the rest, and exits, so a partial
+        result is never used.
+        :param func: the function to run for each task
+        :param tasks: a list of tasks, each a tuple
+                      of arguments to process
+        :param apply: function to pass each result of func through, in order
+        """
+        if len(tasks) == 0:
+            return []
+
+        total = len(tasks)
+        finished = []
+        bot.show_progress(0, total, length=35, prefix="[0/%s]" % total)
+
+        if self.engine == "thread":
+            pool = ThreadPoolExecutor(max_workers=self.workers)
+        else:
+            pool = multiprocessing.Pool(self.workers, init_worker)
+
+        futures = []
+        try:
+            self.start()
+            if self.engine == "thread":
+                futures = [pool.submit(func, *task) for task in tasks]
+                results = [future.result for future in futures]
+            else:
+                results = [
+                    pool.apply_async(multi_wrapper, multi_package(func, [task]))
+                    for task in tasks
+                ]
+                results = [result.get for result in results]
+
+            for progress, result in enumerate(results, start=1):
+                finished.append(apply(result()))
+                prefix = "[%s/%s]" % (progress, total)
+                bot.show_progress(progress, total, length=35, prefix=prefix)
+
+            self.end()
+            if self.engine == "thread":
+                pool.shutdown()
+            else:
+                pool.close()
+                pool.join()
+
+        except (KeyboardInterrupt, SystemExit):
+            bot.error("Keyboard interrupt or error, terminating workers!")
+            if self.engine == "thread":
+                pool.shutdown(wait=False)
+            else:
+                pool.terminate()
+            sys.exit(1)
+
+        # A task (or apply) that fails stops the tasks that haven't finished
+        except Exception as e:  # pylint: disable=broad-except
+            if self.engine == "thread":
+                for future in futures:
+                    future.cancel()
+                pool.shutdown(wait=False)
+            else:
+                pool.terminate()
+            bot.exit(e)
+
+        return finished
+
 
 # Supporting functions for MultiProcess Worker
 def init_worker():
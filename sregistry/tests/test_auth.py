@@ -0,0 +1,150 @@
+#!/usr/bin/python
+
+# Copyright (C) 2017-2021 Vanessa Sochat.
+
+# This Source Code Form is subject to the terms of the
+# Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import threading
+import time
+import pytest
+
+
+class Fetch:
+    """a token endpoint that counts requests, and is slow to answer"""
+
+    def __init__(self, expires_in=300, seconds=0.1):
+        self.expires_in = expires_in
+        self.seconds = seconds
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            self.count += 1
+            count = self.count
+        time.sleep(self.seconds)
+        return "token%s" % count, self.expires_in
+
+
+class Clock:
+    """a stand in for the time module, that only moves when told to"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_token_cache_single_flight(tmp_path, shared):
+    print("Testing auth.TokenCache.get by many workers at once")
+    from sregistry.auth import TokenCache
+
+    # Each cache is a process, sharing the file, with threads sharing each
+    filename = str(tmp_path / "tokens.json") if shared else None
+    caches = [TokenCache(filename) for _ in range(2 if shared else 1)]
+    fetch = Fetch()
+    tokens = []
+
+    def get(cache):
+        tokens.append(cache.get("https://auth/token", fetch))
+
+    threads = [
+        threading.Thread(target=get, args=(caches[index % len(caches)],))
+        for index in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert fetch.count == 1
+    assert tokens == ["token1"] * 8
+
+
+def test_token_cache_expiry(tmp_path, monkeypatch):
+    print("Testing auth.TokenCache.get of a token that expires")
+    import sregistry.auth.tokens
+    from sregistry.auth import TokenCache
+
+    clock = Clock()
+    monkeypatch.setattr(sregistry.auth.tokens, "time", clock)
+    cache = TokenCache(str(tmp_path / "tokens.json"), margin=60)
+    fetch = Fetch(expires_in=300, seconds=0)
+
+    assert cache.get("https://auth/token", fetch) == "token1"
+    clock.now += 200
+    assert cache.get("https://auth/token", fetch) == "token1"
+
+    # A token that expires within the margin is fetched again
+    clock.now += 50
+    assert cache.get("https://auth/token", fetch) == "token2"
+    assert fetch.count == 2
+
+    # Another process finds the token in the file, until it expires
+    other = TokenCache(cache.filename, margin=60)
+    assert other.get("https://auth/token", fetch) == "token2"
+    clock.now += 300
+    assert other.get("https://auth/token", fetch) == "token3"
+
+    # A token that the registry rejected isn't returned again
+    assert other.get("https://auth/token", fetch, rejected="token3") == "token4"
+    assert fetch.count == 4
+
+
+def test_token_cache_disabled(tmp_path, monkeypatch):
+    print("Testing auth.get_token_cache without a credential cache")
+    import os
+    import sregistry.auth.tokens as tokens
+    import sregistry.defaults
+
+    monkeypatch.setattr(sregistry.defaults, "CREDENTIAL_CACHE", None)
+    monkeypatch.setattr(sregistry.defaults, "SREGISTRY_TMPDIR", str(tmp_path))
+    monkeypatch.setattr(tokens, "_cache", None)
+
+    # Tokens are kept in memory, and nothing is written to disk
+    cache = tokens.get_token_cache()
+    assert cache.filename is None
+    assert cache.get("https://auth/token", Fetch(seconds=0)) == "token1"
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_worker_token_key(monkeypatch):
+    print("Testing workers.tasks.update_token with the key of the client")
+    import sregistry.main.workers.tasks as tasks
+    from sregistry.auth import TokenCache, get_token_key
+
+    class Response:
+        status_code = 401
+        headers = {
+            "Www-Authenticate": 'Bearer realm="https://auth/token",'
+            'service="registry",scope="repository:library/ubuntu:pull"'
+        }
+
+    cache = TokenCache()
+    requested = []
+
+    def get(url, headers=None):
+        requested.append(headers)
+        return {"token": "worker", "expires_in": 300}
+
+    monkeypatch.setattr(tasks, "get_token_cache", lambda: cache)
+    monkeypatch.setattr(tasks, "get", get)
+    token_url = (
+        "https://auth/token?service=registry&expires_in=900"
+        "&scope=repository:library/ubuntu:pull"
+    )
+
+    # A worker finds the token that the client cached (anonymously)
+    cache.get(get_token_key(token_url), lambda: ("client", 300))
+    headers = tasks.update_token(Response(), {"Authorization": "Bearer old"})
+    assert headers["Authorization"] == "Bearer client"
+
+    # A worker with a credential gets its own token, with the credential
+    headers = tasks.update_token(Response(), {"Authorization": "Basic abc"})
+    assert headers["Authorization"] == "Bearer worker"
+    assert requested == [{"Authorization": "Basic abc"}]
+    assert cache.get(get_token_key(token_url), None) == "client"
@@ -0,0 +1,130 @@
+#!/usr/bin/python
+
+# Copyright (C) 2017-2021 Vanessa Sochat.
+
+# This Source Code Form is subject to the terms of the
+# Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import hashlib
+import os
+import threading
+import pytest
+
+
+def write_layer(path, content):
+    with open(str(path), "wb") as filey:
+        filey.write(content)
+    return str(path)
+
+
+def get_digest(content):
+    return "sha256:%s" % hashlib.sha256(content).hexdigest()
+
+
+@pytest.fixture
+def blobs(tmp_path):
+    from sregistry.main.workers import BlobStore
+
+    return BlobStore(str(tmp_path / "blobs"))
+
+
+def test_blobs_add(tmp_path, blobs):
+    print("Testing workers.BlobStore.add")
+    content = os.urandom(1000)
+    digest = get_digest(content)
+    layer = write_layer(tmp_path / "layer.tar.gz", content)
+
+    assert not blobs.exists(digest)
+    assert blobs.refcount(digest) is None
+    blobs.add(digest, layer)
+
+    # The file is now a reference to the blob, under its digest
+    blob = blobs.path(digest)
+    assert blob.endswith(os.path.join("sha256", digest[7:9], digest[7:]))
+    assert os.path.samefile(blob, layer)
+    assert blobs.refcount(digest) == 1
+    assert os.listdir(blobs.tmpdir) == []
+
+    # A second download of the same layer is replaced by a reference
+    other = write_layer(tmp_path / "other.tar.gz", content)
+    blobs.add(digest, other)
+    assert os.path.samefile(blob, other)
+    assert blobs.refcount(digest) == 2
+
+
+def test_blobs_add_concurrent(tmp_path, blobs):
+    print("Testing workers.BlobStore.add of one blob by many pulls at once")
+    content = os.urandom(1000)
+    digest = get_digest(content)
+    layers = [write_layer(tmp_path / ("layer%s.tar.gz" % i), content) for i in range(8)]
+    threads = [
+        threading.Thread(target=blobs.add, args=(digest, layer)) for layer in layers
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # One blob is published, and every layer references it
+    assert all(os.path.samefile(blobs.path(digest), layer) for layer in layers)
+    assert blobs.refcount(digest) == len(layers)
+    assert os.listdir(blobs.tmpdir) == []
+
+
+def test_blobs_link(tmp_path, blobs):
+    print("Testing workers.BlobStore.link and refcount")
+    content = os.urandom(1000)
+    digest = get_digest(content)
+    blobs.add(digest, write_layer(tmp_path / "layer.tar.gz", content))
+
+    cache = tmp_path / "cache"
+    cache.mkdir()
+    links = [str(cache / ("layer%s.tar.gz" % i)) for i in range(3)]
+    for link in links:
+        blobs.link(digest, link)
+    assert blobs.refcount(digest) == 4
+
+    # Linking an existing reference doesn't add another
+    blobs.link(digest, links[0])
+    assert blobs.refcount(digest) == 4
+    os.remove(links[0])
+    assert blobs.refcount(digest) == 3
+    with open(links[1], "rb") as filey:
+        assert filey.read() == content
+
+
+def test_blobs_prune(tmp_path, blobs):
+    print("Testing workers.BlobStore.prune")
+    kept = os.urandom(1000)
+    removed = os.urandom(1000)
+    blobs.add(get_digest(kept), write_layer(tmp_path / "kept.tar.gz", kept))
+    blobs.add(get_digest(removed), write_layer(tmp_path / "removed.tar.gz", removed))
+    os.remove(str(tmp_path / "removed.tar.gz"))
+
+    # An old temporary file is removed, a recent one is kept
+    old_tmp = blobs._get_tmpfile()
+    os.utime(old_tmp, (0, 0))
+    new_tmp = blobs._get_tmpfile()
+
+    # A quarantined file isn't a blob, and is kept
+    corrupt = write_layer(tmp_path / "corrupt.tar.gz", kept[:500])
+    quarantined = blobs.quarantine(get_digest(kept), corrupt)
+
+    assert blobs.prune() == [get_digest(removed)]
+    assert blobs.exists(get_digest(kept))
+    assert not blobs.exists(get_digest(removed))
+    assert not os.path.exists(old_tmp)
+    assert os.path.exists(new_tmp)
+    assert os.path.exists(quarantined)
+
+
+def test_blobs_verify(tmp_path, blobs):
+    print("Testing workers.BlobStore.verify")
+    content = os.urandom(1000)
+    digest = get_digest(content)
+    layer = write_layer(tmp_path / "layer.tar.gz", content)
+    assert blobs.verify(digest, layer)
+
+    corrupt = write_layer(tmp_path / "corrupt.tar.gz", content[:500])
+    assert not blobs.verify(digest, corrupt)
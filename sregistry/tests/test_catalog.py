@@ -0,0 +1,104 @@
+#!/usr/bin/python
+
+# Copyright (C) 2017-2021 Vanessa Sochat.
+
+# This Source Code Form is subject to the terms of the
+# Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+
+def test_catalog():
+    print("Testing base.catalog.Catalog, with writers at once")
+    from concurrent.futures import ThreadPoolExecutor
+    from sregistry.main.base.catalog import Catalog
+
+    class Storage:
+        """storage in memory, where a catalog object is only created once"""
+
+        client_name = "storage"
+
+        def __init__(self):
+            self.objects = {}
+            self.walks = 0
+
+        def _list_catalog(self, prefix):
+            return [name for name in list(self.objects) if name.startswith(prefix)]
+
+        def _read_catalog(self, name):
+            return self.objects.get(name)
+
+        def _create_catalog(self, name, content):
+            return self.objects.setdefault(name, content) is content
+
+        def _delete_catalog(self, name):
+            self.objects.pop(name, None)
+
+        def _list_images(self):
+            self.walks += 1
+            return [{"path": "vanessa/pancakes.sif", "size": 1}]
+
+    storage = Storage()
+    catalog = Catalog(storage)
+    assert catalog.images() is None
+
+    # The first catalog starts with a walk of storage
+    assert catalog.update(add=[{"path": "vanessa/tacos.sif", "size": 2}]) == 1
+    assert [image["path"] for image in catalog.images()] == [
+        "vanessa/pancakes.sif",
+        "vanessa/tacos.sif",
+    ]
+
+    # Writers at once each write a version, and none of the images are lost
+    paths = ["dino/%s.sif" % i for i in range(8)]
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        for path in paths:
+            pool.submit(Catalog(storage).update, add=[{"path": path, "size": 3}])
+
+    images = [image["path"] for image in Catalog(storage).images()]
+    assert len(images) == 10 and set(paths) <= set(images)
+    assert storage.walks == 1
+
+    # Removing an image, and older versions are pruned
+    assert catalog.update(remove=["vanessa/tacos.sif"]) == 10
+    assert "vanessa/tacos.sif" not in [image["path"] for image in catalog.images()]
+    assert len(storage.objects) <= 3
+
+    # Versions that can't be read are replaced by a newer version
+    for version in [11, 12]:
+        storage.objects[catalog.get_name(version)] = None
+    assert catalog.update(add=[{"path": "vanessa/waffles.sif", "size": 4}]) == 13
+    assert storage.walks == 2
+
+
+def test_get_images(monkeypatch):
+    print("Testing base.catalog.get_images, from the catalog or a walk")
+    import json
+    import sregistry.main.base.catalog as catalog
+
+    class Storage:
+        """storage with one version of the catalog"""
+
+        client_name = "storage"
+        objects = {}
+
+        def _list_catalog(self, prefix):
+            return list(self.objects)
+
+        def _read_catalog(self, name):
+            return self.objects.get(name)
+
+    def walk():
+        return [{"path": "vanessa/pancakes.sif"}]
+
+    # Without a catalog (or with it disabled) the storage is walked
+    storage = Storage()
+    monkeypatch.setattr(catalog, "SREGISTRY_CATALOG", True)
+    assert catalog.get_images(storage, walk) == walk()
+
+    name = catalog.Catalog(storage).get_name(1)
+    images = [{"path": "vanessa/tacos.sif"}]
+    storage.objects[name] = json.dumps({"version": 1, "images": images})
+    assert catalog.get_images(storage, walk) == images
+
+    monkeypatch.setattr(catalog, "SREGISTRY_CATALOG", False)
+    assert catalog.get_images(storage, walk) == walk()
@@ -0,0 +1,254 @@
+#!/usr/bin/python
+
+# Copyright (C) 2017-2021 Vanessa Sochat.
+
+# This Source Code Form is subject to the terms of the
+# Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import os
+import threading
+import pytest
+
+
+class Response:
+    """a response of the fake registry, with a json body"""
+
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.content = json.dumps(body).encode("utf-8")
+        self.headers = {}
+        self.reason = "Reason"
+
+    def json(self):
+        return json.loads(self.content.decode("utf-8"))
+
+    def close(self):
+        pass
+
+
+class Registry:
+    """a fake session (get only) for the manifests of one image. The image
+    config is only returned for the token that the client updates to.
+    """
+
+    def __init__(self):
+        self.config = {"config": {"Entrypoint": ["/bin/sh"]}}
+        self.manifest = {
+            "schemaVersion": 2,
+            "config": {
+                "mediaType": "application/vnd.docker.container.image.v1+json",
+                "digest": "sha256:config",
+            },
+            "layers": [],
+        }
+
+    def get(self, url, headers=None, verify=True, data=None, stream=False):
+        if url.endswith("/blobs/sha256:config"):
+            if headers.get("Authorization") != "Bearer new":
+                return Response(401)
+            return Response(200, self.config)
+        return Response(200, self.manifest)
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """serve the manifests of an image from a fake registry, not cached"""
+    import sregistry.main.base.manifests as manifests
+    import sregistry.main.base.session as session
+
+    fake = Registry()
+    monkeypatch.setattr(manifests, "_cache", manifests.ManifestCache())
+    monkeypatch.setattr(session, "_session", fake)
+    monkeypatch.setattr(session, "_session_pid", os.getpid())
+    return fake
+
+
+def test_docker_pull_registries():
+    print("Testing docker.pull of a batch of images from two registries")
+    from sregistry.main.docker import Client
+
+    client = Client()
+    batches = []
+    client._download_images = lambda names: batches.append(
+        (client.base, [name["uri"] for name in names])
+    )
+    client._pull = lambda names, **kwargs: (client.base, names["uri"])
+    client._remove_batch = lambda: None
+
+    # Each image is pulled from its registry, and returned in order
+    images = ["ubuntu", "gcr.io/x/y", "busybox", "gcr.io/x/z"]
+    assert client.pull(images) == [
+        ("https://index.docker.io/v2", "library/ubuntu:latest"),
+        ("https://gcr.io/v2", "x/y:latest"),
+        ("https://index.docker.io/v2", "library/busybox:latest"),
+        ("https://gcr.io/v2", "x/z:latest"),
+    ]
+    assert batches == [
+        (
+            "https://index.docker.io/v2",
+            ["library/ubuntu:latest", "library/busybox:latest"],
+        ),
+        ("https://gcr.io/v2", ["x/y:latest", "x/z:latest"]),
+    ]
+
+
+def test_docker_config_token(registry):
+    print("Testing docker.get_manifests with a token that expires")
+    from sregistry.main.docker import Client
+
+    client = Client()
+    client.base = "http://registry/v2"
+    updates = []
+
+    def update_token(response=None):
+        if response is not None:
+            updates.append(threading.current_thread())
+            client.headers["Authorization"] = "Bearer new"
+
+    client._update_token = update_token
+    client.headers["Authorization"] = "Bearer old"
+
+    # The config requested in the background doesn't update the token
+    client._get_manifests("library/ubuntu", "latest")
+    client._config_request[0].result()
+    assert updates == []
+    assert client.headers["Authorization"] == "Bearer old"
+
+    # It is requested again with a new token, in the calling thread
+    assert client._wait_manifests()["config"] == registry.config
+    assert updates == [threading.current_thread()]
+
+
+def test_docker_batch_tokens(registry, monkeypatch):
+    print("Testing docker.download_images with a token for each repository")
+    import sregistry.main.docker.api as api
+    from sregistry.main.docker import Client
+    from sregistry.utils import parse_image_name
+
+    client = Client()
+    client.base = "http://registry/v2"
+    client._token_url = (
+        "https://batch/token?service=registry&expires_in=900"
+        "&scope=repository:library/debian:pull"
+    )
+    client.headers["Authorization"] = "Bearer library/debian"
+
+    # Tokens are named for their scope, the manifests are from the registry
+    get_manifest = client._get
+
+    def get(url, headers=None, **kwargs):
+        if not url.startswith("https://batch/token"):
+            return get_manifest(url, headers=headers, **kwargs)
+        return {"token": url.split("scope=repository:")[1], "expires_in": 300}
+
+    client._get = get
+    registry.manifest["layers"] = [{"digest": "sha256:layer"}]
+    monkeypatch.setattr(
+        api,
+        "download_batch",
+        lambda self, names, get_layers, func: [get_layers(name) for name in names],
+    )
+
+    # Each image hands its layers to the workers with a token of its own
+    # repository, and the config isn't requested until the image is pulled
+    names = [parse_image_name(name) for name in ["ubuntu", "busybox"]]
+    ubuntu, busybox = client._download_images(names)
+    assert ubuntu[0][2]["Authorization"] == "Bearer library/ubuntu:pull"
+    assert busybox[0][2]["Authorization"] == "Bearer library/busybox:pull"
+    assert getattr(client, "_config_request", None) is None
+
+
+@pytest.fixture
+def database_client(tmp_path):
+    """a docker client with a database, that builds an image (with random
+    content) from the manifests of any name, each with the same config
+    """
+    pytest.importorskip("sqlalchemy")
+    from sregistry.database.models import init_db
+    from sregistry.main.docker import Client
+    import sregistry.database as database
+
+    class DatabaseClient(Client):
+        client_name = "docker"
+        quiet = True
+
+    for name in [
+        "add",
+        "get_container",
+        "get_container_by_digest",
+        "get_image_hash",
+        "add_image_hash",
+        "get_collection",
+        "get_or_create_collection",
+    ]:
+        setattr(DatabaseClient, name, getattr(database, name))
+
+    client = DatabaseClient()
+    init_db(client, str(tmp_path / "sregistry.db"))
+    client.storage = str(tmp_path / "storage")
+    client.builds = []
+
+    def get_manifests(repo_name, digest=None):
+        config = {"digest": "sha256:config", "mediaType": "config"}
+        client.manifests = {"v2": {"schemaVersion": 2, "config": config}}
+        return client.manifests
+
+    def build_image(file_name, names, uri="docker://", **kwargs):
+        client.builds.append(names["uri"])
+        with open(file_name, "wb") as filey:
+            filey.write(os.urandom(1000))
+        return file_name, None
+
+    client._get_manifests = get_manifests
+    client._build_image = build_image
+    return client
+
+
+def test_docker_pull_unchanged(database_client):
+    print("Testing docker.pull of an image built from the same content")
+    from concurrent.futures import Future
+    import json
+
+    client = database_client
+    inspected = []
+
+    def get_metadata(image_file, names=None):
+        inspected.append(image_file)
+        return dict(names, label="inspected")
+
+    client.get_metadata = get_metadata
+    first = client.pull("ubuntu:latest")
+    assert len(inspected) == 1
+
+    # The image is linked, without downloading layers, building or
+    # inspecting it, and the config requested in the background is waited for
+    config = Future()
+    config.set_result({"architecture": "amd64"})
+    get_manifests = client._get_manifests
+
+    def get_manifests_config(repo_name, digest=None):
+        client._config_request = (config, "config", "accept")
+        return get_manifests(repo_name, digest)
+
+    client._get_manifests = get_manifests_config
+    second = client.pull("ubuntu:22.04")
+    assert client.builds == ["library/ubuntu:latest"]
+    assert second != first and os.path.samefile(first, second)
+    assert client.manifests["config"] == {"architecture": "amd64"}
+    assert client._config_request is None
+    assert len(inspected) == 1
+    container = client.get_container_by_digest("sha256:config")
+    assert container.image == second
+    metrics = json.loads(container.metrics)
+    assert metrics["label"] == "inspected"
+    assert metrics["uri"] == "library/ubuntu:22.04"
+
+    # An image that no longer exists isn't reused, the pull builds it
+    os.remove(first)
+    os.remove(second)
+    third = client.pull("ubuntu:jammy")
+    assert client.builds == ["library/ubuntu:latest", "library/ubuntu:jammy"]
+    assert os.path.exists(third)
+    assert client.get_container_by_digest("sha256:config").image == third
@@ -0,0 +1,403 @@
+#!/usr/bin/python
+
+# Copyright (C) 2017-2021 Vanessa Sochat.
+
+# This Source Code Form is subject to the terms of the
+# Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import hashlib
+import importlib
+import os
+import re
+import threading
+import pytest
+
+from requests.exceptions import ConnectionError
+
+
+class Response:
+    """a streamed response of the fake registry, that can close early"""
+
+    def __init__(self, status_code, body=b"", headers=None, drop=None, url=""):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+        self.drop = drop
+        self.url = url
+
+    def iter_content(self, chunk_size=1):
+        body = self.body if self.drop is None else self.body[: self.drop]
+        for start in range(0, len(body), chunk_size):
+            yield body[start : start + chunk_size]
+
+    def close(self):
+        pass
+
+
+class Registry:
+    """a fake session that serves one file with an ETag (at any url but
+    /missing), and honors Range and If-Range. drops maps the start of a
+    range (0 for a full response) to the bytes to send before the first
+    such response closes early. HEAD requests are counted, not answered.
+    """
+
+    def __init__(self, content, drops=None):
+        self.content = content
+        self.etag = '"%s"' % hashlib.md5(content).hexdigest()
+        self.drops = dict(drops or {})
+        self.requests = []
+        self.heads = 0
+        self.lock = threading.Lock()
+
+    def head(self, url, **kwargs):
+        self.heads += 1
+        raise AssertionError("HEAD %s" % url)
+
+    def get(self, url, headers=None, verify=True, stream=False):
+        headers = dict(headers or {})
+        with self.lock:
+            self.requests.append(headers)
+        if url.endswith("/missing"):
+            return Response(404, url=url)
+        size = len(self.content)
+        match = re.match(r"bytes=(\d+)-(\d*)", headers.get("Range", ""))
+        if_range = headers.get("If-Range")
+
+        if match is None or (if_range is not None and if_range != self.etag):
+            return Response(
+                200,
+                self.content,
+                {"ETag": self.etag, "Content-Length": str(size)},
+                drop=self.drops.pop(0, None),
+                url=url,
+            )
+
+        start = int(match.group(1))
+        end = min(int(match.group(2) or size - 1), size - 1)
+        if start >= size:
+            return Response(416, url=url)
+        body = self.content[start : end + 1]
+        with self.lock:
+            drop = self.drops.pop(start, None)
+        return Response(
+            206,
+            body,
+            {
+                "ETag": self.etag,
+                "Content-Length": str(len(body)),
+                "Content-Range": "bytes %s-%s/%s" % (start, end, size),
+            },
+            drop=drop,
+            url=url,
+        )
+
+    def starts(self):
+        return [
+            int(re.match(r"bytes=(\d+)", headers["Range"]).group(1))
+            for headers in self.requests
+            if "Range" in headers
+        ]
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    """serve content from a fake registry, with partial files in tmp_path"""
+    import sregistry.defaults
+    import sregistry.main.base.session as session
+
+    monkeypatch.setattr(sregistry.defaults, "SREGISTRY_TMPDIR", str(tmp_path))
+
+    def serve(content, drops=None):
+        fake = Registry(content, drops)
+        monkeypatch.setattr(session, "_session", fake)
+        monkeypatch.setattr(session, "_session_pid", os.getpid())
+        return fake
+
+    return serve
+
+
+def get_digest(content):
+    return "sha256:%s" % hashlib.sha256(content).hexdigest()
+
+
+def test_download_resume(tmp_path, registry, monkeypatch):
+    print("Testing base.http.download resumed with a Range request")
+    import sregistry.defaults
+    from sregistry.main.base import ApiConnection
+    from sregistry.utils import get_partial_file
+
+    monkeypatch.setattr(sregistry.defaults, "SREGISTRY_DOWNLOAD_SEGMENTS", 1)
+    content = os.urandom(5000)
+    digest = get_digest(content)
+    fake = registry(content, drops={0: 1200})
+
+    file_name = str(tmp_path / "layer.tar.gz")
+    ApiConnection().download("http://registry/blob", file_name, digest=digest)
+    with open(file_name, "rb") as filey:
+        assert filey.read() == content
+
+    # The second request continues from the bytes that were written
+    assert fake.requests[1]["Range"] == "bytes=1200-"
+    assert fake.requests[1]["If-Range"] == fake.etag
+
+    # The partial download is gone, and so is its lock
+    partial_file = get_partial_file(digest)
+    assert not os.path.exists("%s.lock" % partial_file)
+    assert not os.path.exists(partial_file)
+
+
+@pytest.mark.parametrize("module", ["tasks", "aws"])
+def test_download_worker_resume(tmp_path, registry, module):
+    print("Testing workers.%s.download resumed and verified" % module)
+    from sregistry.main.workers.blobs import BlobStore
+
+    download = importlib.import_module("sregistry.main.workers.%s" % module).download
+    content = os.urandom(5000)
+    digest = get_digest(content)
+    fake = registry(content, drops={0: 1200})
+
+    # The first attempt is interrupted, the second continues from its bytes
+    file_name = str(tmp_path / "layer.tar.gz")
+    with pytest.raises(ConnectionError):
+        download("http://registry/blob", file_name, {}, digest=digest)
+    assert download("http://registry/blob", file_name, {}, digest=digest)
+    with open(file_name, "rb") as filey:
+        assert filey.read() == content
+    assert fake.requests[1]["Range"] == "bytes=1200-"
+
+    # Content that doesn't match its digest is quarantined
+    wrong = get_digest(b"pancakes")
+    assert download("http://registry/blob", file_name, {}, digest=wrong) is None
+    assert os.listdir(BlobStore().quarantine_dir)[0].startswith(wrong[7:])
+
+
+def test_download_one_request(tmp_path, registry, monkeypatch):
+    print("Testing base.http.download and workers.tasks.download without HEAD")
+    import sregistry.defaults
+    from sregistry.main.base import ApiConnection
+    from sregistry.main.workers.tasks import download
+
+    monkeypatch.setattr(sregistry.defaults, "SREGISTRY_DOWNLOAD_SEGMENTS", 1)
+    content = os.urandom(5000)
+    fake = registry(content)
+
+    # Each download is one GET, which tells us if the url exists
+    file_name = str(tmp_path / "image.sif")
+    ApiConnection().download("http://registry/image", file_name)
+    layer = download("http://registry/layer", str(tmp_path / "layer.tar.gz"), {})
+    for path in [file_name, layer]:
+        with open(path, "rb") as filey:
+            assert filey.read() == content
+    assert len(fake.requests) == 2 and fake.heads == 0
+
+    # A missing url is one GET too, and nothing is written
+    missing = str(tmp_path / "missing.sif")
+    ApiConnection().download("http://registry/missing", missing)
+    assert not os.path.exists(missing)
+    assert len(fake.requests) == 3 and fake.heads == 0
+
+
+def test_download_range_not_satisfiable(tmp_path, registry):
+    print("Testing workers.tasks.download_task with a partial file that is too large")
+    from sregistry.main.workers.tasks import download_task
+    from sregistry.utils import get_partial_file, write_json
+
+    content = os.urandom(5000)
+    digest = get_digest(content)
+    fake = registry(content, drops={0: 2000})
+
+    # A partial file larger than the content is answered with 416
+    partial_file = get_partial_file(digest)
+    with open(partial_file, "wb") as filey:
+        filey.write(os.urandom(6000))
+    write_json({"etag": fake.etag}, "%s.json" % partial_file)
+
+    destination = str(tmp_path / "layer.tar.gz")
+    download_task("http://registry/blob", {}, destination, digest=digest)
+    with open(destination, "rb") as filey:
+        assert filey.read() == content
+
+    # The download starts over, and is still resumed (with If-Range)
+    assert fake.requests[0]["Range"] == "bytes=6000-"
+    assert "Range" not in fake.requests[1]
+    assert fake.requests[2]["Range"] == "bytes=2000-"
+    assert fake.requests[2]["If-Range"] == fake.etag
+
+
+def test_download_segments(tmp_path, registry, monkeypatch):
+    print("Testing base.http.download in segments, resuming the missing ones")
+    import sregistry.defaults
+    from sregistry.main.base import ApiConnection
+
+    monkeypatch.setattr(sregistry.defaults, "SREGISTRY_DOWNLOAD_SEGMENTS", 4)
+    monkeypatch.setattr(sregistry.defaults, "SREGISTRY_DOWNLOAD_SEGMENT_SIZE", 1000)
+    content = os.urandom(10500)
+    digest = get_digest(content)
+    fake = registry(content, drops={5000: 300})
+
+    file_name = str(tmp_path / "image.sif")
+    ApiConnection().download("http://registry/image", file_name, digest=digest)
+    with open(file_name, "rb") as filey:
+        assert filey.read() == content
+
+    # Each segment is written once, the one that closed early twice
+    starts = fake.starts()
+    assert starts.count(0) == 1 and starts.count(5000) == 2
+    assert sorted(set(starts)) == list(range(0, 10500, 1000))
+    assert all(
+        headers.get("If-Range") == fake.etag
+        for headers in fake.requests
+        if headers.get("Range", "").startswith("bytes=5000")
+    )
+
+
+def test_download_segments_unchecked(tmp_path, registry, monkeypatch):
+    print("Testing base.http.download without a validator or digest")
+    import sregistry.defaults
+    from sregistry.main.base import ApiConnection
+
+    monkeypatch.setattr(sregistry.defaults, "SREGISTRY_DOWNLOAD_SEGMENTS", 4)
+    monkeypatch.setattr(sregistry.defaults, "SREGISTRY_DOWNLOAD_SEGMENT_SIZE", 1000)
+    content = os.urandom(10500)
+    fake = registry(content)
+    fake.etag = None
+
+    # Segments couldn't be checked, so the file is downloaded in one stream
+    file_name = str(tmp_path / "image.sif")
+    ApiConnection().download("http://registry/image", file_name)
+    with open(file_name, "rb") as filey:
+        assert filey.read() == content
+    assert fake.starts() == [0]
+    assert "Range" not in fake.requests[-1]
+
+
+def test_download_segments_changed(tmp_path, registry, monkeypatch):
+    print("Testing base.http.download in segments, of a file that changes")
+    import time
+    import sregistry.defaults
+    from sregistry.main.base import ApiConnection
+
+    monkeypatch.setattr(sregistry.defaults, "SREGISTRY_DOWNLOAD_SEGMENTS", 4)
+    monkeypatch.setattr(sregistry.defaults, "SREGISTRY_DOWNLOAD_SEGMENT_SIZE", 1000)
+    content = os.urandom(10500)
+    fake = registry(os.urandom(10500))
+    get = fake.get
+
+    # The file changes while two segments are slow to write
+    def change(url, headers=None, verify=True, stream=False):
+        if len(fake.requests) == 3 and fake.content != content:
+            fake.content = content
+            fake.etag = '"%s"' % hashlib.md5(content).hexdigest()
+        response = get(url, headers, verify, stream)
+        if response.status_code == 206 and len(fake.requests) in [2, 3]:
+            iter_content = response.iter_content
+
+            def slow(chunk_size=1):
+                time.sleep(0.2)
+                return iter_content(chunk_size)
+
+            response.iter_content = slow
+        return response
+
+    fake.get = change
+    file_name = str(tmp_path / "image.sif")
+    ApiConnection().download("http://registry/image", file_name)
+    with open(file_name, "rb") as filey:
+        assert filey.read() == content
+
+    # The download starts over, once the segments that were written stop
+    assert fake.requests[0]["Range"] == "bytes=0-999"
+    assert any(
+        headers.get("If-Range") not in [None, fake.etag] for headers in fake.requests
+    )
+    partials = os.listdir(str(tmp_path / "sregistry-partial"))
+    assert [name for name in partials if name.endswith(".json")] == []
+
+
+def test_download_concurrent(tmp_path, registry):
+    print("Testing workers.tasks.download of one blob by two pulls at once")
+    from sregistry.main.workers.tasks import download
+
+    content = os.urandom(200000)
+    digest = get_digest(content)
+    registry(content)
+
+    names = [str(tmp_path / ("layer%s" % i)) for i in range(2)]
+    threads = [
+        threading.Thread(
+            target=download,
+            args=("http://registry/blob", name),
+            kwargs={"digest": digest},
+        )
+        for name in names
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for name in names:
+        with open(name, "rb") as filey:
+            assert filey.read() == content
+    assert os.listdir(str(tmp_path / "sregistry-partial")) == []
+
+
+def test_lock_partial(tmp_path):
+    print("Testing base.ranges.lock_partial removed while another pull waits")
+    import time
+    from sregistry.main.base.ranges import lock_partial
+
+    partial_file = str(tmp_path / "layer.partial")
+    lock_file = "%s.lock" % partial_file
+    with open(partial_file, "wb") as filey:
+        filey.write(b"partial")
+
+    # The waiting pull finds the lock file it opened removed, and locks a new one
+    locked = []
+
+    def wait():
+        with lock_partial(partial_file) as lock:
+            locked.append(os.path.samestat(os.fstat(lock.fileno()), os.stat(lock_file)))
+
+    with lock_partial(partial_file):
+        waiter = threading.Thread(target=wait)
+        waiter.start()
+        time.sleep(0.2)
+        assert locked == []
+        os.remove(partial_file)
+    waiter.join()
+    assert locked == [True]
+    assert not os.path.exists(lock_file)
+
+
+def test_download_cached_quarantine(tmp_path, registry, monkeypatch):
+    print("Testing workers.tasks.download_task with a corrupt cached layer")
+    import sregistry.main.workers.blobs
+    from sregistry.main.workers import BlobStore
+    from sregistry.main.workers.tasks import download_task
+
+    monkeypatch.setattr(
+        sregistry.main.workers.blobs, "SREGISTRY_BLOBS", str(tmp_path / "blobs")
+    )
+    content = os.urandom(5000)
+    digest = get_digest(content)
+    fake = registry(content)
+
+    # A cached layer that matches its digest is used without a request
+    destination = str(tmp_path / "layer.tar.gz")
+    with open(destination, "wb") as filey:
+        filey.write(content)
+    download_task("http://registry/blob", {}, destination, digest=digest)
+    assert fake.requests == []
+
+    # A cached layer that doesn't is quarantined, and downloaded again
+    with open(destination, "wb") as filey:
+        filey.write(content[:2500])
+    download_task("http://registry/blob", {}, destination, digest=digest)
+    with open(destination, "rb") as filey:
+        assert filey.read() == content
+    assert len(fake.requests) == 1
+
+    quarantine = os.listdir(BlobStore().quarantine_dir)
+    assert len(quarantine) == 1 and quarantine[0].startswith(digest[7:])
@@ -0,0 +1,179 @@
+#!/usr/bin/python
+
+# Copyright (C) 2017-2021 Vanessa Sochat.
+
+# This Source Code Form is subject to the terms of the
+# Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import hashlib
+import importlib
+import os
+import pytest
+
+dropbox = pytest.importorskip("dropbox")
+
+
+def test_dropbox_chunks():
+    print("Testing dropbox.push.get_chunk_size and get_content_hash")
+    from sregistry.main.dropbox.push import (
+        get_block_hashes,
+        get_chunk_size,
+        get_content_hash,
+    )
+
+    # Chunks adapt to the image, in multiples of 4MB
+    assert get_chunk_size(1 << 20, 4) == 16 << 20
+    assert get_chunk_size(1 << 30, 4) == 64 << 20
+    assert get_chunk_size(1 << 40, 4) == 128 << 20
+    assert get_chunk_size(1 << 30, 4, chunk_size=5 << 20) == 8 << 20
+
+    # The content hash of chunks is the hash of the blocks of the file
+    data = b"x" * ((8 << 20) + 3)
+    blocks = [get_block_hashes(data[: 4 << 20]), get_block_hashes(data[4 << 20 :])]
+    assert len(blocks[1]) == 2
+    expected = hashlib.sha256(
+        hashlib.sha256(data[: 4 << 20]).digest() * 2
+        + hashlib.sha256(data[8 << 20 :]).digest()
+    )
+    assert get_content_hash(blocks) == expected.hexdigest()
+    assert get_content_hash([[]]) == hashlib.sha256().hexdigest()
+
+
+def test_dropbox_content_hash():
+    print("Testing dropbox.push.get_content_hash against known hashes")
+    from sregistry.main.dropbox.push import get_block_hashes, get_content_hash
+
+    # An empty file, and a file of a block and 256 bytes
+    assert get_content_hash([get_block_hashes(b"")]) == (
+        "e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855"
+    )
+    data = bytes(range(256)) * 16385
+    assert get_content_hash([get_block_hashes(data)]) == (
+        "3e51b74a6c6698343abcbf98670fffdc3fc0db4fd04b591a13f01724c7ae3f08"
+    )
+
+
+class Session:
+    """the upload session routes of the Dropbox sdk, where the first append
+    at each offset is written, but times out before it returns.
+    """
+
+    def __init__(self, correct_offset=None):
+        self.parts = {}
+        self.correct_offset = correct_offset
+
+    def files_upload_session_append_v2(self, data, cursor, close=False):
+        import requests
+
+        if cursor.offset not in self.parts:
+            self.parts[cursor.offset] = bytes(data)
+            raise requests.exceptions.Timeout("timed out")
+
+        # The session is past the chunk (or where correct_offset says)
+        correct_offset = self.correct_offset
+        if correct_offset is None:
+            correct_offset = cursor.offset + len(data)
+        error = dropbox.files.UploadSessionAppendError.incorrect_offset(
+            dropbox.files.UploadSessionOffsetError(correct_offset=correct_offset)
+        )
+        raise dropbox.exceptions.ApiError("request", error, None, None)
+
+
+def test_dropbox_push_chunk_appended(tmp_path, monkeypatch):
+    print("Testing dropbox.push.push_chunk retried after it was appended")
+    from types import SimpleNamespace
+
+    push_module = importlib.import_module("sregistry.main.dropbox.push")
+    monkeypatch.setattr(push_module.time, "sleep", lambda seconds: None)
+
+    content = os.urandom(3000)
+    image = str(tmp_path / "image.sif")
+    with open(image, "wb") as filey:
+        filey.write(content)
+
+    # The retry finds the session past the chunk, so the chunk is done
+    client = SimpleNamespace(dbx=Session())
+    hashes = push_module.push_chunk(client, image, "session", 1000, 1000)
+    assert hashes == [hashlib.sha256(content[1000:2000]).digest()]
+    assert client.dbx.parts == {1000: content[1000:2000]}
+
+    # A session that isn't past the chunk is an error
+    client = SimpleNamespace(dbx=Session(correct_offset=1000))
+    with pytest.raises(dropbox.exceptions.ApiError):
+        push_module.push_chunk(client, image, "session", 1000, 1000)
+
+    # In a concurrent session, an incorrect offset is an error
+    client = SimpleNamespace(dbx=Session())
+    with pytest.raises(dropbox.exceptions.ApiError):
+        push_module.push_chunk(client, image, "session", 1000, 1000, concurrent=True)
+
+
+class ConcurrentSession:
+    """the concurrent upload session routes of the Dropbox sdk, where the
+    first chunk is the slowest to append, and a closed session rejects
+    the appends that come after the close.
+    """
+
+    def __init__(self):
+        import threading
+
+        self.lock = threading.Lock()
+        self.parts = {}
+        self.closed = False
+
+    def files_upload_session_start(self, data, session_type=None):
+        from types import SimpleNamespace
+
+        return SimpleNamespace(session_id="session")
+
+    def files_upload_session_append_v2(self, data, cursor, close=False):
+        import time
+
+        if cursor.offset == 0:
+            time.sleep(0.2)
+        with self.lock:
+            if self.closed:
+                error = dropbox.files.UploadSessionAppendError.closed
+                raise dropbox.exceptions.ApiError("request", error, None, None)
+            self.parts[cursor.offset] = bytes(data)
+            self.closed = close
+
+    def files_upload_session_finish(self, data, cursor, commit):
+        from types import SimpleNamespace
+
+        return SimpleNamespace(path_display=commit.path)
+
+
+def test_dropbox_push_chunks_close(tmp_path):
+    print("Testing dropbox.push.push_chunks closes the session last")
+    from functools import partial
+    from types import SimpleNamespace
+
+    push_module = importlib.import_module("sregistry.main.dropbox.push")
+    if getattr(dropbox.files, "UploadSessionType", None) is None:
+        pytest.skip("the Dropbox sdk has no concurrent upload sessions")
+
+    content = os.urandom(4000)
+    image = str(tmp_path / "image.sif")
+    with open(image, "wb") as filey:
+        filey.write(content)
+
+    # The close waits for the first chunk, which finishes after the others
+    client = SimpleNamespace(dbx=ConcurrentSession())
+    client._push_chunk = partial(push_module.push_chunk, client)
+    progress = push_module._Progress(len(content))
+    metadata, content_hash = push_module.push_chunks(
+        client, image, "/image.sif", 1000, 4, progress
+    )
+    assert metadata.path_display == "/image.sif"
+    assert (
+        b"".join(client.dbx.parts[offset] for offset in sorted(client.dbx.parts))
+        == content
+    )
+    assert content_hash == push_module.get_content_hash(
+        [
+            push_module.get_block_hashes(content[offset : offset + 1000])
+            for offset in range(0, 4000, 1000)
+        ]
+    )
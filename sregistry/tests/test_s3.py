@@ -0,0 +1,244 @@
+#!/usr/bin/python
+
+# Copyright (C) 2017-2021 Vanessa Sochat.
+
+# This Source Code Form is subject to the terms of the
+# Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import importlib
+import os
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+
+class Storage:
+    """the parts of the s3 client that push and pull use, with a bucket in
+    a mocked s3, and a table of file hashes in memory.
+    """
+
+    quiet = True
+
+    def __init__(self, settings=None):
+        from sregistry.main.s3.pull import pull
+        from sregistry.main.s3.push import push
+        from sregistry.main.s3.transfer import (
+            download_object,
+            get_object_metadata,
+            get_transfer_config,
+        )
+
+        self.s3 = boto3.resource("s3", region_name="us-east-1")
+        self.bucket = self.s3.Bucket("sregistry")
+        self.bucket.create()
+        self.settings = settings or {}
+        self.hashes = {}
+
+        self._download_object = download_object.__get__(self)
+        self._get_object_metadata = get_object_metadata.__get__(self)
+        self._get_transfer_config = get_transfer_config.__get__(self)
+        self.push = push.__get__(self)
+        self.pull = pull.__get__(self)
+
+    def _get_setting(self, name, default=None):
+        return self.settings.get(name, default)
+
+    def _get_and_update_setting(self, name, default=None):
+        return self.settings.get(name, default)
+
+    def get_image_hash(self, image_path, algorithm="sha256", compute=True):
+        return self.hashes.get(os.path.realpath(image_path))
+
+    def add_image_hash(self, image_path, digest, algorithm=None, stat=None):
+        self.hashes[os.path.realpath(image_path)] = digest.split(":")[-1]
+        return digest
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    import sregistry.main.base.catalog
+
+    monkeypatch.setattr(sregistry.main.base.catalog, "SREGISTRY_CATALOG", False)
+    for name in ["AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"]:
+        monkeypatch.setenv(name, "testing")
+    with moto.mock_aws():
+        yield Storage
+
+
+def test_s3_push(tmp_path, storage, monkeypatch):
+    print("Testing s3.push with one read of the image to hash it")
+    import hashlib
+
+    push_module = importlib.import_module("sregistry.main.s3.push")
+    reads = []
+
+    def get_file_hashes(path, *args, **kwargs):
+        reads.append(path)
+        return hashes(path, *args, **kwargs)
+
+    hashes = push_module.get_file_hashes
+    monkeypatch.setattr(push_module, "get_file_hashes", get_file_hashes)
+    warnings = []
+    monkeypatch.setattr(push_module.bot, "warning", warnings.append)
+
+    # A multipart upload, its ETag is checked with the hashes of the parts
+    client = storage({"SREGISTRY_S3_MULTIPART_CHUNKSIZE": str(5 << 20)})
+    content = os.urandom((11 << 20) + 7)
+    image = str(tmp_path / "image.sif")
+    with open(image, "wb") as filey:
+        filey.write(content)
+
+    client.push(image, "vanessa/pancakes:latest")
+    sha256 = hashlib.sha256(content).hexdigest()
+    metadata = client._get_object_metadata("vanessa/pancakes:latest.sif")
+    assert metadata["sha256"] == sha256
+    assert metadata["size"] == len(content)
+    assert client.hashes[image] == sha256
+    assert reads == [image]
+    assert warnings == []
+
+    # The hash is now known, an unchanged image isn't read again
+    client.push(image, "vanessa/pancakes:latest")
+    assert reads == [image]
+
+
+def test_s3_pull_unchanged(tmp_path, storage):
+    print("Testing s3.pull of an unchanged image to a file name")
+    from types import SimpleNamespace
+
+    client = storage()
+    image = str(tmp_path / "image.sif")
+    with open(image, "wb") as filey:
+        filey.write(os.urandom(1000))
+    client.push(image, "vanessa/pancakes:latest")
+
+    # The image in storage is linked to the file name, without a download
+    client.get = lambda uri, quiet=False: SimpleNamespace(image=image)
+    file_name = str(tmp_path / "pancakes.sif")
+    assert client.pull("vanessa/pancakes:latest", file_name=file_name) == file_name
+    assert os.path.samefile(file_name, image)
+
+    # Without a file name, the image in storage is returned
+    assert client.pull("vanessa/pancakes:latest") == image
+
+
+def test_s3_pull_verified(tmp_path, storage):
+    print("Testing s3.pull checks the sha256 of the image as it's written")
+    client = storage()
+    content = os.urandom(3000)
+    image = str(tmp_path / "image.sif")
+    with open(image, "wb") as filey:
+        filey.write(content)
+    client.push(image, "vanessa/pancakes:latest")
+    metadata = client._get_object_metadata("vanessa/pancakes:latest.sif")
+
+    file_name = str(tmp_path / "pancakes.sif")
+    assert client.pull("vanessa/pancakes:latest", file_name, save=False) == file_name
+    with open(file_name, "rb") as filey:
+        assert filey.read() == content
+    assert client.hashes[file_name] == metadata["sha256"]
+
+    # Content that doesn't match its sha256 is removed
+    metadata.pop("size")
+    client.bucket.put_object(
+        Key="vanessa/pancakes:latest.sif", Body=b"corrupt", Metadata=metadata
+    )
+    file_name = str(tmp_path / "corrupt.sif")
+    with pytest.raises(SystemExit):
+        client.pull("vanessa/pancakes:latest", file_name, save=False)
+    assert not os.path.exists(file_name)
+
+
+def test_s3_transfer_config():
+    print("Testing s3.transfer.get_transfer_config and TransferProgress")
+    from sregistry.main.s3.transfer import get_transfer_config, TransferProgress
+
+    class Client:
+        settings = {"SREGISTRY_S3_MULTIPART_CHUNKSIZE": str(16 << 20)}
+
+        def _get_setting(self, name, default=None):
+            return self.settings.get(name, default)
+
+    config = get_transfer_config(Client())
+    assert config.multipart_chunksize == 16 << 20
+    assert config.multipart_threshold == 16 << 20
+    assert config.max_concurrency == 10 and config.use_threads
+
+    Client.settings["SREGISTRY_S3_MAX_CONCURRENCY"] = "1"
+    assert not get_transfer_config(Client()).use_threads
+
+    progress = TransferProgress(3 << 20, hide=True)
+    for _ in range(12):
+        progress(1 << 18)
+    assert progress.transferred == 3 << 20 and progress.shown == 3
+
+
+def test_s3_list_objects():
+    print("Testing s3.query.list_objects in pages")
+    from datetime import datetime
+    from types import SimpleNamespace
+    from sregistry.main.s3.catalog import list_images
+    from sregistry.main.s3.query import list_objects
+
+    keys = ["vanessa/pancakes:latest.sif", "vanessa/tacos:latest.sif", "dino/a.sif"]
+    modified = datetime(2018, 12, 21)
+
+    class Paginator:
+        def paginate(self, Bucket, Prefix):
+            found = [key for key in keys if key.startswith(Prefix)]
+            for key in found:
+                yield {"Contents": [dict(Key=key, Size=3 << 20, LastModified=modified)]}
+
+    client = SimpleNamespace(get_paginator=lambda name: Paginator())
+    self = SimpleNamespace(
+        s3=SimpleNamespace(meta=SimpleNamespace(client=client)),
+        bucket=SimpleNamespace(name="bucket"),
+    )
+
+    # Without a catalog, the images are listed from the bucket
+    self._list_catalog = lambda prefix: []
+    self._list_images = lambda prefix="": list_images(self, prefix)
+    assert len(list_objects(self)) == 3
+    assert list_objects(self, prefix="vanessa/")[0] == [
+        "vanessa/pancakes:latest.sif",
+        "12-21-2018",
+        "3MB",
+    ]
+
+
+@pytest.mark.parametrize("rejected", ["ParamValidationError", "NotImplemented"])
+def test_s3_create_catalog(rejected):
+    print("Testing s3.catalog.create_catalog without If-None-Match")
+    from types import SimpleNamespace
+    import botocore
+    from sregistry.main.s3.catalog import create_catalog
+
+    objects = {}
+
+    def put_object(Bucket, Key, Body, ContentType, **kwargs):
+        if "IfNoneMatch" in kwargs:
+            if rejected == "ParamValidationError":
+                raise botocore.exceptions.ParamValidationError(report="IfNoneMatch")
+            error = {"Error": {"Code": rejected}}
+            raise botocore.exceptions.ClientError(error, "PutObject")
+        objects[Key] = Body
+
+    def head_object(Bucket, Key):
+        if Key not in objects:
+            error = {"Error": {"Code": "404"}}
+            raise botocore.exceptions.ClientError(error, "HeadObject")
+        return {"ContentLength": len(objects[Key])}
+
+    client = SimpleNamespace(put_object=put_object, head_object=head_object)
+    self = SimpleNamespace(
+        s3=SimpleNamespace(meta=SimpleNamespace(client=client)),
+        bucket=SimpleNamespace(name="bucket"),
+    )
+
+    # The object is created once, and then found with a head request
+    assert create_catalog(self, "catalog/1.json", "{}")
+    assert objects == {"catalog/1.json": b"{}"}
+    assert not create_catalog(self, "catalog/1.json", "[]")
+    assert objects == {"catalog/1.json": b"{}"}
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+
+# Copyright (C) 2017-2021 Vanessa Sochat.
+
+# This Source Code Form is subject to the terms of the
+# Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Handler(BaseHTTPRequestHandler):
+    """answer every request with a small body, keeping the connection open"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def session(monkeypatch):
+    """a new session for the test, that isn't shared with other tests"""
+    import sregistry.main.base.session as session
+
+    monkeypatch.setattr(session, "_session", None)
+    monkeypatch.setattr(session, "_session_pid", None)
+    return session
+
+
+def test_get_session(session):
+    print("Testing base.session.get_session by threads and processes")
+    from sregistry.defaults import SREGISTRY_HTTP_POOLS, SREGISTRY_HTTP_POOLSIZE
+
+    # Threads of a process share one session
+    sessions = []
+    threads = [
+        threading.Thread(target=lambda: sessions.append(session.get_session()))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(id(x) for x in sessions)) == 1
+    adapter = sessions[0].get_adapter("https://registry")
+    assert adapter._pool_connections == SREGISTRY_HTTP_POOLS
+    assert adapter._pool_maxsize == SREGISTRY_HTTP_POOLSIZE
+
+    # A forked process (another pid) creates its own
+    session._session_pid = os.getpid() + 1
+    assert session.get_session() is not sessions[0]
+    assert session._session_pid == os.getpid()
+
+
+def test_get_session_stats(session):
+    print("Testing base.session.get_session_stats of requests to one host")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        assert session.get_session_stats()["requests"] == 0
+        url = "http://127.0.0.1:%s/v2/" % server.server_port
+        for _ in range(5):
+            assert session.get_session().get(url).content == b"ok"
+
+        # One connection is opened, and reused by the requests after it
+        assert session.get_session_stats() == {
+            "hosts": 1,
+            "connections": 1,
+            "requests": 5,
+            "reused": 4,
+        }
+    finally:
+        session.get_session().close()
+        server.shutdown()
+        server.server_close()
+        thread.join()
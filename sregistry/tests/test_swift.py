@@ -0,0 +1,177 @@
+#!/usr/bin/python
+
+# Copyright (C) 2017-2021 Vanessa Sochat.
+
+# This Source Code Form is subject to the terms of the
+# Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import hashlib
+import importlib
+import json
+import os
+import threading
+import pytest
+
+pytest.importorskip("swiftclient")
+
+
+class Connection:
+    """a swiftclient connection (the calls that push makes) to containers
+    in memory, shared by the connections of the segment threads.
+    """
+
+    def __init__(self, containers, slo=True):
+        self.containers = containers
+        self.slo = slo
+        self.puts = []
+        self.lock = threading.Lock()
+
+    def get_capabilities(self):
+        from swiftclient.exceptions import ClientException
+
+        if not self.slo:
+            raise ClientException("Capabilities not found")
+        return {"slo": {"max_manifest_segments": 1000}}
+
+    def get_container(self, container, prefix="", full_listing=False):
+        from swiftclient.exceptions import ClientException
+
+        if container not in self.containers:
+            raise ClientException("Container %s not found" % container)
+        listing = [
+            {"name": name, "bytes": len(content), "hash": get_md5(content)}
+            for name, content in sorted(self.containers[container].items())
+            if name.startswith(prefix)
+        ]
+        return {}, listing
+
+    def put_container(self, container):
+        self.containers.setdefault(container, {})
+
+    def put_object(self, container, name, contents=None, **kwargs):
+        if hasattr(contents, "read"):
+            content = b"".join(iter(lambda: contents.read(1 << 10), b""))
+        elif isinstance(contents, str):
+            content = contents.encode("utf-8")
+        else:
+            content = contents
+        with self.lock:
+            self.containers[container][name] = content
+            self.puts.append((container, name, kwargs))
+        return get_md5(content)
+
+    def delete_object(self, container, name):
+        del self.containers[container][name]
+
+    def close(self):
+        pass
+
+
+def get_md5(content):
+    return hashlib.md5(content).hexdigest()
+
+
+class Storage:
+    """the parts of the swift client that push uses"""
+
+    def __init__(self, conn):
+        from sregistry.main.swift import Client
+
+        self.conn = conn
+        for name in [
+            "push",
+            "_push_segments",
+            "_push_segment",
+            "_remove_segments",
+            "_get_or_create_collection",
+            "_get_collection",
+        ]:
+            setattr(self, name, getattr(Client, name).__get__(self))
+
+    def _get_connection(self):
+        return self.conn
+
+
+@pytest.fixture
+def push_module(monkeypatch):
+    import sregistry.main.base.catalog
+
+    monkeypatch.setattr(sregistry.main.base.catalog, "SREGISTRY_CATALOG", False)
+    push_module = importlib.import_module("sregistry.main.swift.push")
+    monkeypatch.setattr(push_module, "SREGISTRY_SWIFT_SEGMENT_SIZE", 1000)
+    monkeypatch.setattr(push_module, "SREGISTRY_SWIFT_SEGMENTS", 3)
+    return push_module
+
+
+@pytest.mark.parametrize("slo", [True, False])
+def test_swift_push_segments(tmp_path, push_module, slo):
+    print("Testing swift.push of a large image in segments, slo %s" % slo)
+    content = os.urandom(3500)
+    image = str(tmp_path / "image.sif")
+    with open(image, "wb") as filey:
+        filey.write(content)
+
+    # Segments of an image that was pushed before
+    containers = {
+        "vanessa": {},
+        "vanessa_segments": {"pancakes:latest.sif/1/2/3/00000000": b"old"},
+    }
+    conn = Connection(containers, slo=slo)
+    client = Storage(conn)
+    client.push(image, "vanessa/pancakes:latest")
+
+    # The image is split into segments of (at most) the segment size
+    segments = containers["vanessa_segments"]
+    names = sorted(segments)
+    assert len(names) == 4
+    assert [len(segments[name]) for name in names] == [1000, 1000, 1000, 500]
+    assert b"".join(segments[name] for name in names) == content
+    prefix = names[0][:-8]
+    assert prefix.startswith("pancakes:latest.sif/")
+    assert prefix.endswith("/3500/1000/")
+
+    # The manifest is a list of the segments (slo), or their prefix (dlo)
+    manifest = containers["vanessa"]["pancakes:latest.sif"]
+    put = [kwargs for container, _, kwargs in conn.puts if container == "vanessa"][0]
+    if slo:
+        assert put["query_string"] == "multipart-manifest=put"
+        assert json.loads(manifest.decode("utf-8")) == [
+            {
+                "path": "/vanessa_segments/%s" % name,
+                "etag": get_md5(segments[name]),
+                "size_bytes": len(segments[name]),
+            }
+            for name in names
+        ]
+    else:
+        assert manifest == b""
+        assert put["headers"] == {"X-Object-Manifest": "vanessa_segments/%s" % prefix}
+
+    # A push that was interrupted only uploads the segments that are missing
+    del segments[names[2]]
+    conn.puts = []
+    client.push(image, "vanessa/pancakes:latest")
+    assert sorted(segments) == names
+    assert [name for container, name, _ in conn.puts] == [
+        names[2],
+        "pancakes:latest.sif",
+    ]
+
+
+def test_swift_push_small(tmp_path, push_module):
+    print("Testing swift.push of an image smaller than a segment")
+    content = os.urandom(500)
+    image = str(tmp_path / "image.sif")
+    with open(image, "wb") as filey:
+        filey.write(content)
+
+    # The segments of the image that was pushed before are removed
+    containers = {
+        "vanessa": {},
+        "vanessa_segments": {"pancakes:latest.sif/1/2/3/00000000": b"old"},
+    }
+    client = Storage(Connection(containers))
+    client.push(image, "vanessa/pancakes:latest")
+    assert containers["vanessa"]["pancakes:latest.sif"] == content
+    assert containers["vanessa_segments"] == {}
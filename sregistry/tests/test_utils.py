@@ -6,6 +6,7 @@
 # Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
 # with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import json
 import os
 import shutil
 import pytest
@@ -209,6 +210,349 @@ def test_read_tar(tmp_path):
     assert "hashtest.txt" in [os.path.basename(x) for x in os.listdir(dirname)]
 
 
+def create_layer(filename, members):
+    """create a layer (.tar.gz) from a list of (name, content) tuples, where
+    content is bytes (a file), None (a folder) or a string (a hard link)
+    """
+    import io
+    import tarfile
+
+    with tarfile.open(filename, "w:gz") as tar:
+        for name, content in members:
+            member = tarfile.TarInfo(name)
+            if content is None:
+                member.type = tarfile.DIRTYPE
+                member.mode = 0o755
+                tar.addfile(member)
+            elif isinstance(content, str):
+                member.type = tarfile.LNKTYPE
+                member.linkname = content
+                tar.addfile(member)
+            else:
+                member.size = len(content)
+                tar.addfile(member, io.BytesIO(content))
+    return filename
+
+
+def test_extract_layers(tmp_path):
+    print("Testing utils.extract_tar with whiteouts")
+    from sregistry.utils import extract_tar
+
+    sandbox = str(tmp_path / "sandbox")
+    os.mkdir(sandbox)
+    lower = create_layer(
+        str(tmp_path / "lower.tar.gz"),
+        [
+            ("etc", None),
+            ("etc/hosts", b"lower"),
+            ("etc/removed", b"lower"),
+            ("opt", None),
+            ("opt/old", b"lower"),
+            ("dev/null", b"device"),
+        ],
+    )
+    upper = create_layer(
+        str(tmp_path / "upper.tar.gz"),
+        [
+            ("etc/.wh.removed", b""),
+            ("opt/new", b"upper"),
+            ("opt/.wh..wh..opq", b""),
+            ("opt/link", "opt/new"),
+            ("../escaped", b"upper"),
+        ],
+    )
+    for layer in [lower, upper]:
+        result = extract_tar(layer, sandbox, handle_whiteout=True)
+        assert result["return_code"] == 0
+
+    assert os.path.exists(os.path.join(sandbox, "etc", "hosts"))
+    assert not os.path.exists(os.path.join(sandbox, "etc", "removed"))
+    assert not os.path.exists(os.path.join(sandbox, "etc", ".wh.removed"))
+    assert sorted(os.listdir(os.path.join(sandbox, "opt"))) == ["link", "new"]
+    assert os.stat(os.path.join(sandbox, "opt", "link")).st_nlink == 2
+    assert not os.path.exists(os.path.join(sandbox, "dev", "null"))
+    assert not os.path.exists(str(tmp_path / "escaped"))
+
+
+def test_extract_hard_link_outside(tmp_path):
+    print("Testing utils.extract_tar with a hard link through a symlink")
+    import tarfile
+    from sregistry.utils import extract_tar
+
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    (outside / "secret").write_bytes(b"secret")
+
+    # A symlink to a folder outside, and then a hard link through it
+    layer = str(tmp_path / "layer.tar")
+    with tarfile.open(layer, "w") as tar:
+        member = tarfile.TarInfo("evil")
+        member.type = tarfile.SYMTYPE
+        member.linkname = str(outside)
+        tar.addfile(member)
+        member = tarfile.TarInfo("stolen")
+        member.type = tarfile.LNKTYPE
+        member.linkname = "evil/secret"
+        tar.addfile(member)
+
+    sandbox = str(tmp_path / "sandbox")
+    os.mkdir(sandbox)
+    result = extract_tar(layer, sandbox, handle_whiteout=True)
+    assert result["return_code"] == 0
+    assert os.path.islink(os.path.join(sandbox, "evil"))
+    assert not os.path.lexists(os.path.join(sandbox, "stolen"))
+    assert os.stat(str(outside / "secret")).st_nlink == 1
+
+
+def test_extract_whiteout_outside(tmp_path):
+    print("Testing utils.extract_tar with whiteouts of the sandbox and above")
+    import tarfile
+    from sregistry.utils import extract_tar
+
+    outer = tmp_path / "outer"
+    outer.mkdir()
+    (outer / "precious").write_bytes(b"precious")
+    sandbox = outer / "sandbox"
+    sandbox.mkdir()
+    (sandbox / "kept").write_bytes(b"kept")
+
+    # Whiteouts of "..", "." and an empty name are skipped
+    layer = str(tmp_path / "layer.tar")
+    with tarfile.open(layer, "w") as tar:
+        for name in [".wh...", ".wh..", ".wh.", "etc/.wh..."]:
+            tar.addfile(tarfile.TarInfo(name))
+
+    result = extract_tar(layer, str(sandbox), handle_whiteout=True)
+    assert result["return_code"] == 0
+    assert (outer / "precious").read_bytes() == b"precious"
+    assert (sandbox / "kept").read_bytes() == b"kept"
+
+
+def test_extract_outside(tmp_path):
+    print("Testing utils.extract_tar with members that would leave the sandbox")
+    import io
+    import tarfile
+    from sregistry.utils import extract_tar
+
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    sandbox = tmp_path / "sandbox"
+    sandbox.mkdir()
+
+    # Absolute and .. members, and members below a symlink that leaves
+    layer = str(tmp_path / "layer.tar")
+    with tarfile.open(layer, "w") as tar:
+        member = tarfile.TarInfo("esc")
+        member.type = tarfile.SYMTYPE
+        member.linkname = str(outside)
+        tar.addfile(member)
+        for name in [
+            str(outside / "abs.txt"),
+            "../dotdot.txt",
+            "esc/../pwn.txt",
+            "esc/inside.txt",
+        ]:
+            member = tarfile.TarInfo(name)
+            member.size = 3
+            tar.addfile(member, io.BytesIO(b"pwn"))
+
+    result = extract_tar(layer, str(sandbox), handle_whiteout=True)
+    assert result["return_code"] == 0
+    assert os.listdir(str(outside)) == []
+    assert not os.path.exists(str(tmp_path / "dotdot.txt"))
+
+    # An absolute path (or one with ..) is extracted under the sandbox
+    assert (sandbox / str(outside / "abs.txt").lstrip("/")).read_bytes() == b"pwn"
+    assert (sandbox / "pwn.txt").read_bytes() == b"pwn"
+
+
+def test_extract_compressed_layers(tmp_path):
+    print("Testing utils.extract_tar with gzip layers")
+    import gzip
+    from sregistry.utils import extract_tar
+    from sregistry.utils.fileio import get_compression
+
+    layer = create_layer(
+        str(tmp_path / "layer.tar.gz"), [("a", None), ("a/one", b"one")]
+    )
+    assert get_compression(layer) == "gzip"
+    assert get_compression(layer, "application/vnd.oci.image.layer.v1.tar+zstd") == (
+        "zstd"
+    )
+
+    # A layer of more than one gzip member (e.g., concatenated)
+    with gzip.open(layer, "rb") as filey:
+        content = filey.read()
+    multi = str(tmp_path / "multi")
+    with open(multi, "wb") as filey:
+        filey.write(gzip.compress(content[:700]) + gzip.compress(content[700:]))
+
+    sandbox = str(tmp_path / "sandbox")
+    os.mkdir(sandbox)
+    media_type = "application/vnd.docker.image.rootfs.diff.tar.gzip"
+    result = extract_tar(multi, sandbox, handle_whiteout=True, media_type=media_type)
+    assert result["return_code"] == 0
+    with open(os.path.join(sandbox, "a", "one"), "rb") as filey:
+        assert filey.read() == b"one"
+
+    # A truncated layer is an error
+    with open(multi, "wb") as filey:
+        filey.write(gzip.compress(content)[:100])
+    result = extract_tar(multi, sandbox, handle_whiteout=True)
+    assert result["return_code"] == 1
+
+
+def read_layer(reader):
+    """read a layer opened with open_layer to the end, and close it"""
+    chunks = []
+    try:
+        for chunk in iter(lambda: reader.read(100000), b""):
+            chunks.append(chunk)
+    finally:
+        reader.close()
+    return b"".join(chunks)
+
+
+@pytest.mark.parametrize("reader", ["zlib", "threads", "pigz"])
+def test_open_layer_gzip(tmp_path, monkeypatch, reader):
+    print("Testing utils.fileio.open_layer of a gzip layer with %s" % reader)
+    import gzip
+    import tarfile
+    import sregistry.defaults
+    from sregistry.utils.fileio import open_layer
+
+    threads = 1 if reader == "zlib" else 4
+    monkeypatch.setattr(sregistry.defaults, "SREGISTRY_DECOMPRESS_THREADS", threads)
+
+    # pigz is a script that decompresses with gzip, in a process
+    pigz = None
+    if reader == "pigz":
+        pigz = str(tmp_path / "pigz")
+        with open(pigz, "w") as filey:
+            filey.write('#!/bin/sh\nexec gzip -dc "$4"\n')
+        os.chmod(pigz, 0o755)
+    which = shutil.which
+    monkeypatch.setattr(
+        shutil, "which", lambda name: pigz if name == "pigz" else which(name)
+    )
+
+    # More than one chunk of the readers, in two members
+    content = os.urandom(3 << 20)
+    layer = str(tmp_path / "layer.tar.gz")
+    with open(layer, "wb") as filey:
+        filey.write(
+            gzip.compress(content[: 1 << 20]) + gzip.compress(content[1 << 20 :])
+        )
+    opened = open_layer(layer)
+    if reader == "pigz":
+        assert opened.command[0] == pigz
+    assert read_layer(opened) == content
+
+    # A truncated layer is an error at the end of the stream
+    with open(layer, "wb") as filey:
+        filey.write(gzip.compress(content)[: 1 << 20])
+    with pytest.raises(tarfile.ReadError):
+        read_layer(open_layer(layer))
+
+
+@pytest.mark.parametrize("reader", ["module", "zstd"])
+def test_open_layer_zstd(tmp_path, monkeypatch, reader):
+    print("Testing utils.fileio.open_layer of a zstd layer with %s" % reader)
+    import subprocess
+    import tarfile
+    import sregistry.utils.fileio as fileio
+
+    zstd = shutil.which("zstd")
+    if zstd is None:
+        pytest.skip("zstd is not installed")
+
+    content = os.urandom(3 << 20)
+    source = str(tmp_path / "layer.tar")
+    with open(source, "wb") as filey:
+        filey.write(content)
+    layer = str(tmp_path / "layer.tar.zst")
+    subprocess.check_call([zstd, "-q", source, "-o", layer])
+    media_type = "application/vnd.oci.image.layer.v1.tar+zstd"
+
+    # The zstandard module (or compression.zstd), else the zstd binary
+    if reader == "module":
+        if fileio._open_zstd(layer) is None:
+            pytest.skip("zstandard is not installed")
+    else:
+        monkeypatch.setattr(fileio, "_open_zstd", lambda archive: None)
+    assert read_layer(fileio.open_layer(layer, media_type)) == content
+
+    # A layer of several frames is read across the frames
+    with open(layer, "rb") as filey:
+        data = filey.read()
+    with open(layer, "ab") as filey:
+        filey.write(data)
+    assert read_layer(fileio.open_layer(layer, media_type)) == content * 2
+    with open(layer, "wb") as filey:
+        filey.write(data)
+
+    # Closing the layer early stops the decompression
+    opened = fileio.open_layer(layer, media_type)
+    assert len(opened.read(1000)) > 0
+    opened.close()
+    if reader == "zstd":
+        assert opened.process.returncode is not None
+
+    # A truncated layer is an error at the end of the stream
+    with open(layer, "rb") as filey:
+        data = filey.read()
+    with open(layer, "wb") as filey:
+        filey.write(data[: len(data) // 2])
+    with pytest.raises(tarfile.ReadError):
+        read_layer(fileio.open_layer(layer, media_type))
+
+
+def test_select_manifest():
+    print("Testing docker.utils.select_manifest")
+    from sregistry.main.docker.utils import get_platform, select_manifest
+
+    index = {
+        "manifests": [
+            {"digest": "amd64", "platform": {"os": "linux", "architecture": "amd64"}},
+            {"digest": "unknown", "platform": {"os": "unknown"}},
+            {
+                "digest": "armv7",
+                "platform": {"os": "linux", "architecture": "arm", "variant": "v7"},
+            },
+            {"digest": "arm64", "platform": {"os": "linux", "architecture": "arm64"}},
+        ]
+    }
+    assert get_platform("linux/arm/v7") == ("linux", "arm", "v7")
+    assert select_manifest(index, "linux/arm64")["digest"] == "arm64"
+    assert select_manifest(index, "linux/arm")["digest"] == "armv7"
+    assert select_manifest(index, "linux/amd64")["digest"] == "amd64"
+    with pytest.raises(SystemExit):
+        select_manifest(index, "linux/s390x")
+
+
+def test_manifest_cache(tmp_path):
+    print("Testing base.manifests.ManifestCache")
+    from sregistry.main.base.manifests import ManifestCache
+
+    cache = ManifestCache(str(tmp_path), ttl=0)
+    tag = "https://registry/v2/library/ubuntu/manifests/latest"
+    pinned = "https://registry/v2/library/ubuntu/manifests/sha256:%s" % ("a" * 64)
+    assert cache.get(tag) is None
+
+    cache.add(tag, {"layers": []}, accept="v2", etag='"sha256:abc"')
+    cache.add(pinned, {"layers": []}, accept="v2")
+    assert cache.get(tag) is None
+    entry = cache.get(tag, accept="v2")
+    assert entry["manifest"] == {"layers": []}
+    assert entry["etag"] == '"sha256:abc"'
+
+    # A tag must be revalidated after the ttl, a digest never changes
+    assert not cache.is_fresh(entry)
+    assert cache.is_fresh(cache.get(pinned, accept="v2"))
+    cache.ttl = 300
+    assert cache.is_fresh(cache.touch(entry))
+
+
 def test_copyfile(tmp_path):
     print("Testing utils.copyfile")
     from sregistry.utils import copyfile, write_file
@@ -242,6 +586,17 @@ def test_get_tmpdir_tmpfile():
     os.remove(tmpfile)
 
 
+def test_get_partial_file(tmp_path):
+    print("Testing utils.get_partial_file")
+    from sregistry.utils import get_partial_file
+
+    partial = get_partial_file("sha256:abc", str(tmp_path))
+    assert os.path.dirname(partial) == str(tmp_path / "sregistry-partial")
+    assert not os.path.exists(partial)
+    assert get_partial_file("sha256:abc", str(tmp_path)) == partial
+    assert get_partial_file("sha256:def", str(tmp_path)) != partial
+
+
 def test_mkdir_p(tmp_path):
     print("Testing utils.mkdir_p")
     from sregistry.utils import mkdir_p
@@ -258,3 +613,279 @@ def test_print_json():
 
     result = print_json({1: 1})
     assert result == '{\n    "1": 1\n}'
+
+
+def test_read_images(tmp_path):
+    print("Testing client.pull.read_images")
+    from sregistry.client.pull import read_images
+    from sregistry.utils import write_file
+
+    filename = str(tmp_path / "images.txt")
+    write_file(filename, "# base images\nubuntu:18.04\n\n  centos:7  # os\n")
+    assert read_images(filename) == ["ubuntu:18.04", "centos:7"]
+
+
+def test_link_file(tmp_path):
+    print("Testing utils.link_file")
+    from sregistry.utils import link_file, write_file
+
+    source = str(tmp_path / "image.sif")
+    destination = str(tmp_path / "linked.sif")
+    write_file(source, "image")
+    write_file(destination, "old image")
+    assert link_file(source, destination) == destination
+    assert os.path.samefile(source, destination)
+    assert link_file(source, destination) == destination
+    assert os.path.exists(source)
+
+
+def test_database_migration(tmp_path):
+    print("Testing database.migrations.migrate")
+    pytest.importorskip("sqlalchemy")
+    from sqlalchemy import create_engine, text
+    from sregistry.database.migrations import SCHEMA_VERSION, migrate
+
+    engine = create_engine("sqlite:///%s" % (tmp_path / "sregistry.db"))
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE container (id INTEGER PRIMARY KEY, collection_id, "
+                "name, tag, version, uri, image, metrics)"
+            )
+        )
+        connection.execute(
+            text(
+                "INSERT INTO container (name, tag, uri, metrics) VALUES "
+                """('cuda', '11.8', 'nvidia/cuda:11.8', """
+                """'{"cuda": "11.8", "image_digest": "sha256:a"}')"""
+            )
+        )
+
+    migrate(engine)
+    migrate(engine)
+    with engine.connect() as connection:
+        version = connection.execute(text("PRAGMA user_version")).scalar()
+        indexes = connection.execute(text("PRAGMA index_list(container)")).fetchall()
+        labels = connection.execute(text("SELECT key, value FROM label")).fetchall()
+        row = connection.execute(
+            text("SELECT digest, metrics FROM container")
+        ).fetchone()
+    assert version == SCHEMA_VERSION
+    assert "ix_container_lookup" in [index[1] for index in indexes]
+    assert labels == [("cuda", "11.8")]
+
+    # The digest in the metrics (before it had a column) is moved
+    assert row[0] == "sha256:a"
+    assert json.loads(row[1]) == {"cuda": "11.8"}
+
+    # A database that is up to date isn't written, and can be read only
+    path = str(tmp_path / "sregistry.db")
+    readonly = create_engine("sqlite:///file:%s?mode=ro&uri=true" % path)
+    migrate(readonly)
+    with readonly.connect() as connection:
+        assert connection.execute(text("PRAGMA user_version")).scalar() == version
+
+
+def test_database_create(tmp_path):
+    print("Testing database.migrations.migrate of a new database, at once")
+    pytest.importorskip("sqlalchemy")
+    import threading
+    from sqlalchemy import create_engine, text
+    from sregistry.database.migrations import SCHEMA_VERSION, migrate
+    from sregistry.database.models import Base
+
+    # Many processes creating the database at once create the tables once
+    engines = [
+        create_engine(
+            "sqlite:///%s" % (tmp_path / "sregistry.db"),
+            connect_args={"timeout": 30},
+        )
+        for _ in range(4)
+    ]
+    errors = []
+
+    def create(engine):
+        try:
+            migrate(engine, Base.metadata)
+        except Exception as e:  # pylint: disable=broad-except
+            errors.append(e)
+
+    threads = [threading.Thread(target=create, args=(engine,)) for engine in engines]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+    with engines[0].connect() as connection:
+        version = connection.execute(text("PRAGMA user_version")).scalar()
+        tables = connection.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'table'")
+        ).fetchall()
+    assert version == SCHEMA_VERSION
+    assert {"collection", "container", "label", "file_hash"} <= {
+        table[0] for table in tables
+    }
+
+
+def test_search_match():
+    print("Testing database.search")
+    from sregistry.database.search import get_fields, get_labels, get_match
+
+    assert get_match() is None
+    assert get_match("nvidia/cuda :") == '"nvidia/cuda"*'
+    assert get_match('a"b cuda') == '"a""b"* AND "cuda"*'
+
+    metrics = {
+        "cuda": "11.8",
+        "version": 2,
+        "uri": "a/b",
+        "org.label-schema.build-arch": "arm64",
+    }
+    labels = get_labels(metrics)
+    assert labels == {"cuda": "11.8", "org.label-schema.build-arch": "arm64"}
+    assert get_fields(metrics)["architecture"] == "arm64"
+
+
+def test_image_hash(tmp_path):
+    print("Testing database.sqlite.get_image_hash")
+    pytest.importorskip("sqlalchemy")
+    from sregistry.database.models import init_db
+    from sregistry.database.sqlite import add_image_hash, get_image_hash
+    from sregistry.utils import get_file_hash, write_file
+
+    class Client:
+        pass
+
+    Client.add_image_hash = add_image_hash
+    Client.get_image_hash = get_image_hash
+    client = Client()
+    init_db(client, str(tmp_path / "sregistry.db"))
+
+    image = str(tmp_path / "image.sif")
+    write_file(image, "image")
+    digest = get_file_hash(image)
+    assert client.get_image_hash(image) == digest
+
+    # A known hash is used while the file is unchanged
+    moved = str(tmp_path / "moved.sif")
+    client.add_image_hash(image, "sha256:known")
+    os.rename(image, moved)
+    assert client.get_image_hash(moved) == "known"
+
+    write_file(moved, "changed")
+    assert client.get_image_hash(moved) == get_file_hash(moved)
+
+
+def test_database_add(tmp_path):
+    print("Testing database.sqlite.add of an image again")
+    pytest.importorskip("sqlalchemy")
+    import sregistry.database as database
+    from sregistry.database.models import init_db
+    from sregistry.main.base.settings import get_storage_name
+    from sregistry.utils import write_file
+
+    class Client:
+        client_name = "docker"
+
+    for name in [
+        "add",
+        "get_collection",
+        "get_container",
+        "get_image_hash",
+        "get_or_create_collection",
+    ]:
+        setattr(Client, name, getattr(database, name))
+    Client._get_storage_name = get_storage_name
+    client = Client()
+    init_db(client, str(tmp_path / "sregistry.db"))
+    client.storage = str(tmp_path / "storage")
+
+    # The labels that inspect finds in each image
+    inspected = [{"cuda": "11.8", "maintainer": "dinosaur"}, {"cuda": "12.1"}]
+    client.get_metadata = lambda image, names=None: dict(names, **inspected.pop(0))
+
+    for content in ["image", "rebuilt"]:
+        image = str(tmp_path / "image.sif")
+        write_file(image, content)
+        container = client.add(
+            image_path=image, image_uri="nvidia/cuda:latest@1", digest="sha256:a"
+        )
+
+    # The metadata of the image file is added to what we had
+    metrics = json.loads(container.metrics)
+    assert metrics["cuda"] == "12.1" and metrics["maintainer"] == "dinosaur"
+    labels = dict((label.key, label.value) for label in container.labels)
+    assert labels == {"cuda": "12.1", "maintainer": "dinosaur"}
+    assert container.digest == "sha256:a"
+    assert container.size == len("rebuilt")
+
+
+def test_database_images(tmp_path):
+    print("Testing database.sqlite.images with a query inside a word")
+    pytest.importorskip("sqlalchemy")
+    import sregistry.database as database
+    from sregistry.database import search
+    from sregistry.database.models import init_db
+
+    class Client:
+        client_name = "docker"
+
+    for name in [
+        "add",
+        "get_collection",
+        "get_container",
+        "get_or_create_collection",
+        "images",
+        "search_images",
+    ]:
+        setattr(Client, name, getattr(database, name))
+    client = Client()
+    init_db(client, str(tmp_path / "sregistry.db"))
+    client.get_metadata = lambda image, names=None: dict(names)
+
+    for uri in ["library/busybox:latest@1", "library/boxer:latest@2"]:
+        client.add(image_uri=uri, save=False)
+
+    # A word of the full text index ranks first, then names that contain it
+    found = [container.name for container in client.images("box")]
+    if search.enabled:
+        assert found == ["boxer", "busybox"]
+    assert sorted(found) == ["boxer", "busybox"]
+    assert [container.name for container in client.images("sybo")] == ["busybox"]
+
+
+def test_get_file_hashes(tmp_path):
+    print("Testing utils.get_file_hashes")
+    import hashlib
+    from sregistry.utils import get_file_hashes, get_file_hashes_background
+
+    content = os.urandom((11 << 20) + 7)
+    image = str(tmp_path / "image.sif")
+    with open(image, "wb") as filey:
+        filey.write(content)
+
+    parts = [
+        hashlib.md5(content[i : i + (5 << 20)]).digest()
+        for i in range(0, len(content), 5 << 20)
+    ]
+    etag = "%s-3" % hashlib.md5(b"".join(parts)).hexdigest()
+
+    digests = get_file_hashes(image, ["sha256", "md5"], part_size=5 << 20)
+    assert digests["sha256"] == hashlib.sha256(content).hexdigest()
+    assert digests["md5"] == hashlib.md5(content).hexdigest()
+    assert digests["etag"] == etag
+
+    # A file under the threshold is uploaded in one request
+    digests = get_file_hashes_background(image, ["md5"], 5 << 20, 16 << 20).result()
+    assert digests["etag"] == digests["md5"]
+
+
+def test_get_segments():
+    print("Testing utils.get_segments")
+    from sregistry.utils import get_segments
+
+    assert get_segments(10, 4) == [(0, 4), (4, 4), (8, 2)]
+    assert get_segments(8, 4) == [(0, 4), (4, 4)]
+    assert get_segments(3, 4) == [(0, 3)]
+    assert get_segments(0, 4) == [(0, 0)]
@@ -0,0 +1,79 @@
+#!/usr/bin/python
+
+# Copyright (C) 2017-2021 Vanessa Sochat.
+
+# This Source Code Form is subject to the terms of the
+# Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import threading
+import time
+import pytest
+
+
+def wait_task(index, seconds):
+    if index == 0 and seconds < 0:
+        raise ValueError("task %s failed" % index)
+    time.sleep(abs(seconds) * (index % 3))
+    return index
+
+
+def test_run_threads():
+    print("Testing workers.Workers.run with thread engine")
+    from sregistry.main.workers import Workers
+
+    workers = Workers(workers=4, engine="thread")
+
+    # Each result is passed through func2, as soon as it is ready
+    tasks = [(index, 0.05) for index in range(8)]
+    assert sorted(workers.run(wait_task, tasks)) == list(range(8))
+    assert sorted(workers.run(wait_task, tasks, func2=lambda x: x * 10)) == [
+        index * 10 for index in range(8)
+    ]
+
+    # A task that fails stops the rest, without waiting for them
+    release = threading.Event()
+    started = []
+
+    def task(index):
+        started.append(index)
+        if index == 0:
+            raise ValueError("task %s failed" % index)
+        release.wait()
+        return index
+
+    assert workers.run(task, [(index,) for index in range(40)]) == []
+    release.set()
+    time.sleep(0.2)
+
+    # Only the worker of the task that failed is free to start another
+    assert len(started) <= 5
+
+
+@pytest.mark.parametrize("engine", ["thread", "process"])
+def test_run_ordered(engine):
+    print("Testing workers.Workers.run_ordered with %s engine" % engine)
+    from sregistry.main.workers import Workers
+
+    workers = Workers(workers=4, engine=engine)
+    applied = []
+
+    def apply(result):
+        applied.append(result)
+        return result * 10
+
+    # Results are applied in the order of the tasks, not as they finish
+    tasks = [(index, 0.05) for index in range(8)]
+    assert workers.run_ordered(wait_task, tasks, apply) == [
+        index * 10 for index in range(8)
+    ]
+    assert applied == list(range(8))
+
+    # A task that fails stops the rest, without waiting for them, and exits
+    applied = []
+    tasks = [(index, -0.2) for index in range(40)]
+    start = time.time()
+    with pytest.raises(SystemExit):
+        workers.run_ordered(wait_task, tasks, apply)
+    assert time.time() - start < 2
+    assert applied == []
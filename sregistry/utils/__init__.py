@@ -13,8 +13,13 @@ from .fileio import (
     extract_tar,
     get_userhome,
     get_file_hash,
+    get_file_hashes,
+    get_file_hashes_background,
+    get_partial_file,
+    get_segments,
     get_tmpdir,
     get_tmpfile,
+    link_file,
     mkdir_p,
     print_json,
     read_file,
@@ -12,12 +12,25 @@ import hashlib
 import errno
 import os
 import pwd
+import queue
 import shutil
+import subprocess
+import tarfile
 import tempfile
+import threading
+import time
+import zlib
 
 import json
 from sregistry.logger import bot
 
+# Magic numbers at the start of compressed layers
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Bytes read at once to hash a file
+HASH_BUFFER_SIZE = 1 << 20
+
 
 ################################################################################
 ## FOLDER OPERATIONS ###########################################################
@@ -90,6 +103,25 @@ def get_tmpdir(requested_tmpdir=None, prefix="", create=True):
     return tmpdir
 
 
+def get_partial_file(key, requested_tmpdir=None):
+    """get a stable path for a partial download, named by a hash of a key
+    (e.g., the digest or url of the download) so that an interrupted
+    download can be found (and resumed) by the next attempt. Unlike
+    get_tmpfile, the file is not created.
+
+    Parameters
+    ==========
+    key: a unique key for the download, typically the digest or url
+    requested_tmpdir: an optional requested temporary directory, first
+    priority as is coming from calling function.
+    """
+    from sregistry.defaults import SREGISTRY_TMPDIR
+
+    tmpdir = os.path.join(requested_tmpdir or SREGISTRY_TMPDIR, "sregistry-partial")
+    mkdir_p(tmpdir)
+    return os.path.join(tmpdir, hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+
 def get_userhome():
     """get the user home based on the effective uid"""
     return pwd.getpwuid(os.getuid())[5]
@@ -100,21 +132,22 @@ def get_userhome():
 ################################################################################
 
 
-def extract_tar(archive, output_folder, handle_whiteout=False):
+def extract_tar(archive, output_folder, handle_whiteout=False, media_type=None):
     """extract a tar archive to a specified output folder
 
     Parameters
     ==========
     archive: the archive file to extract
     output_folder: the output folder to extract to
-    handle_whiteout: use docker2oci variation to handle whiteout files
+    handle_whiteout: apply the archive as an image layer, handling whiteouts
+    media_type: the media type of the layer (from the manifest), if known
 
     """
     from .terminal import run_command
 
     # Do we want to remove whiteout files?
     if handle_whiteout is True:
-        return _extract_tar(archive, output_folder)
+        return _extract_tar(archive, output_folder, media_type=media_type)
 
     # If extension is .tar.gz, use -xzf
     args = "-xf"
@@ -129,30 +162,484 @@ def extract_tar(archive, output_folder, handle_whiteout=False):
     return run_command(command)
 
 
-def _extract_tar(archive, output_folder):
-    """use blob2oci to handle whiteout files for extraction. Credit for this
-    script goes to docker2oci by Olivier Freyermouth, and see script
-    folder for license.
+def _extract_tar(archive, output_folder, media_type=None):
+    """apply an image layer (a tar archive) to a sandbox, handling whiteout
+    files as described by the OCI image spec. The archive is streamed (and
+    decompressed) once in process, so we don't need a tar binary or script:
+
+     - a whiteout file (.wh.<name>) removes <name> from lower layers
+     - an opaque whiteout (.wh..wh..opq) removes all content of its folder
+       from lower layers
+     - whiteouts never remove content added by the same layer
+     - device files, and anything under dev/, are not extracted
+     - hard links are linked to files that were extracted before them
+     - an absolute path is extracted relative to the sandbox, and a path
+       that leaves it (with .., or below a symlink that leaves) is skipped
+
+    The layer is decompressed by open_layer, alongside the extraction. The
+    result matches run_command, with a summary (and throughput) of the
+    extraction as the message.
 
     Parameters
     ==========
     archive: the archive to extract
     output_folder the output folder (sandbox) to extract to
+    media_type: the media type of the layer, to choose the decompression
 
     """
-    from .terminal import run_command, which
+    start = time.time()
+    try:
+        stream = open_layer(archive, media_type)
+        try:
+            with tarfile.open(fileobj=stream, mode="r|*") as tar:
+                files = _apply_layer(tar, output_folder)
+
+            # Read to the end (tar padding) to check the decompression
+            while stream.read(1 << 20):
+                pass
+        finally:
+            stream.close()
+    except (tarfile.TarError, EnvironmentError) as e:
+        return {"message": "Error extracting %s: %s" % (archive, e), "return_code": 1}
+
+    size = os.path.getsize(archive) / (1024.0 * 1024.0)
+    seconds = max(time.time() - start, 1e-6)
+    message = "Extracted %s: %s files, %.1f MB in %.2fs (%.1f MB/s)" % (
+        os.path.basename(archive),
+        files,
+        size,
+        seconds,
+        size / seconds,
+    )
+    if not bot.is_quiet():
+        print(message)
+    return {"message": message, "return_code": 0}
 
-    result = which("blob2oci")
-    if result["return_code"] != 0:
-        bot.exit("Cannot find blob2oci script on path, exiting.")
 
-    script = result["message"]
-    command = ["exec", script, "--layer", archive, "--extract", output_folder]
+def _apply_layer(tar, root):
+    """apply the members of an open tarfile (possibly a stream) to a root
+    folder, see _extract_tar. Returns the number of members extracted.
+    """
+    root = os.path.realpath(root)
+    created = set()
+    directories = []
+    safe_parents = {}
+    files = 0
+
+    # Our own checks replace the extraction filters of newer Pythons
+    kwargs = {}
+    if hasattr(tarfile, "fully_trusted_filter"):
+        kwargs["filter"] = "fully_trusted"
+    tar.copybufsize = 1 << 20
+
+    for member in tar:
+        name = _get_member_path(member.name)
+        if name is None:
+            bot.warning("Skipping unsafe path %s" % member.name)
+            continue
+
+        dirname, basename = os.path.split(name)
+        if name == "." or name.startswith("dev/"):
+            continue
+
+        if member.ischr() or member.isblk():
+            bot.debug("Skipping device %s" % name)
+            continue
+
+        if dirname not in safe_parents:
+            safe_parents[dirname] = _is_below(root, os.path.join(root, dirname))
+        if not safe_parents[dirname]:
+            bot.warning("Skipping %s, it is not below the sandbox" % name)
+            continue
+
+        # Opaque whiteout: remove lower content of the folder
+        if basename == ".wh..wh..opq":
+            _remove_lower(root, dirname, created)
+            safe_parents = {}
+            continue
+
+        # Explicit whiteout: remove the file or folder from lower layers
+        if basename.startswith(".wh."):
+            lower = os.path.join(dirname, basename[4:])
+            if basename[4:] in ["", ".", ".."] or "/" in basename[4:]:
+                bot.warning("Skipping whiteout %s of an unsafe name" % name)
+                continue
+
+            # The whiteout removes a link itself, so its folder is checked
+            path = os.path.join(root, lower)
+            if not _is_below(root, os.path.dirname(path)) or path == root:
+                bot.warning("Skipping whiteout %s, it is not below the sandbox" % name)
+                continue
+            if lower not in created:
+                _remove_path(path)
+                safe_parents = {}
+            continue
+
+        target = os.path.join(root, name)
+
+        # Overwrite anything but an existing folder (not a link) with a folder
+        if os.path.lexists(target):
+            if not (member.isdir() and _is_folder(target)):
+                _remove_path(target)
+        elif not os.path.isdir(os.path.join(root, dirname)):
+            os.makedirs(os.path.join(root, dirname))
+
+        if member.islnk():
+            # The source must be below the sandbox too (not through a symlink)
+            source = _get_member_path(member.linkname)
+            if source is not None:
+                source = os.path.join(root, source)
+            if (
+                source is None
+                or not os.path.lexists(source)
+                or not _is_below(root, os.path.dirname(source))
+            ):
+                bot.warning("Skipping hard link %s to %s" % (name, member.linkname))
+                continue
+            os.link(source, target, follow_symlinks=False)
+
+        # Folder attributes are set last, so a read only folder can be filled
+        elif member.isdir():
+            if not _is_folder(target):
+                os.mkdir(target, 0o700)
+            directories.append((member, target))
+
+        # Extract under the name that was checked, not the one in the tar
+        else:
+            member.name = name
+            tar.extract(member, root, set_attrs=not member.issym(), **kwargs)
+            if member.issym():
+                safe_parents = {}
+
+        created.add(name)
+        files += 1
+
+    for member, target in reversed(directories):
+        try:
+            if os.geteuid() == 0:
+                tar.chown(member, target, False)
+            tar.utime(member, target)
+            tar.chmod(member, target)
+        except tarfile.ExtractError as e:
+            bot.debug("Cannot set attributes of %s: %s" % (target, e))
+    return files
+
+
+def _get_member_path(name):
+    """return the normalized (relative) path of a tar member, or None if the
+    path would leave the folder that it is extracted to.
+    """
+    name = os.path.normpath(name.lstrip("/"))
+    if name == ".." or name.startswith("../"):
+        return None
+    return name
 
-    if not bot.is_quiet():
-        print("Extracting %s" % archive)
 
-    return run_command(command)
+def _is_below(root, path):
+    """determine if a path (following symlinks) is the root, or below it"""
+    path = os.path.realpath(path)
+    return path == root or path.startswith(root + os.sep)
+
+
+def _is_folder(path):
+    """determine if a path is a folder, and not a symlink to one"""
+    return os.path.isdir(path) and not os.path.islink(path)
+
+
+def _remove_path(path):
+    """remove a file, symlink or folder, if it exists"""
+    if _is_folder(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def _remove_lower(root, dirname, created):
+    """remove the content of a folder that comes from lower layers, keeping
+    what the current layer (created) added to it.
+    """
+    folder = os.path.join(root, dirname)
+    if not _is_folder(folder):
+        return
+    for name in os.listdir(folder):
+        path = os.path.join(dirname, name) if dirname else name
+        if path not in created:
+            _remove_path(os.path.join(root, path))
+        elif _is_folder(os.path.join(root, path)):
+            _remove_lower(root, path, created)
+
+
+def get_compression(archive, media_type=None):
+    """return the compression of a layer, "gzip", "zstd" or None. The media
+    type from the manifest (e.g., application/vnd.oci.image.layer.v1.tar+zstd
+    or application/vnd.docker.image.rootfs.diff.tar.gzip) is used if known,
+    and otherwise the magic number at the start of the archive.
+
+    Parameters
+    ==========
+    archive: the path to the layer
+    media_type: the media type of the layer, if known
+    """
+    media_type = media_type or ""
+    if media_type.endswith("zstd"):
+        return "zstd"
+    if media_type.endswith("gzip"):
+        return "gzip"
+    if media_type.endswith(".tar"):
+        return None
+
+    with open(archive, "rb") as filey:
+        magic = filey.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        return "gzip"
+    if magic == ZSTD_MAGIC:
+        return "zstd"
+    return None
+
+
+def open_layer(archive, media_type=None):
+    """open a layer as a file object that reads the uncompressed tar stream.
+    Decompression runs alongside the extraction (in a background thread, or
+    process) with up to SREGISTRY_DECOMPRESS_THREADS threads:
+
+     - gzip uses pigz if it's installed, and otherwise zlib
+     - zstd uses the zstandard module (pip install sregistry[zstd]), or
+       compression.zstd (Python 3.14+), or else the zstd binary
+
+    Reading the file object raises an error if the decompression failed,
+    and the caller should close it. An archive that isn't gzip or zstd is
+    returned as is.
+
+    Parameters
+    ==========
+    archive: the path to the layer
+    media_type: the media type of the layer, if known
+    """
+    from sregistry.defaults import SREGISTRY_DECOMPRESS_THREADS
+
+    threads = SREGISTRY_DECOMPRESS_THREADS
+    compression = get_compression(archive, media_type)
+
+    if compression == "gzip":
+        pigz = shutil.which("pigz")
+        if pigz is not None and threads > 1:
+            return _ProcessReader([pigz, "-dc", "-p", str(threads), archive])
+        return _ThreadedReader(_GzipReader(archive), threads > 1)
+
+    if compression == "zstd":
+        reader = _open_zstd(archive)
+        if reader is not None:
+            return _ThreadedReader(reader, threads > 1)
+        zstd = shutil.which("zstd")
+        if zstd is None:
+            raise tarfile.CompressionError(
+                "zstd layers need zstandard (pip install sregistry[zstd]) or zstd"
+            )
+        return _ProcessReader([zstd, "-dcq", archive])
+
+    return open(archive, "rb")
+
+
+def _open_zstd(archive):
+    """open a zstd archive with the zstandard module, or compression.zstd
+    (Python 3.14+), or return None if neither is available.
+    """
+    try:
+        import zstandard
+
+        return _ZstdReader(archive, zstandard.ZstdDecompressor())
+    except ImportError:
+        pass
+
+    try:
+        from compression import zstd
+
+        return zstd.open(archive, "rb")
+    except ImportError:
+        return None
+
+
+class _GzipReader(object):
+    """decompress a gzip file (of one or more members) in large chunks with
+    zlib, which checks the crc of each member.
+    """
+
+    def __init__(self, filename, size=1 << 20):
+        self.filename = filename
+        self.fileobj = open(filename, "rb")
+        self.size = size
+        self.pending = b""
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def read(self, size=-1):
+        """return the next chunk of decompressed data, or b"" at the end"""
+        while True:
+            if self.decompressor.eof:
+                data = self.decompressor.unused_data
+                if len(data) < len(GZIP_MAGIC):
+                    data += self.fileobj.read(self.size)
+
+                # The end of the file, or padding after the last member
+                if not data.startswith(GZIP_MAGIC):
+                    return b""
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                self.pending = data
+
+            if not self.pending:
+                self.pending = self.fileobj.read(self.size)
+                if not self.pending:
+                    raise EOFError("%s is truncated" % self.filename)
+
+            chunk = self.decompressor.decompress(self.pending, 4 * self.size)
+            self.pending = self.decompressor.unconsumed_tail
+            if chunk:
+                return chunk
+
+    def close(self):
+        self.fileobj.close()
+
+
+class _ZstdReader(object):
+    """decompress a zstd file (of one or more frames) in large chunks with
+    the zstandard module. A frame that isn't finished at the end of the
+    file is an error, as the stream reader of zstandard would return a
+    clean end of file for a truncated layer.
+    """
+
+    def __init__(self, filename, decompressor, size=1 << 20):
+        self.filename = filename
+        self.fileobj = open(filename, "rb")
+        self.size = size
+        self.decompressor = decompressor
+        self.decompressobj = decompressor.decompressobj()
+        self.started = False
+
+    def read(self, size=-1):
+        """return the next chunk of decompressed data, or b"" at the end"""
+        while True:
+            if self.decompressobj.eof:
+                data = self.decompressobj.unused_data
+                if len(data) < len(ZSTD_MAGIC):
+                    data += self.fileobj.read(self.size)
+                if not data:
+                    return b""
+                self.decompressobj = self.decompressor.decompressobj()
+            else:
+                data = self.fileobj.read(self.size)
+                if not data:
+                    if not self.started:
+                        return b""
+                    raise EOFError("%s is truncated" % self.filename)
+
+            self.started = True
+            chunk = self.decompressobj.decompress(data)
+            if chunk:
+                return chunk
+
+    def close(self):
+        self.fileobj.close()
+
+
+class _ThreadedReader(object):
+    """read a (decompressing) file object in chunks, in a background thread
+    if threaded is True, so that decompression (zlib and zstd release the
+    GIL) overlaps with writing the files of the layer.
+    """
+
+    def __init__(self, fileobj, threaded=True, size=1 << 20, depth=8):
+        self.fileobj = fileobj
+        self.size = size
+        self.chunk = b""
+        self.offset = 0
+        self.done = False
+        self.error = None
+        self.thread = None
+        self.closed = threading.Event()
+        self.queue = queue.Queue(depth)
+        if threaded:
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _run(self):
+        while not self.closed.is_set():
+            try:
+                chunk = self.fileobj.read(self.size)
+            except Exception as e:
+                self.error = e
+                chunk = b""
+            while not self.closed.is_set():
+                try:
+                    self.queue.put(chunk, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if not chunk:
+                return
+
+    def _next(self):
+        if self.thread is not None:
+            return self.queue.get()
+        try:
+            return self.fileobj.read(self.size)
+        except Exception as e:
+            self.error = e
+            return b""
+
+    def read(self, size=-1):
+        """read up to size bytes (at most one chunk) of the stream"""
+        if self.offset >= len(self.chunk):
+            if self.done:
+                return b""
+            self.chunk, self.offset = self._next(), 0
+            if not self.chunk:
+                self.done = True
+                if self.error is not None:
+                    raise tarfile.ReadError("Error decompressing: %s" % self.error)
+                return b""
+        end = len(self.chunk)
+        if size >= 0:
+            end = min(end, self.offset + size)
+        data = self.chunk[self.offset : end]
+        self.offset = end
+        return data
+
+    def close(self):
+        self.closed.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.fileobj.close()
+
+
+class _ProcessReader(object):
+    """read the output of a decompression command (e.g., pigz -dc) as a file
+    object. Reading the end of the output raises an error if the command
+    failed, and closing the reader early stops the command.
+    """
+
+    def __init__(self, command):
+        self.command = command
+        self.stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(
+            command, stdout=subprocess.PIPE, stderr=self.stderr, bufsize=1 << 20
+        )
+
+    def read(self, size=-1):
+        data = self.process.stdout.read(size)
+        if not data and size != 0 and self.process.wait() != 0:
+            self.stderr.seek(0)
+            error = self.stderr.read().decode("utf-8", "replace").strip()
+            raise tarfile.ReadError(
+                "%s failed: %s" % (os.path.basename(self.command[0]), error)
+            )
+        return data
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.stdout.close()
+        self.process.wait()
+        self.stderr.close()
 
 
 def get_file_hash(image_path, algorithm="sha256"):
@@ -162,18 +649,111 @@ def get_file_hash(image_path, algorithm="sha256"):
     Parameters
     ==========
     image_path: full path to the singularity image
+    algorithm: the hashlib algorithm, sha256 by default
 
     """
-    try:
-        hasher = getattr(hashlib, algorithm)()
-    except AttributeError:
-        bot.error("%s is an invalid algorithm.")
+    if algorithm not in hashlib.algorithms_available:
+        bot.error("%s is an invalid algorithm." % algorithm)
         bot.exit(" ".join(hashlib.algorithms_guaranteed))
+    return get_file_hashes(image_path, [algorithm])[algorithm]
 
-    with open(image_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hasher.update(chunk)
-    return hasher.hexdigest()
+
+def get_file_hashes(image_path, algorithms=None, part_size=None, threshold=None):
+    """return the hex digests of a file for one or more algorithms from one
+    read of the file, for a push that needs several (e.g., a sha256 version
+    and an md5 to check the upload). If a part_size is provided, the S3
+    ETag of the file ("etag") is added too: the md5 of a file smaller than
+    the threshold (uploaded in one request), otherwise the md5 of the md5
+    of each part, and the number of parts.
+
+    Parameters
+    ==========
+    image_path: full path to the file
+    algorithms: a list of hashlib algorithms, sha256 by default
+    part_size: the part size of a multipart upload, to add the etag
+    threshold: the size that uploads are multipart from (part_size default)
+    """
+    algorithms = algorithms or ["sha256"]
+    hashers = dict((algorithm, hashlib.new(algorithm)) for algorithm in algorithms)
+
+    # The md5 of each part of a multipart upload, for the etag
+    parts = []
+    multipart = False
+    if part_size is not None:
+        size = os.path.getsize(image_path)
+        part_size = get_part_size(size, part_size)
+        multipart = size >= (threshold or part_size)
+        if not multipart and "md5" not in hashers:
+            hashers["md5"] = hashlib.md5()
+    remaining = 0
+
+    # Read into one large buffer, images can be many gigabytes
+    buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(image_path, "rb", buffering=0) as f:
+        for size in iter(lambda: f.readinto(buffer), 0):
+            chunk = view[:size]
+            for hasher in hashers.values():
+                hasher.update(chunk)
+            while multipart and len(chunk) > 0:
+                if remaining == 0:
+                    parts.append(hashlib.md5())
+                    remaining = part_size
+                piece = chunk[:remaining]
+                parts[-1].update(piece)
+                remaining -= len(piece)
+                chunk = chunk[len(piece) :]
+
+    digests = dict((name, hasher.hexdigest()) for name, hasher in hashers.items())
+    if part_size is not None:
+        if multipart:
+            etag = hashlib.md5(b"".join(part.digest() for part in parts))
+            digests["etag"] = "%s-%s" % (etag.hexdigest(), len(parts))
+        else:
+            digests["etag"] = digests["md5"]
+    return dict(
+        (name, digests[name]) for name in algorithms + ["etag"] if name in digests
+    )
+
+
+def get_part_size(size, part_size):
+    """return the part size that a multipart upload of a file uses (the
+    same as boto3), at least 5 MiB, at most 5 GiB and at most 10000 parts.
+    """
+    part_size = min(max(part_size, 5 << 20), 5 << 30)
+    while (size + part_size - 1) // part_size > 10000:
+        part_size *= 2
+    return part_size
+
+
+def get_segments(size, segment_size):
+    """return the segments (offset and length) of a file of some size, for
+    an upload in parts. The last segment has the remainder, and an empty
+    file has one empty segment.
+    """
+    segment_size = max(segment_size, 1)
+    segments = [
+        (offset, min(segment_size, size - offset))
+        for offset in range(0, size, segment_size)
+    ]
+    return segments or [(0, 0)]
+
+
+def get_file_hashes_background(
+    image_path, algorithms=None, part_size=None, threshold=None
+):
+    """start get_file_hashes in a background thread, e.g., to hash a file
+    while it's uploaded (hashlib doesn't hold the GIL for large updates).
+    Returns a future, whose result() is the dictionary of digests.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(
+        get_file_hashes, image_path, algorithms, part_size, threshold
+    )
+    executor.shutdown(wait=False)
+    return future
 
 
 ################################################################################
@@ -195,6 +775,21 @@ def copyfile(source, destination, force=True):
     return destination
 
 
+def link_file(source, destination):
+    """create a hard link to a file at a destination (replacing it), or a
+    copy if a link can't be created (e.g., on another filesystem).
+    """
+    if os.path.exists(destination):
+        if os.path.samefile(source, destination):
+            return destination
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+    return destination
+
+
 def write_file(filename, content, mode="w"):
     """write_file will open a file, "filename" and write content, "content"
     and properly close the file
@@ -8,7 +8,7 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 """
 
-__version__ = "0.2.39"
+__version__ = "0.2.64"
 AUTHOR = "Vanessa Sochat"
 AUTHOR_EMAIL = "vsochat@stanford.edu"
 NAME = "sregistry"
@@ -83,6 +83,9 @@ INSTALL_BASIC_GOOGLE_COMPUTE = (
 
 INSTALL_BASIC_S3 = (("boto3", {"min_version": "1.7.83"}),)
 
+# Optional, to extract zstd compressed layers in process
+INSTALL_BASIC_ZSTD = (("zstandard", {"min_version": "0.18.0"}),)
+
 INSTALL_BASIC_ALL = (
     INSTALL_REQUIRES
     + INSTALL_BASIC_S3